@@ -12,6 +12,8 @@ sys.path.append('/'.join(os.path.dirname(os.path.abspath(__file__)).split('/')[:
 from genericgl import TestApplication
 from genericgl import RotatableCanvas
 from genericgl import info
+from genericgl import shaderProgram
+from genericgl import UniformCache
 
 import array
 
@@ -43,26 +45,18 @@ class TestCanvas(RotatableCanvas):
 
     def setupGL(self):
 
-        self.program = QOpenGLShaderProgram(self.context())
+        # Get a linked shader program from the shader cache. The sources are only compiled if
+        # neither this context nor the on-disk cache of program binaries has it already.
+        self.program = shaderProgram(self.context(), self.vertexShaderSource, self.fragmentShaderSource)
         info("PROGRAM",self.program)
 
-        # addShaderFromSourceCode() only returns a bool telling whether everything went well
-
-        if self.program.addShaderFromSourceCode(QOpenGLShader.Vertex, self.vertexShaderSource):
-            info("VERTEX SHADER","Managed to load and parse the vertex shader")
-
-        if self.program.addShaderFromSourceCode(QOpenGLShader.Fragment, self.fragmentShaderSource):
-            info("FRAGMENT SHADER","Managed to load and parse the fragment shader")
-
-        # Compile and bind the shader program to the current context
-        self.program.link()
+        # Bind the shader program to the current context
         self.program.bind()
 
-        # Find the uniform location for controling the viewport scale of the vertex positions
-        self.viewportScaling = self.program.uniformLocation("viewportScaling")
-
-        # Find the uniform location for controling the rotation of the object
-        self.objectRotation = self.program.uniformLocation("objectRotation")
+        # Uniforms are set through a uniform cache: viewportScaling for the viewport scale of
+        # the vertex positions and objectRotation for the rotation of the object. It finds the
+        # location of each uniform once, and only calls GL when a value has actually changed.
+        self.uniforms = UniformCache(self.program)
 
         # Use arrays to specify two different triangles. 
         self.vertices1 = array.array('f', [-0.5, -0.5, 0.0, 0.5, 0.5, 0.0, 0.5, -0.5, 0.0])
@@ -146,13 +140,12 @@ class TestCanvas(RotatableCanvas):
         # this program)
         self.program.bind()
 
-        # Set current rotation as a uniform
-        self.currentRotation = QVector3D(self.xRot / 16, self.yRot / 16, self.zRot / 16)
-        self.program.setUniformValue(self.objectRotation, self.currentRotation)
+        # Set current rotation as a uniform. The QVector3D is only created if it has changed.
+        self.uniforms.set("objectRotation", self.xRot / 16, self.yRot / 16, self.zRot / 16)
 
         # Before painting we set the scaling "uniform" parameter in the vertex shader.
         # This will be used to scale the vertex positions. 
-        self.program.setUniformValue(self.viewportScaling, self.currentScaling)
+        self.uniforms.set("viewportScaling", self.currentScaling)
  
         # Activate the first VAO
         self.triangleVAO1.bind()
@@ -194,13 +187,13 @@ class TestCanvas(RotatableCanvas):
         self.update()
 
     def closeGL(self):
-        # We need to explicitly destroy VAOs, VBOs and programs. Otherwise we'll get a 
-        # segfault or another similar crash.
+        # We need to explicitly destroy VAOs and VBOs. Otherwise we'll get a segfault or
+        # another similar crash. The program belongs to the shader cache, which lets go of it
+        # when the context is destroyed.
         self.triangleVAO1.destroy()
         self.verticesBuffer1.destroy()
         self.triangleVAO2.destroy()
         self.verticesBuffer2.destroy()
-        del self.program
 
 app = TestApplication(sys.argv, TestCanvas)
 app.exec_()
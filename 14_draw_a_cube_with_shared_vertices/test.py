@@ -13,6 +13,9 @@ sys.path.append('/'.join(os.path.dirname(os.path.abspath(__file__)).split('/')[:
 from genericgl import TestApplication
 from genericgl import RotatableCanvas
 from genericgl import info
+from genericgl import shaderProgram
+from genericgl import UniformCache
+from genericgl import IndexBuffer
 
 import array
 
@@ -44,26 +47,18 @@ class TestCanvas(RotatableCanvas):
 
     def setupGL(self):
 
-        self.program = QOpenGLShaderProgram(self.context())
+        # Get a linked shader program from the shader cache. The sources are only compiled if
+        # neither this context nor the on-disk cache of program binaries has it already.
+        self.program = shaderProgram(self.context(), self.vertexShaderSource, self.fragmentShaderSource)
         info("PROGRAM",self.program)
 
-        # addShaderFromSourceCode() only returns a bool telling whether everything went well
-
-        if self.program.addShaderFromSourceCode(QOpenGLShader.Vertex, self.vertexShaderSource):
-            info("VERTEX SHADER","Managed to load and parse the vertex shader")
-
-        if self.program.addShaderFromSourceCode(QOpenGLShader.Fragment, self.fragmentShaderSource):
-            info("FRAGMENT SHADER","Managed to load and parse the fragment shader")
-
-        # Compile and bind the shader program to the current context
-        self.program.link()
+        # Bind the shader program to the current context
         self.program.bind()
 
-        # Find the uniform location for controling the viewport scale of the vertex positions
-        self.viewportScaling = self.program.uniformLocation("viewportScaling")
-
-        # Find the uniform location for controling the rotation of the object
-        self.objectRotation = self.program.uniformLocation("objectRotation")
+        # Uniforms are set through a uniform cache: viewportScaling for the viewport scale of
+        # the vertex positions and objectRotation for the rotation of the object. It finds the
+        # location of each uniform once, and only calls GL when a value has actually changed.
+        self.uniforms = UniformCache(self.program)
 
         # Location and color for vertices. We specity vertices independently of
         # faces, so it does not matter in which order they occur. 
@@ -138,6 +133,12 @@ class TestCanvas(RotatableCanvas):
         # we now also specify that the color information starts at colorBytesOffset bytes into each vertex specification
         self.program.enableAttributeArray( self.program.attributeLocation("inputColor") )
         self.program.setAttributeBuffer( self.program.attributeLocation("inputColor"), self.gl.GL_FLOAT, self.colorBytesOffset, 4, self.vertexStride )
+
+        # Upload the indices to an index buffer while the VAO is bound, so that the VAO
+        # remembers it. Draws then only pass a byte offset into it, rather than the whole
+        # index array on every frame.
+        self.indexBuffer = IndexBuffer(self.indices)
+        self.indexBuffer.create()
         
         # Once we have set up everything related to the VBOs, we can release that and the 
         # related VAO.
@@ -158,20 +159,19 @@ class TestCanvas(RotatableCanvas):
         # this program)
         self.program.bind()
 
-        # Set current rotation as a uniform
-        self.currentRotation = QVector3D(self.xRot / 16, self.yRot / 16, self.zRot / 16)
-        self.program.setUniformValue(self.objectRotation, self.currentRotation)
+        # Set current rotation as a uniform. The QVector3D is only created if it has changed.
+        self.uniforms.set("objectRotation", self.xRot / 16, self.yRot / 16, self.zRot / 16)
 
         # Before painting we set the scaling "uniform" parameter in the vertex shader.
         # This will be used to scale the vertex positions. 
-        self.program.setUniformValue(self.viewportScaling, self.currentScaling)
+        self.uniforms.set("viewportScaling", self.currentScaling)
  
         # Activate the VAO
         self.cubeVAO.bind()
 
-        # Draw the VAO. It will remember which VBO was specified for it. Note the use
-        # of glDrawElements rather than glDrawArrays. 
-        self.gl.glDrawElements(self.gl.GL_QUADS, self.numberOfVertices, self.gl.GL_UNSIGNED_SHORT, self.indices)
+        # Draw the VAO. It will remember which VBO and index buffer were specified for it.
+        # Note the use of glDrawElements rather than glDrawArrays. 
+        self.indexBuffer.draw(self.gl, self.gl.GL_QUADS, 0, self.numberOfVertices)
 
         # Release the VAO
         self.cubeVAO.release()
@@ -198,11 +198,12 @@ class TestCanvas(RotatableCanvas):
         self.update()
 
     def closeGL(self):
-        # We need to explicitly destroy VAOs, VBOs and programs. Otherwise we'll get a 
-        # segfault or another similar crash.
+        # We need to explicitly destroy VAOs and VBOs. Otherwise we'll get a segfault or
+        # another similar crash. The program belongs to the shader cache, which lets go of it
+        # when the context is destroyed.
         self.cubeVAO.destroy()
         self.verticesBuffer.destroy()
-        del self.program
+        self.indexBuffer.destroy()
 
 app = TestApplication(sys.argv, TestCanvas)
 app.exec_()
@@ -13,22 +13,56 @@ sys.path.append('/'.join(os.path.dirname(os.path.abspath(__file__)).split('/')[:
 from genericgl import TestApplication
 from genericgl import RotatableCanvas
 from genericgl import info
-from genericgl import Wavefront
+from genericgl import shaderProgram
+from genericgl import UniformCache
+from genericgl import loadMeshFile
+from genericgl import Meshlets
+from genericgl import AssetLoader
+from genericgl import GpuMesh
+from genericgl import meshFileLayout
 from genericgl.testapplication import _TestApplication
 
 import array
 import json
+import numpy
 
 from PyQt5.QtWidgets import *
 from PyQt5.QtGui import *
 from PyQt5.QtCore import *
 
+def loadMeshWithMeshlets(objPath):
+
+    # Runs on a worker thread of the asset loader. Returns a tuple with the mesh file and
+    # a list with the meshlets of each of its chunks.
+
+    # The mesh is loaded from a memory mapped file, with vertex and index data already
+    # laid out the way they are going to be uploaded. The file is created from the obj
+    # on the first run.
+    meshFile = loadMeshFile(objPath, optimizeForVertexCache=True)
+
+    # Split the faces of each chunk into meshlets: small clusters of faces with a bounding
+    # sphere and a normal cone. When painting, clusters which face away from the viewer or
+    # are outside the view are skipped.
+    #
+    # Sorting the faces into meshlets undoes the vertex cache order of the mesh file, so the
+    # faces within each meshlet are ordered for the vertex cache again. Faces grouped by their
+    # normals share fewer vertices than the runs of faces in the mesh file do, though. For the
+    # base mesh, drawing the visible meshlets skips about a third of the faces, but transforms
+    # more vertices than drawing the whole mesh in the mesh file's order would.
+    meshlets = []
+    for chunk in meshFile.chunks:
+        firstVertex = int(chunk["vertexStart"])
+        positions = meshFile.vertices[firstVertex:firstVertex + int(chunk["vertexCount"]), 0:3]
+        indices = meshFile.indices[int(chunk["indexStart"]):int(chunk["indexStart"]) + int(chunk["indexCount"])]
+        meshlets.append(Meshlets(positions, indices, optimizeForVertexCache=True))
+
+    return (meshFile, meshlets)
+
+
 class TestCanvas(RotatableCanvas):
 
     def __init__(self):
 
-        self.suzanne = Wavefront("../objs/stripped_base_mesh.obj")
-
         with open("vertex.glsl","r") as f:
             self.vertexShaderSource = f.read()
 
@@ -50,111 +84,52 @@ class TestCanvas(RotatableCanvas):
         self.specularStrength = 0.1
         self.specularHardness = 6
 
-        super(TestCanvas,self).__init__()
-
-    def setupGL(self):
-
-        self.program = QOpenGLShaderProgram(self.context())
-        info("PROGRAM",self.program)
-
-        # addShaderFromSourceCode() only returns a bool telling whether everything went well
-
-        if self.program.addShaderFromSourceCode(QOpenGLShader.Vertex, self.vertexShaderSource):
-            info("VERTEX SHADER","Managed to load and parse the vertex shader")
-
-        if self.program.addShaderFromSourceCode(QOpenGLShader.Fragment, self.fragmentShaderSource):
-            info("FRAGMENT SHADER","Managed to load and parse the fragment shader")
-
-        # Compile and bind the shader program to the current context
-        self.program.link()
-        self.program.bind()
-
-        # Find the uniform location for controling the viewport scale of the vertex positions
-        self.viewportScaling = self.program.uniformLocation("viewportScaling")
+        # The mesh and its meshlets are set by assetLoaded() when they have been loaded, and
+        # uploaded to the GPU in the first paintGL() after that
+        self.suzanne = None
+        self.meshlets = None
+        self.suzanneMesh = None
 
-        # Find the uniform location for controling the rotation of the object
-        self.objectRotation = self.program.uniformLocation("objectRotation")
-
-        # Find light setting uniforms
-        self.diffuseStrengthUniform = self.program.uniformLocation("diffuseStrength")
-        self.ambientStrengthUniform = self.program.uniformLocation("ambientStrength")
-        self.specularStrengthUniform = self.program.uniformLocation("specularStrength")
-        self.specularHardnessUniform = self.program.uniformLocation("specularHardness")
-
-        # This returns a numpy array with the shape [ [XYZNNN] [XYZNNN] ... ]
-        self.vertices2d = self.suzanne.getVertexAndNormalArray()
-
-        # ... so we need to flatten it to an 1d array
-        self.vertices = self.suzanne.getVertexAndNormalArray().flatten()
-
-        # Number of elements in the flattened array
-        self.verticesLength = self.vertices.size
+        super(TestCanvas,self).__init__()
 
-        # Each vertex is specified with with six values (xyznnn)
-        self.arrayCellsPerVertex = 6
+        # Load the mesh on a worker thread, so that the window appears right away
+        self.loader = AssetLoader()
+        self.loader.loaded.connect(self.assetLoaded)
+        self.loader.failed.connect(self.assetFailed)
+        self.loader.load("suzanne", loadMeshWithMeshlets, "../objs/stripped_base_mesh.obj")
 
-        # Size in bytes for each vertex specification (self.vertices.itemsize is the size in bytes
-        # of a single array cell)
-        self.vertexSpecificationSize = self.vertices.itemsize * self.arrayCellsPerVertex
+    def assetLoaded(self, name, asset):
 
-        # In bytes, where in a vertex specification does the normal data start? (it starts after 
-        # x, y, z.. i.e after 3 array cells)
-        self.normalBytesOffset = self.vertices.itemsize * 3
+        # Called in the GUI thread when the loader is done with an asset
 
-        # How many bytes are there in between vertex location specifications
-        self.vertexStride = self.vertices.itemsize * self.arrayCellsPerVertex
+        if name == "suzanne":
+            (self.suzanne, self.meshlets) = asset
 
-        # What GL datatype should we tell the buffer that we're using? This is necessary, since it
-        # might be different on 32-bit and 64-bit machines
+        # Paint again, which uploads the data
+        self.update()
 
-        self.glDataType = None # let it crash if it isn't float or double
+    def assetFailed(self, name, exception):
 
-        if self.vertices.itemsize == 4:
-            self.glDataType = self.gl.GL_FLOAT
+        # Called in the GUI thread when the loader could not load an asset. Nothing can be
+        # drawn without it, so say so rather than leave the window empty.
+        QMessageBox.critical(self, "Unable to load " + name, str(exception))
 
-        if self.vertices.itemsize == 8:
-            self.glDataType = self.gl.GL_DOUBLE
+    def setupGL(self):
 
-        # Total size in bytes for entire array
-        self.verticesDataLength = self.vertices.nbytes
+        # Get a linked shader program from the shader cache. The sources are only compiled if
+        # neither this context nor the on-disk cache of program binaries has it already.
+        self.program = shaderProgram(self.context(), self.vertexShaderSource, self.fragmentShaderSource)
+        info("PROGRAM",self.program)
 
-        # 2d Array with vertex indices that make up faces
-        self.indices2d = self.suzanne.getFaceArray()
-        
-        # Flattened version suitable for drawElements
-        self.indices = self.indices2d.flatten().tolist()
+        # Bind the shader program to the current context
+        self.program.bind()
 
-        # Number of elements in the index array. 
-        self.numberOfVertices = self.indices2d.size
+        # Uniforms are set through a uniform cache: viewportScaling for the viewport scale of
+        # the vertex positions, objectRotation for the rotation of the object and the light
+        # settings. It finds the location of each uniform once, and only calls GL when a value
+        # has actually changed.
+        self.uniforms = UniformCache(self.program)
 
-        # Start specifying the Vertex Array Object (VAO). 
-        self.suzanneVAO = QOpenGLVertexArrayObject()
-        self.suzanneVAO.create()
-        self.suzanneVAO.bind()
- 
-        # Create a VBO for holding vertex info (both positions and normals)
-        self.verticesBuffer = QOpenGLBuffer(QOpenGLBuffer.VertexBuffer)
-        self.verticesBuffer.create()
-        self.verticesBuffer.bind()
-        self.verticesBuffer.setUsagePattern(QOpenGLBuffer.StaticDraw)
-        self.verticesBuffer.allocate(self.vertices.tobytes(), self.verticesDataLength)
-
-        # Here we specify that there is a program attribute that should get data that is sent
-        # to it (by glDraw* operations), and in what form the data will arrive. 
-        self.program.enableAttributeArray( self.program.attributeLocation("somePosition") )
-        self.program.setAttributeBuffer( self.program.attributeLocation("somePosition"), self.glDataType, 0, 3, self.vertexStride )
-        
-        # Say that the inputNormal attribute should be read from the same array, that it should take three values at a 
-        # time (the normal vector), and that they are of type GL_FLOAT. The same byte offset as for the position info is used, but
-        # we now also specify that the normal information starts at normalBytesOffset bytes into each vertex specification
-        self.program.enableAttributeArray( self.program.attributeLocation("inputNormal") )
-        self.program.setAttributeBuffer( self.program.attributeLocation("inputNormal"), self.glDataType, self.normalBytesOffset, 3, self.vertexStride )
-        
-        # Once we have set up everything related to the VBOs, we can release that and the 
-        # related VAO.
-        self.verticesBuffer.release()
-        self.suzanneVAO.release()
-     
         # Release the program until we need to actually draw something. 
         self.program.release()
 
@@ -162,39 +137,79 @@ class TestCanvas(RotatableCanvas):
 
         self.dumpGLLogMessages("setupGL()")
 
+    def uploadMesh(self):
+
+        # Create the VAO and buffers once the mesh has been loaded. Needs the context to be
+        # current, so this is called from paintGL().
+
+        # Create a mesh with a VAO, a VBO holding the vertices and an index buffer holding the
+        # indices. GpuMesh does what tests 13 and 14 did by hand: it creates and binds the VAO,
+        # uploads the buffers and points the program's attributes at the vertex data, following
+        # a layout which says where in a vertex each attribute is found. Here the layout comes
+        # from the mesh file ([ [XYZNNNTT] [XYZNNNTT] ... ]). The shader has no texture
+        # coordinate attribute, so those are left out of it. The VAO and buffer are bound
+        # through the canvas' GL state tracker, so it knows what is bound afterwards.
+        #
+        # The memory mapped vertices of the mesh file are handed to the buffer as they are,
+        # without flattening or copying them first. The meshlets have their own order of the
+        # faces, so it is their indices which are drawn, one chunk after the other. Each chunk
+        # has as many indices as in the mesh file, so the mesh file's chunks apply: a tuple with
+        # the byte offset of the chunk's first vertex, and the number of its first index and its
+        # number of indices in the index buffer. Meshes with more than 65535 vertices are split
+        # into chunks, each with its own range of vertices, so that 16-bit indices can always be
+        # used.
+        layout = meshFileLayout(self.suzanne, texCo=None)
+        indices = numpy.concatenate([meshlets.indices for meshlets in self.meshlets])
+
+        self.suzanneMesh = GpuMesh(self.suzanne.vertices, layout, indices, self.suzanne.bufferChunks)
+        self.suzanneMesh.create(self.program, self.glState)
+
+        self.dumpGLLogMessages("uploadMesh()")
+
     def paintGL(self):
         self.gl.glClear(self.gl.GL_COLOR_BUFFER_BIT | self.gl.GL_DEPTH_BUFFER_BIT)
+
+        # Only show the clear color until the mesh has been loaded
+        if self.suzanneMesh is None:
+            if self.suzanne is None:
+                return
+            self.uploadMesh()
         
-        # We re-enable the program and use it for all draw operations (both VAOs use
-        # this program)
-        self.program.bind()
+        # Use the program for all draw operations (both VAOs use this program). It goes
+        # through the canvas' GL state tracker, which binds it once per frame.
+        self.glState.useProgram(self.program)
 
-        # Set current rotation as a uniform
-        self.currentRotation = QVector3D(self.xRot / 16, self.yRot / 16, self.zRot / 16)
-        self.program.setUniformValue(self.objectRotation, self.currentRotation)
+        # Set current rotation as a uniform. The QVector3D is only created if it has changed.
+        self.uniforms.set("objectRotation", self.xRot / 16, self.yRot / 16, self.zRot / 16)
 
         # Set light uniforms
-        self.program.setUniformValue(self.diffuseStrengthUniform, self.diffuseStrength)
-        self.program.setUniformValue(self.ambientStrengthUniform, self.ambientStrength)
-        self.program.setUniformValue(self.specularStrengthUniform, self.specularStrength)
-        self.program.setUniformValue(self.specularHardnessUniform, float(self.specularHardness))
+        self.uniforms.set("diffuseStrength", self.diffuseStrength)
+        self.uniforms.set("ambientStrength", self.ambientStrength)
+        self.uniforms.set("specularStrength", self.specularStrength)
+        self.uniforms.set("specularHardness", float(self.specularHardness))
 
         # Before painting we set the scaling "uniform" parameter in the vertex shader.
         # This will be used to scale the vertex positions. 
-        self.program.setUniformValue(self.viewportScaling, self.currentScaling)
+        self.uniforms.set("viewportScaling", self.currentScaling)
  
-        # Activate the VAO
-        self.suzanneVAO.bind()
+        # Activate the mesh's VAO, unless it is still bound from the last frame
+        self.suzanneMesh.bind(self.glState)
 
-        # Draw the VAO. It will remember which VBO was specified for it. Note the use
-        # of glDrawElements rather than glDrawArrays. 
-        self.gl.glDrawElements(self.gl.GL_TRIANGLES, self.numberOfVertices, self.gl.GL_UNSIGNED_SHORT, self.indices)
+        # Find out which meshlets may be visible with the current rotation and scaling. These
+        # are the same as the ones given to the shader.
+        rotation = self.rotationMatrix()
+        viewportScale = self.currentViewportScale()
 
-        # Release the VAO
-        self.suzanneVAO.release()
+        # Draw the VAO. It will remember which VBO and index buffer were specified for it. Note
+        # the use of glDrawElements rather than glDrawArrays. Chunks are drawn back to back,
+        # with the attributes moved to the vertices of each chunk. Neighbouring visible meshlets
+        # are drawn with a single call.
+        for (chunk, meshlets) in enumerate(self.meshlets):
 
-        # Release the program
-        self.program.release()
+            visible = meshlets.cull(rotation, viewportScale)
+
+            for (start, count) in meshlets.visibleRanges(visible):
+                self.suzanneMesh.drawChunk(self.gl, chunk, start, count, self.glState)
 
         self.dumpGLLogMessages("paintGL()")
 
@@ -215,11 +230,12 @@ class TestCanvas(RotatableCanvas):
         self.update()
 
     def closeGL(self):
-        # We need to explicitly destroy VAOs, VBOs and programs. Otherwise we'll get a 
-        # segfault or another similar crash.
-        self.suzanneVAO.destroy()
-        self.verticesBuffer.destroy()
-        del self.program
+        # We need to explicitly destroy VAOs and VBOs. Otherwise we'll get a segfault or
+        # another similar crash. The program belongs to the shader cache, which lets go of it
+        # when the context is destroyed.
+        self.loader.shutdown(wait=False)
+        if not self.suzanneMesh is None:
+            self.suzanneMesh.destroy()
 
     def updateParameters(self, diffuseStrength, ambientStrength, specularStrength, specularHardness):
 
@@ -13,7 +13,10 @@ sys.path.append('/'.join(os.path.dirname(os.path.abspath(__file__)).split('/')[:
 from genericgl import TestApplication
 from genericgl import RotatableCanvas
 from genericgl import info
-from genericgl import Wavefront
+from genericgl import shaderProgram
+from genericgl import UniformCache
+from genericgl import AssetLoader
+from genericgl import gpuMeshFromMeshFile
 from genericgl.testapplication import _TestApplication
 
 import array
@@ -27,8 +30,6 @@ class TestCanvas(RotatableCanvas):
 
     def __init__(self):
 
-        self.suzanne = Wavefront("../objs/stripped_base_mesh.obj")
-
         with open("vertex.glsl","r") as f:
             self.vertexShaderSource = f.read()
 
@@ -41,9 +42,6 @@ class TestCanvas(RotatableCanvas):
         if self.fragmentShaderSource is None:
             raise Exception("Could not load the source for the fragment shader")
 
-        # Mirror since image coordinates are reversed compared to GL ones. 
-        self.skinImage = QImage("../textures/skin.png").mirrored(False, True)
-
         # Use an initial scale assuming width = height (should always be overwritten
         # in the resizeGL method below)
         self.currentScaling = QVector4D(1.0, 1.0, 1.0, 1.0)
@@ -53,173 +51,124 @@ class TestCanvas(RotatableCanvas):
         self.specularStrength = 0.1
         self.specularHardness = 4
 
-        super(TestCanvas,self).__init__()
-
-    def setupGL(self):
-
-        self.gl.glEnable(self.gl.GL_TEXTURE_2D)
-
-        self.program = QOpenGLShaderProgram(self.context())
-        info("PROGRAM",self.program)
-
-        # addShaderFromSourceCode() only returns a bool telling whether everything went well
-
-        if self.program.addShaderFromSourceCode(QOpenGLShader.Vertex, self.vertexShaderSource):
-            info("VERTEX SHADER","Managed to load and parse the vertex shader")
-
-        if self.program.addShaderFromSourceCode(QOpenGLShader.Fragment, self.fragmentShaderSource):
-            info("FRAGMENT SHADER","Managed to load and parse the fragment shader")
+        # The mesh and the texture image are set by assetLoaded() when they have been loaded,
+        # and uploaded to the GPU in the first paintGL() after that
+        self.suzanne = None
+        self.skinImage = None
+        self.suzanneMesh = None
 
-        # Compile and bind the shader program to the current context
-        self.program.link()
-        self.program.bind()
-
-        self.skinTexture = QOpenGLTexture(self.skinImage)
-        #self.skinTexture.setMinificationFilter(QOpenGLTexture.Nearest);
-        #self.skinTexture.setMagnificationFilter(QOpenGLTexture.Linear);
-
-        # Find the uniform location for controling the viewport scale of the vertex positions
-        self.viewportScaling = self.program.uniformLocation("viewportScaling")
+        super(TestCanvas,self).__init__()
 
-        # Find the uniform location for controling the rotation of the object
-        self.objectRotation = self.program.uniformLocation("objectRotation")
+        # Load the mesh and the texture on worker threads, so that the window appears right
+        # away. The mesh is loaded from a memory mapped file, with vertex and index data already
+        # laid out the way they are going to be uploaded. The file is created from the obj on
+        # the first run. The image is mirrored since image coordinates are reversed compared
+        # to GL ones.
+        self.loader = AssetLoader()
+        self.loader.loaded.connect(self.assetLoaded)
+        self.loader.failed.connect(self.assetFailed)
+        self.loader.loadMeshFile("suzanne", "../objs/stripped_base_mesh.obj", optimizeForVertexCache=True)
+        self.loader.loadImage("skin", "../textures/skin.png")
 
-        # Find light setting uniforms
-        self.diffuseStrengthUniform = self.program.uniformLocation("diffuseStrength")
-        self.ambientStrengthUniform = self.program.uniformLocation("ambientStrength")
-        self.specularStrengthUniform = self.program.uniformLocation("specularStrength")
-        self.specularHardnessUniform = self.program.uniformLocation("specularHardness")
+    def assetLoaded(self, name, asset):
 
-        # This returns a numpy array with the shape [ [XYZNNNTT] [XYZNNNTT] ... ]
-        self.vertices2d = self.suzanne.getVertexAndNormalAndTexCoArray()
+        # Called in the GUI thread when the loader is done with an asset
 
-        print(self.vertices2d)
+        if name == "suzanne":
+            self.suzanne = asset
 
-        # ... so we need to flatten it to an 1d array
-        self.vertices = self.vertices2d.flatten()
+        if name == "skin":
+            self.skinImage = asset
 
-        # Number of elements in the flattened array
-        self.verticesLength = self.vertices.size
+        # Paint again, which uploads the data once everything is there
+        self.update()
 
-        # Each vertex is specified with with six values (xyznnntt)
-        self.arrayCellsPerVertex = 8
+    def assetFailed(self, name, exception):
 
-        # Size in bytes for each vertex specification (self.vertices.itemsize is the size in bytes
-        # of a single array cell)
-        self.vertexSpecificationSize = self.vertices.itemsize * self.arrayCellsPerVertex
+        # Called in the GUI thread when the loader could not load an asset. Nothing can be
+        # drawn without it, so say so rather than leave the window empty.
+        QMessageBox.critical(self, "Unable to load " + name, str(exception))
 
-        # In bytes, where in a vertex specification does the normal data start? (it starts after 
-        # x, y, z.. i.e after 3 array cells)
-        self.normalBytesOffset = self.vertices.itemsize * 3
+    def setupGL(self):
 
-        # In bytes, where in a vertex specification does the normal data start? (it starts after 
-        # x, y, z.. i.e after 3 array cells)
-        self.textureBytesOffset = self.vertices.itemsize * 6
+        self.gl.glEnable(self.gl.GL_TEXTURE_2D)
 
-        # How many bytes are there in between vertex location specifications
-        self.vertexStride = self.vertices.itemsize * self.arrayCellsPerVertex
+        # Get a linked shader program from the shader cache. The sources are only compiled if
+        # neither this context nor the on-disk cache of program binaries has it already.
+        self.program = shaderProgram(self.context(), self.vertexShaderSource, self.fragmentShaderSource)
+        info("PROGRAM",self.program)
 
-        # What GL datatype should we tell the buffer that we're using? This is necessary, since it
-        # might be different on 32-bit and 64-bit machines
+        # Bind the shader program to the current context
+        self.program.bind()
 
-        self.glDataType = None # let it crash if it isn't float or double
+        # Uniforms are set through a uniform cache: viewportScaling for the viewport scale of
+        # the vertex positions, objectRotation for the rotation of the object and the light
+        # settings. It finds the location of each uniform once, and only calls GL when a value
+        # has actually changed.
+        self.uniforms = UniformCache(self.program)
 
-        if self.vertices.itemsize == 4:
-            self.glDataType = self.gl.GL_FLOAT
+        # Release the program until we need to actually draw something. 
+        self.program.release()
 
-        if self.vertices.itemsize == 8:
-            self.glDataType = self.gl.GL_DOUBLE
+        self.gl.glClearColor(0.1, 0.1, 0.1, 1.0)
 
-        # Total size in bytes for entire array
-        self.verticesDataLength = self.vertices.nbytes
+        self.dumpGLLogMessages("setupGL()")
 
-        # 2d Array with vertex indices that make up faces
-        self.indices2d = self.suzanne.getFaceArray()
-        
-        # Flattened version suitable for drawElements
-        self.indices = self.indices2d.flatten().tolist()
+    def uploadMesh(self):
 
-        # Number of elements in the index array. 
-        self.numberOfVertices = self.indices2d.size
+        # Create the texture, VAO and buffers once the assets have been loaded. Needs the
+        # context to be current, so this is called from paintGL().
 
-        # Start specifying the Vertex Array Object (VAO). 
-        self.suzanneVAO = QOpenGLVertexArrayObject()
-        self.suzanneVAO.create()
-        self.suzanneVAO.bind()
- 
-        # Create a VBO for holding vertex info (both positions and normals)
-        self.verticesBuffer = QOpenGLBuffer(QOpenGLBuffer.VertexBuffer)
-        self.verticesBuffer.create()
-        self.verticesBuffer.bind()
-        self.verticesBuffer.setUsagePattern(QOpenGLBuffer.StaticDraw)
-        self.verticesBuffer.allocate(self.vertices.tobytes(), self.verticesDataLength)
-
-        # Here we specify that there is a program attribute that should get data that is sent
-        # to it (by glDraw* operations), and in what form the data will arrive. 
-        self.program.enableAttributeArray( self.program.attributeLocation("somePosition") )
-        self.program.setAttributeBuffer( self.program.attributeLocation("somePosition"), self.glDataType, 0, 3, self.vertexStride )
-        
-        # Say that the inputNormal attribute should be read from the same array, that it should take three values at a 
-        # time (the normal vector), and that they are of type GL_FLOAT. The same byte offset as for the position info is used, but
-        # we now also specify that the normal information starts at normalBytesOffset bytes into each vertex specification
-        self.program.enableAttributeArray( self.program.attributeLocation("inputNormal") )
-        self.program.setAttributeBuffer( self.program.attributeLocation("inputNormal"), self.glDataType, self.normalBytesOffset, 3, self.vertexStride )
-
-        # Say that the textureCoordinate attribute should be read from the same array, that it should take two values at a 
-        # time (XY texture coord), and that they are of type GL_FLOAT. The same byte offset as for the position info is used, but
-        # we now also specify that the normal information starts at textureBytesOffset bytes into each vertex specification
-        self.program.enableAttributeArray( self.program.attributeLocation("textureCoordinate") )
-        self.program.setAttributeBuffer( self.program.attributeLocation("textureCoordinate"), self.glDataType, self.textureBytesOffset, 2, self.vertexStride )
-         
-        # Once we have set up everything related to the VBOs, we can release that and the 
-        # related VAO.
-        self.verticesBuffer.release()
-        self.suzanneVAO.release()
-     
-        # Release the program until we need to actually draw something. 
-        self.program.release()
+        self.skinTexture = QOpenGLTexture(self.skinImage)
+        #self.skinTexture.setMinificationFilter(QOpenGLTexture.Nearest);
+        #self.skinTexture.setMagnificationFilter(QOpenGLTexture.Linear);
 
-        self.gl.glClearColor(0.1, 0.1, 0.1, 1.0)
+        # Create a mesh with a VAO, a VBO holding the vertices and an index buffer holding the
+        # indices. The memory mapped vertex and index arrays of the mesh file are handed to the
+        # buffers as they are, without flattening or copying them first. The layout of the mesh
+        # file's vertices ([ [XYZNNNTT] [XYZNNNTT] ... ]) goes to the somePosition, inputNormal
+        # and textureCoordinate attributes. Meshes with more than 65535 vertices are split into
+        # chunks, each with its own range of vertices, so that 16-bit indices can always be used.
+        #
+        # Pass positionFormat="int16" to upload packed 16 byte vertices instead. The shader then
+        # needs to decode them, see 18_pack_vertex_attributes.
+        self.suzanneMesh = gpuMeshFromMeshFile(self.suzanne)
+        self.suzanneMesh.create(self.program, self.glState)
 
-        self.dumpGLLogMessages("setupGL()")
+        self.dumpGLLogMessages("uploadMesh()")
 
     def paintGL(self):
         self.gl.glClear(self.gl.GL_COLOR_BUFFER_BIT | self.gl.GL_DEPTH_BUFFER_BIT)
+
+        # Only show the clear color until the mesh and the texture have been loaded
+        if self.suzanneMesh is None:
+            if self.suzanne is None or self.skinImage is None:
+                return
+            self.uploadMesh()
         
-        # We re-enable the program and use it for all draw operations (both VAOs use
-        # this program)
-        self.program.bind()
+        # Use the program for all draw operations (both VAOs use this program). It goes
+        # through the canvas' GL state tracker, which binds it once per frame.
+        self.glState.useProgram(self.program)
 
-        # Set current rotation as a uniform
-        self.currentRotation = QVector3D(self.xRot / 16, self.yRot / 16, self.zRot / 16)
-        self.program.setUniformValue(self.objectRotation, self.currentRotation)
+        # Set current rotation as a uniform. The QVector3D is only created if it has changed.
+        self.uniforms.set("objectRotation", self.xRot / 16, self.yRot / 16, self.zRot / 16)
 
         # Set light uniforms
-        self.program.setUniformValue(self.diffuseStrengthUniform, self.diffuseStrength)
-        self.program.setUniformValue(self.ambientStrengthUniform, self.ambientStrength)
-        self.program.setUniformValue(self.specularStrengthUniform, self.specularStrength)
-        self.program.setUniformValue(self.specularHardnessUniform, float(self.specularHardness))
+        self.uniforms.set("diffuseStrength", self.diffuseStrength)
+        self.uniforms.set("ambientStrength", self.ambientStrength)
+        self.uniforms.set("specularStrength", self.specularStrength)
+        self.uniforms.set("specularHardness", float(self.specularHardness))
 
         # Before painting we set the scaling "uniform" parameter in the vertex shader.
         # This will be used to scale the vertex positions. 
-        self.program.setUniformValue(self.viewportScaling, self.currentScaling)
+        self.uniforms.set("viewportScaling", self.currentScaling)
  
-        # Activate the VAO
-        self.suzanneVAO.bind()
+        # Bind the texture to unit 0 through the GL state tracker
+        self.glState.bindTexture(self.skinTexture)
 
-        self.skinTexture.bind()
-
-        # Draw the VAO. It will remember which VBO was specified for it. Note the use
-        # of glDrawElements rather than glDrawArrays. 
-        self.gl.glDrawElements(self.gl.GL_TRIANGLES, self.numberOfVertices, self.gl.GL_UNSIGNED_SHORT, self.indices)
-
-        self.skinTexture.release()
-
-        # Release the VAO
-        self.suzanneVAO.release()
-
-        # Release the program
-        self.program.release()
+        # Draw the mesh. This binds its VAO, which remembers which VBO and index buffer were
+        # specified for it, and draws the chunks back to back with glDrawElements.
+        self.suzanneMesh.draw(self.gl, self.glState)
 
         self.dumpGLLogMessages("paintGL()")
 
@@ -240,13 +189,14 @@ class TestCanvas(RotatableCanvas):
         self.update()
 
     def closeGL(self):
-        # We need to explicitly destroy VAOs, VBOs and programs. Otherwise we'll get a 
-        # segfault or another similar crash.
-        self.skinTexture.destroy()
-        self.suzanneVAO.destroy()
-        self.verticesBuffer.destroy()
-        del self.program
-        del self.skinTexture
+        # We need to explicitly destroy VAOs and VBOs. Otherwise we'll get a segfault or
+        # another similar crash. The program belongs to the shader cache, which lets go of it
+        # when the context is destroyed.
+        self.loader.shutdown(wait=False)
+        if not self.suzanneMesh is None:
+            self.skinTexture.destroy()
+            self.suzanneMesh.destroy()
+            del self.skinTexture
 
     def updateParameters(self, diffuseStrength, ambientStrength, specularStrength, specularHardness):
 
@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+
+"""
+Draw a textured model with a level of detail (LOD) chain. The levels are
+decimated versions of the model which all use the same vertices. Each frame,
+the coarsest level whose error is less than a pixel on screen is drawn. Use
+the mouse wheel to zoom out and watch the level change.
+
+While the model is loading, whatever has arrived is drawn as a stand-in: the
+whole mesh until the LOD chain has been built, and the coarsest level with a
+plain skin colour until the texture has been decoded.
+"""
+
+import sys
+import os.path
+sys.path.append('/'.join(os.path.dirname(os.path.abspath(__file__)).split('/')[:-1]))
+
+from genericgl import TestApplication
+from genericgl import RotatableCanvas
+from genericgl import info
+from genericgl import shaderProgram
+from genericgl import UniformCache
+from genericgl import AssetLoader
+from genericgl import loadLodChain
+from genericgl import gpuMeshFromMeshFile
+from genericgl import gpuMeshFromLodChain
+
+from PyQt5.QtWidgets import *
+from PyQt5.QtGui import *
+from PyQt5.QtCore import *
+
+class TestCanvas(RotatableCanvas):
+
+    def __init__(self):
+
+        with open("vertex.glsl","r") as f:
+            self.vertexShaderSource = f.read()
+
+        with open("fragment.glsl","r") as f:
+            self.fragmentShaderSource = f.read()
+
+        if self.vertexShaderSource is None:
+            raise Exception("Could not load the source for the vertex shader")
+
+        if self.fragmentShaderSource is None:
+            raise Exception("Could not load the source for the fragment shader")
+
+        # The W component of the viewport scaling. Higher = smaller object on screen. Changed
+        # with the mouse wheel.
+        self.globalScale = 1.0
+
+        # Use an initial scale assuming width = height (should always be overwritten
+        # in the resizeGL method below)
+        self.currentScaling = QVector4D(1.0, 1.0, 1.0, self.globalScale)
+
+        # How far (in pixels) the surface of the drawn level may be from that of the full mesh
+        self.pixelTolerance = 1.0
+
+        # The level drawn in the last frame, so that changes can be logged
+        self.currentLevel = None
+
+        # The mesh file, the LOD chain and the texture image are set by assetLoaded() when
+        # they have been loaded, and uploaded to the GPU in the first paintGL() after that
+        self.suzanne = None
+        self.lodChain = None
+        self.skinImage = None
+        self.suzanneMesh = None
+        self.skinTexture = None
+        self.skinTextureIsStandIn = False
+
+        super(TestCanvas,self).__init__()
+
+        # Load everything on worker threads. The LOD chain is built from the obj on the first
+        # run and saved next to it. It must be made with the same settings as the mesh file,
+        # since its levels index the vertices in the mesh file.
+        self.loader = AssetLoader()
+        self.loader.loaded.connect(self.assetLoaded)
+        self.loader.failed.connect(self.assetFailed)
+        self.loader.loadMeshFile("suzanne", "../objs/stripped_base_mesh.obj", optimizeForVertexCache=True)
+        self.loader.load("lods", loadLodChain, "../objs/stripped_base_mesh.obj", optimizeForVertexCache=True)
+        self.loader.loadImage("skin", "../textures/skin.png")
+
+    def assetLoaded(self, name, asset):
+
+        # Called in the GUI thread when the loader is done with an asset
+
+        if name == "suzanne":
+            self.suzanne = asset
+
+        if name == "lods":
+            self.lodChain = asset
+            info("LOD FACE COUNTS", self.lodChain.getFaceCounts())
+
+        if name == "skin":
+            self.skinImage = asset
+
+        # Paint again, which uploads the data
+        self.update()
+
+    def assetFailed(self, name, exception):
+
+        # Called in the GUI thread when the loader could not load an asset. Say so, rather
+        # than leave the window empty. Without the LOD chain or the texture, the stand-ins
+        # keep being drawn.
+        QMessageBox.critical(self, "Unable to load " + name, str(exception))
+
+    def setupGL(self):
+
+        self.gl.glEnable(self.gl.GL_TEXTURE_2D)
+
+        # Get a linked shader program from the shader cache
+        self.program = shaderProgram(self.context(), self.vertexShaderSource, self.fragmentShaderSource)
+        info("PROGRAM",self.program)
+
+        # Uniforms are set through a uniform cache, which only calls GL when a value has changed
+        self.uniforms = UniformCache(self.program)
+
+        self.gl.glClearColor(0.1, 0.1, 0.1, 1.0)
+
+        self.dumpGLLogMessages("setupGL()")
+
+    def uploadTexture(self):
+
+        # Create the texture. Needs the context to be current, so this is called from
+        # paintGL(). Until the skin image has been decoded, a single texel of skin colour
+        # stands in for it.
+
+        if not self.skinTexture is None:
+            self.skinTexture.destroy()
+
+        self.skinTextureIsStandIn = self.skinImage is None
+
+        if self.skinTextureIsStandIn:
+            image = QImage(1, 1, QImage.Format_RGB32)
+            image.fill(QColor(224, 172, 150))
+            self.skinTexture = QOpenGLTexture(image)
+        else:
+            self.skinTexture = QOpenGLTexture(self.skinImage)
+
+        self.dumpGLLogMessages("uploadTexture()")
+
+    def uploadMesh(self):
+
+        # Create the VAO and buffers. Needs the context to be current, so this is called from
+        # paintGL().
+        #
+        # Building the LOD chain takes a few seconds on the first run. Until it is there, the
+        # mesh file's own indices are uploaded, and the whole mesh is drawn. Once it arrives,
+        # the mesh is created again with the indices of all levels one after the other in a
+        # single index buffer. Switching levels then only changes which part of the index
+        # buffer is drawn, nothing is uploaded again.
+
+        if not self.suzanneMesh is None:
+            self.suzanneMesh.destroy()
+
+        if self.lodChain is None:
+            self.suzanneMesh = gpuMeshFromMeshFile(self.suzanne)
+        else:
+            self.suzanneMesh = gpuMeshFromLodChain(self.suzanne, self.lodChain)
+
+        self.suzanneMesh.create(self.program, self.glState)
+
+        self.dumpGLLogMessages("uploadMesh()")
+
+    def paintGL(self):
+        self.gl.glClear(self.gl.GL_COLOR_BUFFER_BIT | self.gl.GL_DEPTH_BUFFER_BIT)
+
+        # Only show the clear color until the mesh file has been loaded. After that, upload
+        # each asset as it arrives, replacing its stand-in.
+        if self.suzanne is None:
+            return
+
+        if self.skinTexture is None or (self.skinTextureIsStandIn and not self.skinImage is None):
+            self.uploadTexture()
+
+        if self.suzanneMesh is None or (self.suzanneMesh.lodChain is None and not self.lodChain is None):
+            self.uploadMesh()
+
+        self.glState.useProgram(self.program)
+
+        self.uniforms.set("objectRotation", self.xRot / 16, self.yRot / 16, self.zRot / 16)
+        self.uniforms.set("viewportScaling", self.currentScaling)
+
+        self.glState.bindTexture(self.skinTexture)
+
+        if self.suzanneMesh.lodChain is None:
+
+            # Without the LOD chain, draw the whole mesh
+            self.suzanneMesh.draw(self.gl, self.glState)
+
+        else:
+
+            # Pick the coarsest level whose error, projected on screen, is within the tolerance.
+            # How many pixels a unit covers follows from the widget size and the global scale.
+            # While the texture is a stand-in, the model is one too, so draw the coarsest level.
+            if self.skinTextureIsStandIn:
+                level = len(self.lodChain.levels) - 1
+            else:
+                level = self.lodChain.selectLevel(self.pixelsPerUnit(self.globalScale), self.pixelTolerance)
+
+            if level != self.currentLevel:
+                info("LOD LEVEL", str(level) + " (" + str(self.lodChain.getFaceCounts()[level]) + " faces)")
+                self.currentLevel = level
+
+            self.suzanneMesh.drawLevel(self.gl, level, self.glState)
+
+        self.dumpGLLogMessages("paintGL()")
+
+    def resizeGL(self, width, height):
+
+        # Keep the proportions of the object, and the current zoom
+        self.currentScaling = QVector4D(*self.currentViewportScale(self.globalScale))
+
+        # Redraw since we changed the value of the scaling uniform
+        self.update()
+
+    def wheelEvent(self, event):
+
+        # Zoom out when the wheel is turned towards the user and in the other way. One step of
+        # the wheel is 120.
+        steps = event.angleDelta().y() / 120
+        self.globalScale = min(32.0, max(0.5, self.globalScale * 1.25 ** -steps))
+
+        self.currentScaling = QVector4D(*self.currentViewportScale(self.globalScale))
+        self.update()
+
+    def closeGL(self):
+        self.loader.shutdown(wait=False)
+        if not self.skinTexture is None:
+            self.skinTexture.destroy()
+            del self.skinTexture
+        if not self.suzanneMesh is None:
+            self.suzanneMesh.destroy()
+
+app = TestApplication(sys.argv, TestCanvas)
+app.exec_()
+del app
+sys.exit()
@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+
+"""
+Draw the textured model from packed vertices: 16 bytes per vertex instead of
+32, with positions, normals and texture coordinates stored as 16-bit integers.
+The vertex shader decodes them before using them.
+"""
+
+import sys
+import os.path
+sys.path.append('/'.join(os.path.dirname(os.path.abspath(__file__)).split('/')[:-1]))
+
+from genericgl import TestApplication
+from genericgl import RotatableCanvas
+from genericgl import info
+from genericgl import shaderProgram
+from genericgl import UniformCache
+from genericgl import AssetLoader
+from genericgl import gpuMeshFromMeshFile
+from genericgl import addDecodeToShader
+
+from PyQt5.QtWidgets import *
+from PyQt5.QtGui import *
+from PyQt5.QtCore import *
+
+class TestCanvas(RotatableCanvas):
+
+    def __init__(self):
+
+        with open("vertex.glsl","r") as f:
+            self.vertexShaderSource = f.read()
+
+        with open("fragment.glsl","r") as f:
+            self.fragmentShaderSource = f.read()
+
+        if self.vertexShaderSource is None:
+            raise Exception("Could not load the source for the vertex shader")
+
+        if self.fragmentShaderSource is None:
+            raise Exception("Could not load the source for the fragment shader")
+
+        # The vertex shader calls decodePosition(), decodeNormal() and decodeTexCo(). Insert
+        # them (and the uniforms they use) after its #version line.
+        self.vertexShaderSource = addDecodeToShader(self.vertexShaderSource)
+
+        # Use an initial scale assuming width = height (should always be overwritten
+        # in the resizeGL method below)
+        self.currentScaling = QVector4D(1.0, 1.0, 1.0, 1.0)
+
+        # The mesh and the texture image are set by assetLoaded() when they have been loaded,
+        # and uploaded to the GPU in the first paintGL() after that
+        self.suzanne = None
+        self.skinImage = None
+        self.suzanneMesh = None
+
+        super(TestCanvas,self).__init__()
+
+        self.loader = AssetLoader()
+        self.loader.loaded.connect(self.assetLoaded)
+        self.loader.failed.connect(self.assetFailed)
+        self.loader.loadMeshFile("suzanne", "../objs/stripped_base_mesh.obj", optimizeForVertexCache=True)
+        self.loader.loadImage("skin", "../textures/skin.png")
+
+    def assetLoaded(self, name, asset):
+
+        # Called in the GUI thread when the loader is done with an asset
+
+        if name == "suzanne":
+            self.suzanne = asset
+
+        if name == "skin":
+            self.skinImage = asset
+
+        # Paint again, which uploads the data once everything is there
+        self.update()
+
+    def assetFailed(self, name, exception):
+
+        # Called in the GUI thread when the loader could not load an asset. Nothing can be
+        # drawn without it, so say so rather than leave the window empty.
+        QMessageBox.critical(self, "Unable to load " + name, str(exception))
+
+    def setupGL(self):
+
+        self.gl.glEnable(self.gl.GL_TEXTURE_2D)
+
+        # Get a linked shader program from the shader cache
+        self.program = shaderProgram(self.context(), self.vertexShaderSource, self.fragmentShaderSource)
+        info("PROGRAM",self.program)
+
+        # Uniforms are set through a uniform cache, which only calls GL when a value has changed
+        self.uniforms = UniformCache(self.program)
+
+        self.gl.glClearColor(0.1, 0.1, 0.1, 1.0)
+
+        self.dumpGLLogMessages("setupGL()")
+
+    def uploadMesh(self):
+
+        # Create the texture, VAO and buffers once the assets have been loaded. Needs the
+        # context to be current, so this is called from paintGL().
+
+        self.skinTexture = QOpenGLTexture(self.skinImage)
+
+        # Pack the float32 vertices of the mesh file into 16 bytes each and upload those. The
+        # layout passes the packed values to the attributes as they are: GL_SHORT positions and
+        # normals, and GL_UNSIGNED_SHORT texture coordinates. The indices and chunks of the
+        # mesh file apply unchanged.
+        self.suzanneMesh = gpuMeshFromMeshFile(self.suzanne, positionFormat="int16")
+        self.suzanneMesh.create(self.program, self.glState)
+
+        info("VERTEX BYTES", str(self.suzanne.vertices.nbytes) + " as float32, " + str(self.suzanneMesh.vertices.nbytes) + " packed")
+
+        # Give the shader the scale and bias which turn the packed positions and texture
+        # coordinates back into the original values. These are the same for the whole mesh,
+        # so they are only set once.
+        self.glState.useProgram(self.program)
+        self.suzanneMesh.setDecodeUniforms(self.program)
+
+        self.dumpGLLogMessages("uploadMesh()")
+
+    def paintGL(self):
+        self.gl.glClear(self.gl.GL_COLOR_BUFFER_BIT | self.gl.GL_DEPTH_BUFFER_BIT)
+
+        # Only show the clear color until the mesh and the texture have been loaded
+        if self.suzanneMesh is None:
+            if self.suzanne is None or self.skinImage is None:
+                return
+            self.uploadMesh()
+
+        self.glState.useProgram(self.program)
+
+        self.uniforms.set("objectRotation", self.xRot / 16, self.yRot / 16, self.zRot / 16)
+        self.uniforms.set("viewportScaling", self.currentScaling)
+
+        self.glState.bindTexture(self.skinTexture)
+
+        # Draw the mesh. Nothing here differs from drawing float32 vertices, since the layout
+        # was given when the mesh was created.
+        self.suzanneMesh.draw(self.gl, self.glState)
+
+        self.dumpGLLogMessages("paintGL()")
+
+    def resizeGL(self, width, height):
+
+        # Keep the proportions of the object
+        self.currentScaling = QVector4D(*self.currentViewportScale())
+
+        # Redraw since we changed the value of the scaling uniform
+        self.update()
+
+    def closeGL(self):
+        self.loader.shutdown(wait=False)
+        if not self.suzanneMesh is None:
+            self.skinTexture.destroy()
+            self.suzanneMesh.destroy()
+            del self.skinTexture
+
+app = TestApplication(sys.argv, TestCanvas)
+app.exec_()
+del app
+sys.exit()
@@ -1,10 +1,22 @@
 #!/usr/bin/python3
 
-__all__ = ("TestApplication","Canvas","RotatableCanvas","info","Wavefront")
+__all__ = ("TestApplication","Canvas","RotatableCanvas","info","Wavefront","indexTypeFor","MeshFile","loadMeshFile","writeMeshFile","MorphTargets","LodChain","buildLodChain","loadLodChain","Bvh","Meshlets","PackedVertices","packWavefront","packMeshFile","addDecodeToShader","writeCompressedMesh","readCompressedMesh","AssetLoader","IndexBuffer","GpuMesh","VertexLayout","floatLayout","meshFileLayout","packedLayout","gpuMeshFromWavefront","gpuMeshFromMeshFile","gpuMeshFromLodChain","shaderProgram","programKey","UniformCache","GlState")
 
 from .testapplication import TestApplication
 from .canvas import Canvas
 from .rotatablecanvas import RotatableCanvas
 from .simpledebug import info
-from .wavefront import Wavefront
-
+from .wavefront import Wavefront, indexTypeFor
+from .meshfile import MeshFile, loadMeshFile, writeMeshFile
+from .morphtargets import MorphTargets
+from .decimate import LodChain, buildLodChain, loadLodChain
+from .bvh import Bvh
+from .meshlets import Meshlets
+from .quantize import PackedVertices, packWavefront, packMeshFile, addDecodeToShader
+from .meshcodec import writeCompressedMesh, readCompressedMesh
+from .assetloader import AssetLoader
+from .indexbuffer import IndexBuffer
+from .gpumesh import GpuMesh, VertexLayout, floatLayout, meshFileLayout, packedLayout, gpuMeshFromWavefront, gpuMeshFromMeshFile, gpuMeshFromLodChain
+from .shadercache import shaderProgram, programKey
+from .uniformcache import UniformCache
+from .glstate import GlState
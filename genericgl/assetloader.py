@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5.QtCore import QObject, pyqtSignal
+from PyQt5.QtGui import QImage
+
+from .simpledebug import info
+from .wavefront import Wavefront
+from .meshfile import loadMeshFile
+
+# Loading of assets (meshes, images, anything else which takes a while) on a pool of
+# worker threads, so that a canvas can be shown while its data is still being read.
+#
+# Each asset has a name. When it has been loaded, the loaded signal is emitted with
+# the name and the result. The signal is emitted from a worker thread, but since the
+# AssetLoader lives in the GUI thread, Qt queues it and the connected slots run in the
+# GUI thread. A typical canvas stores the result in the slot, calls update(), and
+# creates GL objects from it in the next paintGL(). Until then it only clears the
+# background.
+#
+# Parsing, normal generation and image decoding are done in numpy and Qt, which
+# release the GIL for most of their work, so threads are enough here. Only loading
+# functions which do not touch GL may be used, since there is no current context on
+# the worker threads.
+
+class AssetLoader(QObject):
+
+    # Emitted with the name and the result of a loaded asset
+    loaded = pyqtSignal(str, object)
+
+    # Emitted with the name and the exception if loading an asset failed
+    failed = pyqtSignal(str, object)
+
+    def __init__(self, maxWorkers = None, parent = None):
+
+        super(AssetLoader, self).__init__(parent)
+
+        self._executor = ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix="AssetLoader")
+
+        # The results loaded so far, by name
+        self.assets = dict()
+
+        # Names which have been asked for but not loaded yet
+        self.pending = set()
+
+        # Connected first, so that assets has the result before any other slot is called
+        self.loaded.connect(self._store)
+        self.failed.connect(self._forget)
+
+    def load(self, name, function, *args, **kwargs):
+
+        # Call function(*args, **kwargs) on a worker thread and emit loaded (or failed)
+        # with its result
+
+        self.pending.add(name)
+
+        return self._executor.submit(self._run, name, function, args, kwargs)
+
+    def _run(self, name, function, args, kwargs):
+
+        startTime = time.perf_counter()
+
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            info("ASSET LOADER", "failed to load " + name + ": " + str(e))
+            self.failed.emit(name, e)
+            raise
+
+        info("ASSET LOADER", "loaded " + name + " in " + str(round(time.perf_counter() - startTime, 3)) + "s")
+
+        self.loaded.emit(name, result)
+
+        return result
+
+    def _store(self, name, result):
+        self.assets[name] = result
+        self.pending.discard(name)
+
+    def _forget(self, name, exception):
+        self.pending.discard(name)
+
+    def loadWavefront(self, name, path, **kwargs):
+
+        # Parse an obj file and generate its normals, see Wavefront
+        return self.load(name, Wavefront, path, **kwargs)
+
+    def loadMeshFile(self, name, objPath, **kwargs):
+
+        # Load, and if necessary create, the mesh file of an obj file, see loadMeshFile()
+        return self.load(name, loadMeshFile, objPath, **kwargs)
+
+    def loadImage(self, name, path, mirrored = True):
+
+        # Decode an image. It is mirrored by default, since image coordinates are reversed
+        # compared to GL ones. QImage (unlike QPixmap) may be used outside the GUI thread.
+        return self.load(name, _readImage, path, mirrored)
+
+    def isLoaded(self, *names):
+
+        # True when all the named assets have been loaded
+        for name in names:
+            if not name in self.assets:
+                return False
+        return True
+
+    def shutdown(self, wait = True):
+
+        # Stop taking new work. Assets which are being loaded are finished first if wait
+        # is True.
+        self._executor.shutdown(wait=wait)
+
+
+def _readImage(path, mirrored):
+
+    image = QImage(path)
+
+    if image.isNull():
+        raise IOError("Could not read the image " + path)
+
+    if mirrored:
+        image = image.mirrored(False, True)
+
+    return image
@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+import numpy
+
+from .simpledebug import info
+
+# A bounding volume hierarchy (BVH) over the faces of a Wavefront object, for finding
+# the face or vertex under the mouse without testing every face.
+#
+# The tree is built top down, one level at a time, with all nodes of a level split
+# at once using array operations. Each node is split with the binned surface area
+# heuristic (SAH): the centroids of its faces are put in a number of bins along the
+# longest axis, and the split between bins which gives the smallest expected cost of
+# tracing a ray through the two halves is picked. Nodes where splitting does not pay
+# off become leaves.
+#
+# Each node covers a contiguous range of faceOrder, so after vertices have been moved
+# (see Wavefront.updateVertexCoords()) the bounds can be refitted without rebuilding
+# the tree.
+#
+# Queries walk the tree in python. Like in vertexcache.py, the node and face data is
+# kept in plain python lists for this, since element by element access to numpy
+# arrays is much slower.
+
+# Nodes with at most this many faces are never split
+_defaultLeafSize = 4
+
+# Nodes with more than this many faces are always split, even if the SAH says otherwise
+_maxLeafSize = 16
+
+# Cost of visiting a node, relative to the cost of intersecting a face
+_traversalCost = 1.0
+
+_infinity = float("inf")
+
+def _surfaceAreas(boundsMin, boundsMax):
+
+    # Half the surface area of boxes, which is all the SAH needs. Empty boxes (min > max)
+    # get an area of zero.
+
+    extent = numpy.maximum(boundsMax - boundsMin, 0.0)
+    return extent[...,0] * extent[...,1] + extent[...,1] * extent[...,2] + extent[...,2] * extent[...,0]
+
+
+def _expandRanges(starts, counts):
+
+    # Return a tuple with the positions covered by the ranges, and which range each of
+    # them belongs to
+
+    owners = numpy.repeat(numpy.arange(len(starts)), counts)
+    positions = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts) + numpy.repeat(starts, counts)
+
+    return (positions, owners)
+
+
+class Bvh():
+
+    def __init__(self, wavefront, leafSize = _defaultLeafSize, numberOfBins = 16):
+
+        self.wavefront = wavefront
+        self.leafSize = leafSize
+        self.numberOfBins = numberOfBins
+
+        numberOfFaces = len(wavefront.faces)
+        maxNodes = max(1, 2 * numberOfFaces - 1)
+
+        # The faces in the order the leaves refer to them
+        self.faceOrder = numpy.arange(numberOfFaces)
+
+        # Node arrays. Node 0 is the root. Children are always stored next to each other, so
+        # only the index of the first child is kept (-1 for leaves). Each node covers the
+        # faces faceOrder[nodeStart:nodeStart + nodeCount].
+        self.nodeMin = numpy.zeros( (maxNodes, 3), dtype=float )
+        self.nodeMax = numpy.zeros( (maxNodes, 3), dtype=float )
+        self.nodeChild = numpy.full(maxNodes, -1, dtype=int)
+        self.nodeStart = numpy.zeros(maxNodes, dtype=int)
+        self.nodeCount = numpy.zeros(maxNodes, dtype=int)
+
+        self.numberOfNodes = 1
+
+        # Node indices for each depth, used for refitting bottom up
+        self._levels = []
+
+        self._build()
+        self._createTraversalLists()
+
+        info("BVH", str(self.numberOfNodes) + " nodes, " + str(len(self._levels)) + " levels")
+
+    def _faceBounds(self):
+
+        corners = self.wavefront.vertexCoords[self.wavefront.faces]
+        return (corners.min(axis=1), corners.max(axis=1))
+
+    def _build(self):
+
+        (faceMin, faceMax) = self._faceBounds()
+        centroids = (faceMin + faceMax) / 2.0
+
+        numberOfBins = self.numberOfBins
+        order = self.faceOrder
+
+        self.nodeCount[0] = len(order)
+
+        if len(order) == 0:
+            self._levels.append(numpy.zeros(1, dtype=int))
+            return
+
+        active = numpy.zeros(1, dtype=int)
+
+        while len(active) > 0:
+
+            self._levels.append(active)
+
+            starts = self.nodeStart[active]
+            counts = self.nodeCount[active]
+            segmentStarts = numpy.cumsum(counts) - counts
+
+            (positions, owners) = _expandRanges(starts, counts)
+            faces = order[positions]
+
+            # Bounds of the nodes, and of the centroids of their faces
+            self.nodeMin[active] = numpy.minimum.reduceat(faceMin[faces], segmentStarts)
+            self.nodeMax[active] = numpy.maximum.reduceat(faceMax[faces], segmentStarts)
+
+            centroidMin = numpy.minimum.reduceat(centroids[faces], segmentStarts)
+            centroidMax = numpy.maximum.reduceat(centroids[faces], segmentStarts)
+            centroidExtent = centroidMax - centroidMin
+
+            axis = numpy.argmax(centroidExtent, axis=1)
+            axisExtent = centroidExtent[numpy.arange(len(active)), axis]
+
+            # Put each face in a bin along the longest axis of its node
+            faceAxis = axis[owners]
+            relative = (centroids[faces, faceAxis] - centroidMin[owners, faceAxis]) / numpy.maximum(axisExtent[owners], 1e-300)
+            bins = numpy.minimum( (relative * numberOfBins).astype(int), numberOfBins - 1 )
+
+            # Sort the faces of each node by bin. The two halves of any split between bins are
+            # then contiguous.
+            keys = owners * numberOfBins + bins
+            byBin = numpy.argsort(keys, kind="stable")
+
+            keys = keys[byBin]
+            faces = faces[byBin]
+            order[positions] = faces
+
+            groupStarts = numpy.flatnonzero(numpy.diff(keys, prepend=-1))
+            groupKeys = keys[groupStarts]
+            groupCounts = numpy.diff(numpy.append(groupStarts, len(keys)))
+
+            binMin = numpy.full( (len(active) * numberOfBins, 3), _infinity )
+            binMax = numpy.full( (len(active) * numberOfBins, 3), -_infinity )
+            binCount = numpy.zeros(len(active) * numberOfBins, dtype=int)
+
+            binMin[groupKeys] = numpy.minimum.reduceat(faceMin[faces], groupStarts)
+            binMax[groupKeys] = numpy.maximum.reduceat(faceMax[faces], groupStarts)
+            binCount[groupKeys] = groupCounts
+
+            binMin = binMin.reshape(len(active), numberOfBins, 3)
+            binMax = binMax.reshape(len(active), numberOfBins, 3)
+            binCount = binCount.reshape(len(active), numberOfBins)
+
+            # Bounds and counts left of (and including) each bin, and right of each bin
+            leftMin = numpy.minimum.accumulate(binMin, axis=1)
+            leftMax = numpy.maximum.accumulate(binMax, axis=1)
+            leftCount = numpy.cumsum(binCount, axis=1)
+
+            rightMin = numpy.minimum.accumulate(binMin[:,::-1], axis=1)[:,::-1]
+            rightMax = numpy.maximum.accumulate(binMax[:,::-1], axis=1)[:,::-1]
+            rightCount = numpy.cumsum(binCount[:,::-1], axis=1)[:,::-1]
+
+            # Cost of splitting after bin j, for j in 0 .. numberOfBins - 2
+            splitCost = _surfaceAreas(leftMin[:,:-1], leftMax[:,:-1]) * leftCount[:,:-1] + _surfaceAreas(rightMin[:,1:], rightMax[:,1:]) * rightCount[:,1:]
+            splitCost[ (leftCount[:,:-1] == 0) | (rightCount[:,1:] == 0) ] = _infinity
+
+            bestSplit = numpy.argmin(splitCost, axis=1)
+            bestCost = splitCost[numpy.arange(len(active)), bestSplit]
+
+            nodeArea = _surfaceAreas(self.nodeMin[active], self.nodeMax[active])
+            leafCost = counts.astype(float)
+            splitCostRelative = _traversalCost + bestCost / numpy.maximum(nodeArea, 1e-300)
+
+            split = (counts > self.leafSize) & numpy.isfinite(bestCost) & ( (splitCostRelative < leafCost) | (counts > _maxLeafSize) )
+
+            splitNodes = active[split]
+            leftCounts = leftCount[split, bestSplit[split]]
+
+            children = self.numberOfNodes + 2 * numpy.arange(len(splitNodes))
+            self.numberOfNodes = self.numberOfNodes + 2 * len(splitNodes)
+
+            self.nodeChild[splitNodes] = children
+
+            self.nodeStart[children] = self.nodeStart[splitNodes]
+            self.nodeCount[children] = leftCounts
+            self.nodeStart[children + 1] = self.nodeStart[splitNodes] + leftCounts
+            self.nodeCount[children + 1] = self.nodeCount[splitNodes] - leftCounts
+
+            active = numpy.concatenate( (children, children + 1) )
+            active.sort()
+
+    def refit(self):
+
+        # Update the node bounds after vertices have moved. The tree itself is kept, so
+        # queries stay correct, but it gets less efficient if the mesh changes a lot. Then
+        # create a new Bvh instead.
+
+        (faceMin, faceMax) = self._faceBounds()
+
+        isLeaf = self.nodeChild[:self.numberOfNodes] < 0
+        leaves = numpy.flatnonzero(isLeaf)
+        leaves = leaves[self.nodeCount[leaves] > 0]
+
+        # Leaves cover disjoint ranges of faceOrder, so they can be reduced in one go
+        leaves = leaves[numpy.argsort(self.nodeStart[leaves])]
+        (positions, owners) = _expandRanges(self.nodeStart[leaves], self.nodeCount[leaves])
+        segmentStarts = numpy.cumsum(self.nodeCount[leaves]) - self.nodeCount[leaves]
+
+        faces = self.faceOrder[positions]
+        self.nodeMin[leaves] = numpy.minimum.reduceat(faceMin[faces], segmentStarts)
+        self.nodeMax[leaves] = numpy.maximum.reduceat(faceMax[faces], segmentStarts)
+
+        # Then the inner nodes, from the deepest level and up
+        for level in reversed(self._levels):
+            inner = level[self.nodeChild[level] >= 0]
+            children = self.nodeChild[inner]
+            self.nodeMin[inner] = numpy.minimum(self.nodeMin[children], self.nodeMin[children + 1])
+            self.nodeMax[inner] = numpy.maximum(self.nodeMax[children], self.nodeMax[children + 1])
+
+        self._createTraversalLists()
+
+    def _createTraversalLists(self):
+
+        count = self.numberOfNodes
+
+        self._nodes = numpy.concatenate( (self.nodeMin[:count], self.nodeMax[:count]), axis=1 ).tolist()
+        self._children = self.nodeChild[:count].tolist()
+        self._starts = self.nodeStart[:count].tolist()
+        self._counts = self.nodeCount[:count].tolist()
+
+        # Per face in faceOrder: the face index, its corners, one corner position and the
+        # two edge vectors from it
+        faces = self.wavefront.faces[self.faceOrder]
+        coords = self.wavefront.vertexCoords
+
+        self._faceIndices = self.faceOrder.tolist()
+        self._faceCorners = faces.tolist()
+        self._faceOrigins = coords[faces[:,0]].tolist()
+        self._faceEdges1 = (coords[faces[:,1]] - coords[faces[:,0]]).tolist()
+        self._faceEdges2 = (coords[faces[:,2]] - coords[faces[:,0]]).tolist()
+        self._coords = coords.tolist()
+
+    def _rayBoxEntry(self, node, ox, oy, oz, ix, iy, iz, maxDistance):
+
+        # Slab test. Returns the distance along the ray where it enters the box, or None if
+        # it misses the box or enters it further away than maxDistance.
+
+        (minX, minY, minZ, maxX, maxY, maxZ) = self._nodes[node]
+
+        t1 = (minX - ox) * ix
+        t2 = (maxX - ox) * ix
+        near = min(t1, t2)
+        far = max(t1, t2)
+
+        t1 = (minY - oy) * iy
+        t2 = (maxY - oy) * iy
+        near = max(near, min(t1, t2))
+        far = min(far, max(t1, t2))
+
+        t1 = (minZ - oz) * iz
+        t2 = (maxZ - oz) * iz
+        near = max(near, min(t1, t2))
+        far = min(far, max(t1, t2))
+
+        if near > far or far < 0.0 or near > maxDistance:
+            return None
+
+        return near
+
+    def firstHit(self, origin, direction, maxDistance = _infinity):
+
+        # Find the first face hit by the ray origin + t * direction, t >= 0. Both sides of
+        # faces count. Returns None if nothing is hit, otherwise a tuple with the face index,
+        # t and the barycentric coordinates of the hit point, ie the weights of the three
+        # corners of faces[faceIndex].
+
+        (ox, oy, oz) = [float(value) for value in origin]
+        (dx, dy, dz) = [float(value) for value in direction]
+
+        # Inverse direction for the slab tests. Axis parallel rays get a huge value rather
+        # than a division by zero.
+        ix = 1.0 / dx if dx != 0.0 else 1e300
+        iy = 1.0 / dy if dy != 0.0 else 1e300
+        iz = 1.0 / dz if dz != 0.0 else 1e300
+
+        bestT = maxDistance
+        bestFace = -1
+        bestU = 0.0
+        bestV = 0.0
+
+        children = self._children
+        starts = self._starts
+        counts = self._counts
+        faceOrigins = self._faceOrigins
+        faceEdges1 = self._faceEdges1
+        faceEdges2 = self._faceEdges2
+
+        if self._counts[0] == 0 or self._rayBoxEntry(0, ox, oy, oz, ix, iy, iz, bestT) is None:
+            return None
+
+        stack = [0]
+
+        while len(stack) > 0:
+
+            node = stack.pop()
+            child = children[node]
+
+            if child >= 0:
+
+                # Visit the nearer child first, by pushing it last
+                nearT = self._rayBoxEntry(child, ox, oy, oz, ix, iy, iz, bestT)
+                farT = self._rayBoxEntry(child + 1, ox, oy, oz, ix, iy, iz, bestT)
+
+                if nearT is None:
+                    if not farT is None:
+                        stack.append(child + 1)
+                elif farT is None:
+                    stack.append(child)
+                elif nearT <= farT:
+                    stack.append(child + 1)
+                    stack.append(child)
+                else:
+                    stack.append(child)
+                    stack.append(child + 1)
+
+                continue
+
+            # Leaf: Moller-Trumbore intersection with each face
+            position = starts[node]
+            end = position + counts[node]
+
+            while position < end:
+
+                (e1x, e1y, e1z) = faceEdges1[position]
+                (e2x, e2y, e2z) = faceEdges2[position]
+
+                px = dy * e2z - dz * e2y
+                py = dz * e2x - dx * e2z
+                pz = dx * e2y - dy * e2x
+
+                determinant = e1x * px + e1y * py + e1z * pz
+
+                if determinant > 1e-15 or determinant < -1e-15:
+
+                    inverse = 1.0 / determinant
+
+                    (v0x, v0y, v0z) = faceOrigins[position]
+                    sx = ox - v0x
+                    sy = oy - v0y
+                    sz = oz - v0z
+
+                    u = (sx * px + sy * py + sz * pz) * inverse
+
+                    if u >= 0.0 and u <= 1.0:
+
+                        qx = sy * e1z - sz * e1y
+                        qy = sz * e1x - sx * e1z
+                        qz = sx * e1y - sy * e1x
+
+                        v = (dx * qx + dy * qy + dz * qz) * inverse
+
+                        if v >= 0.0 and u + v <= 1.0:
+
+                            t = (e2x * qx + e2y * qy + e2z * qz) * inverse
+
+                            if t >= 0.0 and t < bestT:
+                                bestT = t
+                                bestFace = position
+                                bestU = u
+                                bestV = v
+
+                position = position + 1
+
+        if bestFace < 0:
+            return None
+
+        return (self._faceIndices[bestFace], bestT, (1.0 - bestU - bestV, bestU, bestV))
+
+    def pickVertex(self, origin, direction, maxDistance = _infinity):
+
+        # Find the vertex closest to where the ray first hits the mesh. Returns None if
+        # nothing is hit, otherwise a tuple with the vertex index and the face index.
+
+        hit = self.firstHit(origin, direction, maxDistance)
+
+        if hit is None:
+            return None
+
+        (face, t, barycentrics) = hit
+
+        corner = barycentrics.index(max(barycentrics))
+
+        return (int(self.wavefront.faces[face][corner]), face)
+
+    def nearestVertex(self, point, maxDistance = _infinity):
+
+        # Find the vertex (among those used by faces) closest to the given point. Returns
+        # None if there is none within maxDistance, otherwise a tuple with the vertex index
+        # and the distance.
+
+        (px, py, pz) = [float(value) for value in point]
+
+        bestSquared = maxDistance * maxDistance
+        bestVertex = -1
+
+        nodes = self._nodes
+        children = self._children
+        starts = self._starts
+        counts = self._counts
+        faceCorners = self._faceCorners
+        coords = self._coords
+
+        if self._counts[0] == 0:
+            return None
+
+        # Stack of (squared distance to box, node)
+        stack = [ (0.0, 0) ]
+
+        while len(stack) > 0:
+
+            (boxSquared, node) = stack.pop()
+
+            if boxSquared >= bestSquared:
+                continue
+
+            child = children[node]
+
+            if child >= 0:
+
+                entries = []
+                for candidate in (child, child + 1):
+                    (minX, minY, minZ, maxX, maxY, maxZ) = nodes[candidate]
+                    ddx = max(minX - px, 0.0, px - maxX)
+                    ddy = max(minY - py, 0.0, py - maxY)
+                    ddz = max(minZ - pz, 0.0, pz - maxZ)
+                    entries.append( (ddx * ddx + ddy * ddy + ddz * ddz, candidate) )
+
+                # Visit the nearer child first, by pushing it last
+                if entries[0][0] <= entries[1][0]:
+                    stack.append(entries[1])
+                    stack.append(entries[0])
+                else:
+                    stack.append(entries[0])
+                    stack.append(entries[1])
+
+                continue
+
+            position = starts[node]
+            end = position + counts[node]
+
+            while position < end:
+                for vertex in faceCorners[position]:
+                    (vx, vy, vz) = coords[vertex]
+                    squared = (vx - px) * (vx - px) + (vy - py) * (vy - py) + (vz - pz) * (vz - pz)
+                    if squared < bestSquared:
+                        bestSquared = squared
+                        bestVertex = vertex
+                position = position + 1
+
+        if bestVertex < 0:
+            return None
+
+        return (bestVertex, math.sqrt(bestSquared))
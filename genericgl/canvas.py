@@ -9,6 +9,7 @@ from PyQt5.QtGui import *
 from PyQt5.QtCore import *
 
 from .simpledebug import info
+from .glstate import GlState
 
 class Canvas(QOpenGLWidget):
 
@@ -17,9 +18,14 @@ class Canvas(QOpenGLWidget):
         self.app = app
         self.requestedVersion = requestedGLVersion
 
+        # Tracks what is bound in the context, see GlState. Created in initializeGL().
+        self.glState = None
+
         super(Canvas, self).__init__(parent)
 
         self.destroyed.connect(self._on_destroyed)
+        self.frameSwapped.connect(self._on_frameSwapped)
+        self.resized.connect(self._on_resized)
 
     def _on_destroyed(self, *args):
         info("CANVAS","about to be destroyed")
@@ -27,6 +33,20 @@ class Canvas(QOpenGLWidget):
         self.closeGL()
         self.doneCurrent()
 
+    def _on_frameSwapped(self):
+        # Make the state change counters of the frame just drawn available in
+        # glState.frameIssued and glState.frameSkipped. Qt may change GL state between
+        # frames (it recreates the framebuffer object on resizes, for example, which resets
+        # the texture binding), so every frame starts out with nothing known.
+        if not self.glState is None:
+            self.glState.endFrame()
+            self.glState.invalidate()
+
+    def _on_resized(self):
+        # The framebuffer object has been recreated, see above
+        if not self.glState is None:
+            self.glState.invalidate()
+
     # Override if necessary
     def minimumSizeHint(self):
         info("CANVAS","minimumSizeHint() is not overridden")
@@ -37,6 +57,14 @@ class Canvas(QOpenGLWidget):
         info("CANVAS","sizeHint() is not overridden")
         return QSize(600, 600)
 
+    def pixelsPerUnit(self, globalScale = 1.0):
+
+        # How many pixels one unit in object coordinates covers on screen. This assumes
+        # the viewport scaling used in the tests, where the shorter side of the widget
+        # spans -1.0 to 1.0 and globalScale is the W component of viewportScaling. Use
+        # this for picking a level of detail, see LodChain.selectLevel()
+        return min(self.width(), self.height()) * self.devicePixelRatioF() / 2.0 / globalScale
+
     def dumpGLLogMessages(self, location = None):
 
         currentError = self.gl.glGetError()
@@ -102,10 +130,14 @@ class Canvas(QOpenGLWidget):
         self.gl = self.context().versionFunctions(self.profile)
         self.gl.initializeOpenGLFunctions()
 
+        # Bind programs, VAOs, buffers and textures and enable capabilities through glState
+        # in paintGL(), and redundant changes within a frame are dropped
+        self.glState = GlState(self.gl)
+
         # Enable GL capabilities we need
-        self.gl.glEnable(self.gl.GL_DEBUG_OUTPUT_SYNCHRONOUS);
-        self.gl.glEnable(self.gl.GL_DEPTH_TEST);
-        self.gl.glEnable(self.gl.GL_VERTEX_PROGRAM_POINT_SIZE)
+        self.glState.enable(self.gl.GL_DEBUG_OUTPUT_SYNCHRONOUS);
+        self.glState.enable(self.gl.GL_DEPTH_TEST);
+        self.glState.enable(self.gl.GL_VERTEX_PROGRAM_POINT_SIZE)
 
         info("PROFILE",self.profile)
         info("FUNCTIONS",self.gl)
@@ -124,6 +156,10 @@ class Canvas(QOpenGLWidget):
 
         self.setupGL()
 
+        # setupGL() binds things directly, so the state glState has recorded is no longer
+        # what is bound
+        self.glState.invalidate()
+
     # Override this
     def setupGL(self):
         info("CANVAS","setupGL() is not overridden")
@@ -0,0 +1,511 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import numpy
+
+from .simpledebug import info
+from .wavefront import Wavefront, indexTypeFor
+from .vertexcache import tipsify
+
+# Level of detail (LOD) generation with quadric error metrics (Garland and Heckbert,
+# "Surface Simplification Using Quadric Error Metrics", 1997).
+#
+# Each vertex gets a quadric, which is the sum of the (area weighted) squared
+# distance functions to the planes of the faces around it. Collapsing the edge from
+# vertex u to vertex v costs the quadric error of v's position under the summed
+# quadrics of u and v.
+#
+# Only half-edge collapses are made, ie u is moved onto v and no new positions are
+# ever created. All levels are therefore index buffers over the same (seam split)
+# vertex stream as the full mesh, so a single vertex buffer serves the whole chain.
+#
+# Rather than collapsing one edge at a time from a priority queue, each pass picks
+# the cheapest collapse per vertex, throws out collapses which would flip a face or
+# break the topology, and applies a set of collapses whose neighbourhoods do not
+# overlap all at once. All of this is done with array operations.
+#
+# Vertices on boundaries and UV seams are locked. In the split vertex stream seams
+# are boundaries too, so both are found as edges not shared by exactly two faces.
+
+# Bump this whenever the layout or contents of saved LOD chains change
+LOD_FORMAT_VERSION = 2
+
+# The fraction of faces kept for each level after the full mesh
+DEFAULT_LOD_RATIOS = (0.5, 0.25, 0.125, 0.0625)
+
+# Collapses which turn a face more than this (as the cosine of the angle between the
+# old and the new normal) are rejected
+_minimumNormalDot = 0.25
+
+# Only the cheapest part of the valid collapses are considered in each pass, so that
+# cheap collapses are not crowded out by expensive ones nearby
+_candidateFraction = 0.5
+
+def _expandRanges(offsets, items):
+
+    # For CSR arrays, return a tuple with the position in items of each element, and
+    # which of the given items it belongs to
+
+    starts = offsets[items]
+    counts = offsets[items + 1] - starts
+
+    owners = numpy.repeat(numpy.arange(len(items)), counts)
+    positions = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts) + numpy.repeat(starts, counts)
+
+    return (positions, owners)
+
+
+def _vertexFaces(faces, numberOfVertices):
+
+    # CSR form lists of the faces around each vertex
+
+    flatFaces = faces.ravel()
+
+    incidentFaces = numpy.argsort(flatFaces, kind="stable") // 3
+
+    offsets = numpy.zeros(numberOfVertices + 1, dtype=int)
+    numpy.cumsum(numpy.bincount(flatFaces, minlength=numberOfVertices), out=offsets[1:])
+
+    return (offsets, incidentFaces)
+
+
+def _edgeKeys(a, b, numberOfVertices):
+
+    # Encode undirected edges as single ints
+    return numpy.minimum(a, b) * numberOfVertices + numpy.maximum(a, b)
+
+
+def _faceNormals(positions, faces):
+
+    # Unnormalized normals, ie with a length of twice the face area
+    corners = positions[faces]
+    return numpy.cross(corners[:,1] - corners[:,0], corners[:,2] - corners[:,0])
+
+
+def _vertexQuadrics(positions, faces, numberOfVertices):
+
+    # Return a tuple with a (n, 4, 4) array of quadrics and the summed face area around
+    # each vertex
+
+    normals = _faceNormals(positions, faces)
+    doubleAreas = numpy.linalg.norm(normals, axis=1)
+
+    unitNormals = numpy.zeros(normals.shape, dtype=float)
+    nonZero = doubleAreas > 0
+    unitNormals[nonZero] = normals[nonZero] / doubleAreas[nonZero,None]
+
+    planes = numpy.empty( (len(faces), 4), dtype=float )
+    planes[:,0:3] = unitNormals
+    planes[:,3] = -numpy.einsum("ij,ij->i", unitNormals, positions[faces[:,0]])
+
+    areas = doubleAreas / 2.0
+    faceQuadrics = (planes[:,:,None] * planes[:,None,:]).reshape(-1, 16) * areas[:,None]
+
+    # Scatter the face quadrics on the corners, one component at a time
+    flatFaces = faces.ravel()
+    quadrics = numpy.empty( (numberOfVertices, 16), dtype=float )
+    for component in range(16):
+        quadrics[:,component] = numpy.bincount(flatFaces, weights=numpy.repeat(faceQuadrics[:,component], 3), minlength=numberOfVertices)
+
+    weights = numpy.bincount(flatFaces, weights=numpy.repeat(areas, 3), minlength=numberOfVertices)
+
+    return (quadrics.reshape(-1, 4, 4), weights)
+
+
+def _lockedVertices(faces, splitVertexMap, numberOfVertices):
+
+    # Vertices which must never be moved: those on edges that do not have exactly two
+    # faces (boundaries, UV seams and non manifold edges), and those whose position is
+    # shared by several split vertices
+
+    keys = _edgeKeys(faces.ravel(), faces[:, [1, 2, 0]].ravel(), numberOfVertices)
+    (uniqueKeys, counts) = numpy.unique(keys, return_counts=True)
+
+    openEdges = uniqueKeys[counts != 2]
+
+    locked = numpy.zeros(numberOfVertices, dtype=bool)
+    locked[openEdges // numberOfVertices] = True
+    locked[openEdges % numberOfVertices] = True
+
+    copies = numpy.bincount(splitVertexMap)
+    locked[copies[splitVertexMap] > 1] = True
+
+    return locked
+
+
+class _Decimator():
+
+    # Holds the state of a decimation in progress, so that a chain of levels can be made
+    # by continuing from the previous level
+
+    def __init__(self, positions, faces, splitVertexMap):
+
+        self.positions = positions
+        self.faces = faces
+        self.numberOfVertices = len(positions)
+
+        (self.quadrics, self.weights) = _vertexQuadrics(positions, faces, self.numberOfVertices)
+        self.locked = _lockedVertices(faces, splitVertexMap, self.numberOfVertices)
+
+        # The largest error (as a distance) of any collapse made so far
+        self.error = 0.0
+
+    def _candidates(self):
+
+        # Return a tuple of arrays (u, v, cost, error) with the cheapest collapse for each
+        # vertex which may be moved
+
+        faces = self.faces
+
+        u = numpy.concatenate( (faces.ravel(), faces.ravel()) )
+        v = numpy.concatenate( (faces[:, [1, 2, 0]].ravel(), faces[:, [2, 0, 1]].ravel()) )
+
+        movable = ~self.locked[u]
+        u = u[movable]
+        v = v[movable]
+
+        # Error of v's position under the summed quadric of u and v
+        quadrics = self.quadrics[u] + self.quadrics[v]
+        homogeneous = numpy.ones( (len(v), 4), dtype=float )
+        homogeneous[:,0:3] = self.positions[v]
+
+        cost = numpy.einsum("ei,eij,ej->e", homogeneous, quadrics, homogeneous)
+        cost = numpy.maximum(cost, 0.0)
+
+        # Keep the cheapest collapse for each u
+        order = numpy.lexsort( (cost, u) )
+        first = numpy.ones(len(order), dtype=bool)
+        first[1:] = u[order][1:] != u[order][:-1]
+        best = order[first]
+
+        u = u[best]
+        v = v[best]
+        cost = cost[best]
+
+        weights = self.weights[u] + self.weights[v]
+        error = numpy.sqrt(cost / numpy.maximum(weights, 1e-300))
+
+        return (u, v, cost, error)
+
+    def _validCollapses(self, u, v, offsets, incidentFaces):
+
+        # Return a mask of the collapses which neither flip nor degenerate a face, and
+        # which keep the mesh manifold
+
+        faces = self.faces
+
+        # Faces around u, and whether they contain v
+        (positions, owners) = _expandRanges(offsets, u)
+        ringFaces = incidentFaces[positions]
+        ringCorners = faces[ringFaces]
+
+        containsV = (ringCorners == v[owners,None]).any(axis=1)
+
+        # Faces which contain both u and v disappear. The others get u replaced with v.
+        movedCorners = numpy.where(ringCorners == u[owners,None], v[owners,None], ringCorners)
+
+        oldNormals = _faceNormals(self.positions, ringCorners)
+        newNormals = _faceNormals(self.positions, movedCorners)
+
+        oldLength = numpy.linalg.norm(oldNormals, axis=1)
+        newLength = numpy.linalg.norm(newNormals, axis=1)
+
+        dot = numpy.einsum("ij,ij->i", oldNormals, newNormals)
+        flipped = ~containsV & ( (dot < _minimumNormalDot * oldLength * newLength) | (newLength <= 1e-12 * oldLength) )
+
+        valid = numpy.bincount(owners, weights=flipped, minlength=len(u)) == 0
+
+        # Link condition: the vertices which are neighbours to both u and v must be exactly
+        # the two opposite corners of the faces on the edge, otherwise the collapse would
+        # create duplicate faces or non manifold edges
+        sharedFaces = numpy.bincount(owners, weights=containsV, minlength=len(u))
+
+        neighbours = ringCorners.ravel()
+        neighbourOwners = numpy.repeat(owners, 3)
+        isOther = (neighbours != u[neighbourOwners]) & (neighbours != v[neighbourOwners])
+
+        neighbours = neighbours[isOther]
+        neighbourOwners = neighbourOwners[isOther]
+
+        # Count each neighbour of u only once per collapse
+        pairs = numpy.unique(neighbourOwners * self.numberOfVertices + neighbours)
+        neighbourOwners = pairs // self.numberOfVertices
+        neighbours = pairs % self.numberOfVertices
+
+        edges = numpy.unique(_edgeKeys(faces.ravel(), faces[:, [1, 2, 0]].ravel(), self.numberOfVertices))
+        keys = _edgeKeys(neighbours, v[neighbourOwners], self.numberOfVertices)
+        found = numpy.searchsorted(edges, keys)
+        found[found >= len(edges)] = 0
+        isCommon = edges[found] == keys
+
+        commonNeighbours = numpy.bincount(neighbourOwners, weights=isCommon, minlength=len(u))
+
+        valid = valid & (sharedFaces == 2) & (commonNeighbours == 2)
+
+        return valid
+
+    def _independentCollapses(self, u, v, offsets, incidentFaces):
+
+        # Given collapses sorted by cost, return a mask of the ones which are the cheapest
+        # among all collapses touching any of the faces around u or v. The faces (and thus
+        # the neighbourhoods) of the selected collapses do not overlap, so they can all be
+        # applied at the same time.
+
+        rank = numpy.arange(len(u))
+
+        (uPositions, uOwners) = _expandRanges(offsets, u)
+        (vPositions, vOwners) = _expandRanges(offsets, v)
+
+        regionFaces = incidentFaces[numpy.concatenate( (uPositions, vPositions) )]
+        regionOwners = numpy.concatenate( (uOwners, vOwners) )
+
+        faceMinimum = numpy.full(len(self.faces), len(u), dtype=int)
+        numpy.minimum.at(faceMinimum, regionFaces, rank[regionOwners])
+
+        beaten = faceMinimum[regionFaces] != regionOwners
+
+        return numpy.bincount(regionOwners, weights=beaten, minlength=len(u)) == 0
+
+    def decimate(self, targetFaceCount):
+
+        # Collapse edges until there are no more than targetFaceCount faces, or until no
+        # more collapses are possible. Returns the number of faces left.
+
+        while len(self.faces) > targetFaceCount:
+
+            (u, v, cost, error) = self._candidates()
+
+            (offsets, incidentFaces) = _vertexFaces(self.faces, self.numberOfVertices)
+
+            valid = self._validCollapses(u, v, offsets, incidentFaces)
+            u = u[valid]
+            v = v[valid]
+            cost = cost[valid]
+            error = error[valid]
+
+            if len(u) == 0:
+                break
+
+            order = numpy.argsort(cost, kind="stable")
+            order = order[:max(1, int(len(order) * _candidateFraction))]
+
+            u = u[order]
+            v = v[order]
+            error = error[order]
+
+            independent = self._independentCollapses(u, v, offsets, incidentFaces)
+            u = u[independent]
+            v = v[independent]
+            error = error[independent]
+
+            # Each collapse removes two faces. Do not overshoot the target.
+            allowed = max(1, (len(self.faces) - targetFaceCount + 1) // 2)
+            u = u[:allowed]
+            v = v[:allowed]
+            error = error[:allowed]
+
+            remap = numpy.arange(self.numberOfVertices)
+            remap[u] = v
+
+            faces = remap[self.faces]
+            keep = (faces[:,0] != faces[:,1]) & (faces[:,1] != faces[:,2]) & (faces[:,2] != faces[:,0])
+            self.faces = faces[keep]
+
+            numpy.add.at(self.quadrics, v, self.quadrics[u])
+            numpy.add.at(self.weights, v, self.weights[u])
+
+            self.error = max(self.error, float(error.max()))
+
+        return len(self.faces)
+
+
+class LodChain():
+
+    # A chain of levels of detail for a mesh. Level 0 is the full mesh. All levels index
+    # the same seam split vertex stream, ie Wavefront.splitVertexMap and the vertex data
+    # in a mesh file, so they can be drawn from the same vertex buffer.
+
+    def __init__(self, levels, errors, vertexCount, vertexCacheOptimized = False, triangulateQuads = True, ratios = DEFAULT_LOD_RATIOS):
+
+        # Index arrays suitable for glDrawElements(), three indices per face. These are
+        # uint16 if possible and uint32 otherwise, see indexTypeFor(). Meshes too large for
+        # uint16 are split into chunks in mesh files, and the levels then do not apply.
+        self.levels = levels
+
+        # For each level, an estimate of how far (in object coordinates) its surface may
+        # be from that of the full mesh
+        self.errors = errors
+
+        self.vertexCount = vertexCount
+        self.vertexCacheOptimized = vertexCacheOptimized
+
+        # The settings the chain was built with, see loadLodChain()
+        self.triangulateQuads = bool(triangulateQuads)
+        self.ratios = tuple([float(ratio) for ratio in ratios])
+
+        self.sourceMtime = 0
+        self.sourceSize = 0
+
+    def getLevel(self, level):
+        return self.levels[level]
+
+    def getFaceCounts(self):
+        return [len(indices) // 3 for indices in self.levels]
+
+    def selectLevel(self, pixelsPerUnit, pixelTolerance = 1.0):
+
+        # Return the coarsest level whose error, as projected on screen, is at most
+        # pixelTolerance pixels. pixelsPerUnit is how many pixels one unit in object
+        # coordinates covers, see Canvas.pixelsPerUnit()
+
+        selected = 0
+        level = 0
+        while level < len(self.levels):
+            if self.errors[level] * pixelsPerUnit <= pixelTolerance:
+                selected = level
+            level = level + 1
+
+        return selected
+
+    def save(self, path, sourcePath = None):
+
+        # Write the chain as a .npz file. If sourcePath is given, the mtime and size of that
+        # file is recorded, so that loadLodChain() can tell when the chain is out of date.
+
+        header = dict()
+        header["formatVersion"] = LOD_FORMAT_VERSION
+        header["vertexCount"] = self.vertexCount
+        header["vertexCacheOptimized"] = self.vertexCacheOptimized
+        header["triangulateQuads"] = self.triangulateQuads
+        header["ratios"] = list(self.ratios)
+        header["errors"] = list(self.errors)
+        header["sourceMtime"] = 0
+        header["sourceSize"] = 0
+
+        if not sourcePath is None:
+            stat = os.stat(sourcePath)
+            header["sourceMtime"] = stat.st_mtime_ns
+            header["sourceSize"] = stat.st_size
+
+        levels = dict()
+        for level in range(len(self.levels)):
+            levels["level" + str(level)] = self.levels[level]
+
+        # Write to a temporary file and move it in place, so that an interrupted write
+        # never leaves a half written file behind
+        temporaryPath = path + ".tmp"
+
+        with open(temporaryPath, "wb") as file:
+            numpy.savez(file, header = numpy.array(json.dumps(header)), **levels)
+
+        os.replace(temporaryPath, path)
+
+        info("LOD CHAIN", "wrote " + path)
+
+
+def readLodChain(path):
+
+    if not os.path.exists(path):
+        raise IOError(path + " does not exist")
+
+    with numpy.load(path) as data:
+
+        if not "header" in data.files:
+            raise ValueError(path + " is not a LOD chain")
+
+        header = json.loads(str(data["header"]))
+
+        if header["formatVersion"] != LOD_FORMAT_VERSION:
+            raise ValueError(path + " has LOD format version " + str(header["formatVersion"]) + ", expected " + str(LOD_FORMAT_VERSION))
+
+        levels = []
+        for level in range(len(header["errors"])):
+            levels.append(data["level" + str(level)])
+
+    chain = LodChain(levels, header["errors"], header["vertexCount"], header["vertexCacheOptimized"], header["triangulateQuads"], header["ratios"])
+    chain.sourceMtime = header["sourceMtime"]
+    chain.sourceSize = header["sourceSize"]
+
+    return chain
+
+
+def buildLodChain(wavefront, ratios = DEFAULT_LOD_RATIOS, optimizeLevels = True):
+
+    # Build a LodChain for the seam split faces of a Wavefront object. Each entry in ratios
+    # gives the fraction of the full mesh's faces to keep for one level, and they should
+    # be decreasing. Levels which cannot be decimated any further (because everything
+    # left is locked) are not added. If optimizeLevels is True, the faces of each level
+    # are reordered for the vertex cache, see vertexcache.py.
+
+    splitVertexMap = wavefront.splitVertexMap
+    vertexCount = len(splitVertexMap)
+
+    positions = numpy.asarray(wavefront.vertexCoords, dtype=float)[splitVertexMap]
+    faces = numpy.asarray(wavefront.splitFaces)
+
+    indexType = indexTypeFor(vertexCount)
+
+    decimator = _Decimator(positions, faces, splitVertexMap)
+
+    levels = [faces.ravel().astype(indexType)]
+    errors = [0.0]
+
+    for ratio in ratios:
+
+        before = len(decimator.faces)
+        after = decimator.decimate(int(len(faces) * ratio))
+
+        if after >= before:
+            info("LOD CHAIN", "unable to decimate below " + str(after) + " faces")
+            break
+
+        levelFaces = decimator.faces
+        if optimizeLevels:
+            levelFaces = levelFaces[tipsify(levelFaces, vertexCount)]
+
+        levels.append(levelFaces.ravel().astype(indexType))
+        errors.append(decimator.error)
+
+        info("LOD LEVEL " + str(len(levels) - 1), str(after) + " faces, error " + str(round(decimator.error, 6)))
+
+    return LodChain(levels, errors, vertexCount, not wavefront.originalVertexIndices is None, wavefront.triangulateQuads, ratios)
+
+
+def loadLodChain(objPath, lodPath = None, triangulateQuads = True, optimizeForVertexCache = False, ratios = DEFAULT_LOD_RATIOS):
+
+    # Return a LodChain for a wavefront obj. The chain is (re)built from the obj if it is
+    # missing, if the obj has changed since it was written or if it was written with a
+    # different triangulateQuads, optimizeForVertexCache or ratios setting. Use the
+    # same settings as for loadMeshFile(), so that the levels match the vertices in the
+    # mesh file.
+
+    if lodPath is None:
+        lodPath = objPath + ".lod.npz"
+
+    stat = os.stat(objPath)
+
+    if os.path.exists(lodPath):
+        try:
+            chain = readLodChain(lodPath)
+            if chain.sourceMtime == stat.st_mtime_ns and chain.sourceSize == stat.st_size:
+                if chain.triangulateQuads != triangulateQuads:
+                    info("LOD CHAIN", "different triangulation, rebuilding " + lodPath)
+                elif chain.vertexCacheOptimized != optimizeForVertexCache:
+                    info("LOD CHAIN", "different vertex cache optimization, rebuilding " + lodPath)
+                elif chain.ratios != tuple([float(ratio) for ratio in ratios]):
+                    info("LOD CHAIN", "different ratios, rebuilding " + lodPath)
+                else:
+                    return chain
+            else:
+                info("LOD CHAIN", "out of date, rebuilding " + lodPath)
+        except (ValueError, KeyError) as e:
+            info("LOD CHAIN", "unable to use " + lodPath + " (" + str(e) + ")")
+
+    wavefront = Wavefront(objPath, triangulateQuads, optimizeForVertexCache=optimizeForVertexCache)
+
+    chain = buildLodChain(wavefront, ratios)
+    chain.save(lodPath, objPath)
+
+    return readLodChain(lodPath)
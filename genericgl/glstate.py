@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from PyQt5.QtGui import QOpenGLBuffer
+
+# A record of the GL state bound through it: the program, the VAO, the vertex and
+# index buffers, the texture on each texture unit and enable flags. Asking for what is
+# already bound does nothing, so draws can simply ask for everything they need, and
+# nothing has to be released between them.
+#
+# The tracker only knows about changes made through it. Canvas keeps one GlState per
+# context and invalidates it at the end of every frame (and when the widget is
+# resized), since Qt may change state between frames. Within a frame, code which
+# binds things directly (such as creating a QOpenGLTexture) after something has been
+# bound through the tracker must call invalidate(), so that the next request for each
+# kind of state is passed on to GL. GpuMesh.create() takes the GlState and binds
+# through it.
+#
+# Every request that is passed on to GL counts as issued, and every one found to be
+# redundant as skipped. Canvas rolls the counters over each time a frame has been
+# swapped, see Canvas.glState.
+
+GL_TEXTURE_2D = 0x0DE1
+GL_TEXTURE0 = 0x84C0
+
+# Stands for state which the tracker does not know
+_UNKNOWN = object()
+
+class GlState():
+
+    def __init__(self, gl):
+
+        # gl is the canvas' GL functions
+
+        self.gl = gl
+
+        # Number of state changes issued and skipped in the frame being drawn, and in the
+        # last frame which was swapped
+        self.issued = 0
+        self.skipped = 0
+        self.frameIssued = 0
+        self.frameSkipped = 0
+
+        self.invalidate()
+
+    def invalidate(self):
+
+        # Forget all recorded state
+        self._program = _UNKNOWN
+        self._vao = _UNKNOWN
+        self._buffers = dict()
+        self._textures = dict()
+        self._activeUnit = _UNKNOWN
+        self._enabled = dict()
+
+    def endFrame(self):
+
+        # Keep the counters of the frame which was just drawn and start counting anew
+        self.frameIssued = self.issued
+        self.frameSkipped = self.skipped
+        self.issued = 0
+        self.skipped = 0
+
+    def _changed(self, current, wanted):
+
+        # Count the request, and tell whether it needs to be passed on to GL
+
+        if current is wanted or (not current is _UNKNOWN and current == wanted):
+            self.skipped = self.skipped + 1
+            return False
+
+        self.issued = self.issued + 1
+        return True
+
+    def useProgram(self, program):
+
+        # Bind a QOpenGLShaderProgram, or no program if None
+
+        if not self._changed(self._program, program):
+            return
+
+        if program is None:
+            self.gl.glUseProgram(0)
+        else:
+            program.bind()
+
+        self._program = program
+
+    def bindVertexArray(self, vao):
+
+        # Bind a QOpenGLVertexArrayObject, or release the bound one if None. Releasing
+        # needs the bound VAO, so when it is not known nothing is done (or counted).
+
+        if vao is None and self._vao is _UNKNOWN:
+            return
+
+        if not self._changed(self._vao, vao):
+            return
+
+        if vao is None:
+            self._vao.release()
+        else:
+            vao.bind()
+
+        self._vao = vao
+
+        # The index buffer binding belongs to the VAO, so it is whatever this one has
+        self._buffers.pop(QOpenGLBuffer.IndexBuffer, None)
+
+    def bindBuffer(self, buffer, bufferType = QOpenGLBuffer.VertexBuffer):
+
+        # Bind a QOpenGLBuffer, or release the buffer of the given type if None
+
+        if not buffer is None:
+            bufferType = buffer.type()
+
+        if not self._changed(self._buffers.get(bufferType, _UNKNOWN), buffer):
+            return
+
+        if buffer is None:
+            QOpenGLBuffer.release(bufferType)
+        else:
+            buffer.bind()
+
+        self._buffers[bufferType] = buffer
+
+    def bindTexture(self, texture, unit = 0):
+
+        # Bind a QOpenGLTexture to a texture unit, or release the texture on it if None
+
+        if not self._changed(self._textures.get(unit, _UNKNOWN), texture):
+            return
+
+        if texture is None:
+            current = self._textures.get(unit, _UNKNOWN)
+            if current is _UNKNOWN:
+                # Whatever is bound is not known, so unbind the 2D target directly
+                self.gl.glActiveTexture(GL_TEXTURE0 + unit)
+                self.gl.glBindTexture(GL_TEXTURE_2D, 0)
+            else:
+                current.release(unit)
+        else:
+            texture.bind(unit)
+
+        # Both bind() and release() leave the unit active
+        self._textures[unit] = texture
+        self._activeUnit = unit
+
+    def activeTexture(self, unit):
+
+        # Make a texture unit active, for code which binds textures directly
+
+        if not self._changed(self._activeUnit, unit):
+            return
+
+        self.gl.glActiveTexture(GL_TEXTURE0 + unit)
+
+        self._activeUnit = unit
+
+    def enable(self, capability):
+        self._setEnabled(capability, True)
+
+    def disable(self, capability):
+        self._setEnabled(capability, False)
+
+    def _setEnabled(self, capability, enabled):
+
+        if not self._changed(self._enabled.get(capability, _UNKNOWN), enabled):
+            return
+
+        if enabled:
+            self.gl.glEnable(capability)
+        else:
+            self.gl.glDisable(capability)
+
+        self._enabled[capability] = enabled
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy
+
+from PyQt5.QtGui import QOpenGLBuffer, QOpenGLVertexArrayObject
+
+from .simpledebug import info
+from .indexbuffer import IndexBuffer
+from .quantize import packWavefront, packMeshFile
+from .wavefront import MAX_SHORT_INDEX_VERTICES
+
+# A mesh on the GPU: a vertex buffer, optionally an index buffer, and a VAO which
+# remembers how the vertex data is fed to the attributes of a shader program.
+#
+# How the vertex data is laid out is described once, by a VertexLayout. The layout
+# functions below give the layouts of the vertex data in a Wavefront, a MeshFile and
+# PackedVertices, so switching between float and packed vertices is a matter of
+# passing positionFormat to gpuMeshFromWavefront() or gpuMeshFromMeshFile(). Packed
+# vertices need a shader which decodes them, see quantize.py.
+#
+# Meshes may consist of several chunks, each with its own range of vertices (see
+# MeshFile). The attributes are then moved to the vertices of each chunk as it is
+# drawn.
+#
+# A mesh made with gpuMeshFromLodChain() instead has one chunk per level of detail,
+# all drawing from the same vertices. Pick a level with LodChain.selectLevel() and
+# draw it with drawLevel().
+
+# GL enums, as passed to setAttributeBuffer() and glDraw*()
+GL_FLOAT = 0x1406
+GL_DOUBLE = 0x140A
+GL_TRIANGLES = 0x0004
+
+# Default names of the attributes in the test shaders
+POSITION_ATTRIBUTE = "somePosition"
+NORMAL_ATTRIBUTE = "inputNormal"
+TEXTURE_ATTRIBUTE = "textureCoordinate"
+
+class VertexLayout():
+
+    def __init__(self, stride):
+
+        # stride is the size in bytes of each vertex specification
+
+        self.stride = stride
+
+        # A list of tuples with the name of the attribute in the shader, its GL type, where
+        # in a vertex specification it starts (in bytes) and how many values it takes
+        self.attributes = []
+
+    def add(self, name, glType, bytesOffset, tupleSize):
+
+        # Add an attribute. Returns the layout, so that calls can be chained.
+
+        self.attributes.append( (name, glType, bytesOffset, tupleSize) )
+
+        return self
+
+
+def floatLayout(itemSize, attributes):
+
+    # Layout of interleaved floats, such as [ [XYZRGBA] [XYZRGBA] ... ]. itemSize is the size
+    # in bytes of one value (4 for float32, 8 for float64) and attributes is a list of tuples
+    # with an attribute name and the number of values it takes, in the order they come in
+    # each vertex. Use None as name for values which should not be fed to the shader.
+
+    glType = GL_FLOAT
+    if itemSize == 8:
+        glType = GL_DOUBLE
+
+    layout = VertexLayout(itemSize * sum([tupleSize for (name, tupleSize) in attributes]))
+
+    bytesOffset = 0
+    for (name, tupleSize) in attributes:
+        if not name is None:
+            layout.add(name, glType, bytesOffset, tupleSize)
+        bytesOffset = bytesOffset + itemSize * tupleSize
+
+    return layout
+
+
+def meshFileLayout(meshFile, position = POSITION_ATTRIBUTE, normal = NORMAL_ATTRIBUTE, texCo = TEXTURE_ATTRIBUTE):
+
+    # Layout of the float32 XYZ NNN TT vertices of a MeshFile. Attributes with the name
+    # None are left out.
+
+    layout = VertexLayout(meshFile.vertexStride)
+
+    if not position is None:
+        layout.add(position, GL_FLOAT, meshFile.positionBytesOffset, 3)
+    if not normal is None:
+        layout.add(normal, GL_FLOAT, meshFile.normalBytesOffset, 3)
+    if not texCo is None:
+        layout.add(texCo, GL_FLOAT, meshFile.textureBytesOffset, 2)
+
+    return layout
+
+
+def packedLayout(packedVertices, position = POSITION_ATTRIBUTE, normal = NORMAL_ATTRIBUTE, texCo = TEXTURE_ATTRIBUTE):
+
+    # Layout of PackedVertices. Positions are passed with three values (the fourth is
+    # padding) and normals with the two values of the octahedral encoding. Attributes
+    # with the name None are left out.
+
+    layout = VertexLayout(packedVertices.vertexStride)
+
+    if not position is None:
+        layout.add(position, packedVertices.positionType, packedVertices.positionBytesOffset, 3)
+    if not normal is None:
+        layout.add(normal, packedVertices.normalType, packedVertices.normalBytesOffset, 2)
+    if not texCo is None:
+        layout.add(texCo, packedVertices.textureType, packedVertices.textureBytesOffset, 2)
+
+    return layout
+
+
+class GpuMesh():
+
+    def __init__(self, vertices, layout, indices = None, chunks = None, mode = GL_TRIANGLES, usagePattern = QOpenGLBuffer.StaticDraw):
+
+        # vertices is anything with the buffer interface holding the vertex data, such as a
+        # numpy array, a memory mapped array or an array.array. indices, if given, is passed
+        # to IndexBuffer. chunks is a list of tuples with the byte offset of a chunk's first
+        # vertex, and the number of its first index (or vertex, without indices) and its
+        # number of indices (or vertices). By default everything is one chunk. mode is the
+        # primitive type to draw.
+        #
+        # Nothing is uploaded until create() is called with a current context.
+
+        self.vertices = numpy.ascontiguousarray(vertices)
+        self.layout = layout
+        self.mode = mode
+        self.usagePattern = usagePattern
+
+        self.vertexCount = self.vertices.nbytes // layout.stride
+
+        self.indexBuffer = None
+        if not indices is None:
+            self.indexBuffer = IndexBuffer(indices)
+
+        if chunks is None:
+            if self.indexBuffer is None:
+                chunks = [ (0, 0, self.vertexCount) ]
+            else:
+                chunks = [ (0, 0, self.indexBuffer.count) ]
+
+        self.chunks = chunks
+
+        # Set by gpuMeshFromWavefront() and gpuMeshFromMeshFile() for packed vertices, see
+        # setDecodeUniforms()
+        self.packedVertices = None
+
+        # Set by gpuMeshFromLodChain(), see drawLevel()
+        self.lodChain = None
+
+        self.program = None
+        self.vao = None
+        self.vertexBuffer = None
+        self._attributeLocations = []
+        self._currentVertexBytesOffset = None
+
+    def create(self, program, state = None):
+
+        # Upload the data and bind the attributes to the (linked) program. Needs a current
+        # context. With a GlState (such as Canvas.glState), the VAO and vertex buffer are
+        # bound through it and left bound, so that it stays right about what is bound.
+
+        self.vao = QOpenGLVertexArrayObject()
+        self.vao.create()
+
+        self.vertexBuffer = QOpenGLBuffer(QOpenGLBuffer.VertexBuffer)
+        self.vertexBuffer.create()
+
+        if state is None:
+            self.vao.bind()
+            self.vertexBuffer.bind()
+        else:
+            state.bindVertexArray(self.vao)
+            state.bindBuffer(self.vertexBuffer)
+
+        self.vertexBuffer.setUsagePattern(self.usagePattern)
+        self.vertexBuffer.allocate(self.vertices, self.vertices.nbytes)
+
+        # Look up the attribute locations once. Attributes the shader does not use (or which
+        # the compiler removed) have location -1 and are skipped.
+        self.program = program
+        self._attributeLocations = []
+
+        for (name, glType, bytesOffset, tupleSize) in self.layout.attributes:
+            location = program.attributeLocation(name)
+            if location < 0:
+                info("GPU MESH", "the program has no attribute " + name)
+                continue
+            self._attributeLocations.append( (location, glType, bytesOffset, tupleSize) )
+
+        # Point the attributes at the vertex data of the first chunk
+        self.bindAttributes(self.chunks[0][0])
+
+        # The VAO remembers the index buffer if it is bound while the VAO is. Its binding is
+        # part of the VAO, which GlState knows, so it needs no telling.
+        if not self.indexBuffer is None:
+            self.indexBuffer.create(self.usagePattern)
+
+        # Releasing the vertex buffer does not affect the VAO, which has already stored the
+        # attribute pointers
+        if state is None:
+            self.vertexBuffer.release()
+            self.vao.release()
+
+        info("GPU MESH", str(self.vertexCount) + " vertices, " + str(self.vertices.nbytes) + " bytes, " + str(len(self.chunks)) + " chunk(s)")
+
+    def bindAttributes(self, vertexBytesOffset = 0):
+
+        # Needs the VAO and the vertex buffer to be bound. vertexBytesOffset is where the first
+        # vertex of the chunk being drawn starts in the vertex buffer.
+
+        for (location, glType, bytesOffset, tupleSize) in self._attributeLocations:
+            self.program.enableAttributeArray(location)
+            self.program.setAttributeBuffer(location, glType, vertexBytesOffset + bytesOffset, tupleSize, self.layout.stride)
+
+        self._currentVertexBytesOffset = vertexBytesOffset
+
+    def setDecodeUniforms(self, program):
+
+        # For packed vertices, set the uniforms the decoding functions in the shader need.
+        # Does nothing for float vertices.
+
+        if not self.packedVertices is None:
+            self.packedVertices.setDecodeUniforms(program)
+
+    def bind(self, state = None):
+
+        # Bind the VAO, through a GlState if given
+
+        if state is None:
+            self.vao.bind()
+        else:
+            state.bindVertexArray(self.vao)
+
+    def release(self):
+        self.vao.release()
+
+    def drawChunk(self, gl, chunk = 0, start = 0, count = None, state = None):
+
+        # Draw count indices (or vertices, without indices) of a chunk, starting at start
+        # within the chunk. All the rest of the chunk is drawn if count is None. Needs the
+        # mesh to be bound. gl is the canvas' GL functions, and state the canvas' GlState if
+        # the mesh was bound through it.
+
+        (vertexBytesOffset, chunkStart, chunkCount) = self.chunks[chunk]
+
+        if count is None:
+            count = chunkCount - start
+
+        # Move the attributes to the vertices of this chunk, unless they are already there
+        if vertexBytesOffset != self._currentVertexBytesOffset:
+            if state is None:
+                self.vertexBuffer.bind()
+                self.bindAttributes(vertexBytesOffset)
+                self.vertexBuffer.release()
+            else:
+                state.bindBuffer(self.vertexBuffer)
+                self.bindAttributes(vertexBytesOffset)
+
+        if self.indexBuffer is None:
+            gl.glDrawArrays(self.mode, chunkStart + start, count)
+        else:
+            self.indexBuffer.draw(gl, self.mode, chunkStart + start, count)
+
+    def draw(self, gl, state = None):
+
+        # Draw the whole mesh, chunk after chunk. The program must be bound. With a GlState,
+        # the VAO is bound through it and left bound, so that drawing the same mesh again
+        # does not bind anything.
+
+        self.bind(state)
+
+        for chunk in range(len(self.chunks)):
+            self.drawChunk(gl, chunk, state=state)
+
+        if state is None:
+            self.release()
+
+    def drawLevel(self, gl, level, state = None):
+
+        # Draw one level of detail of a mesh made with gpuMeshFromLodChain(), for example the
+        # one picked by lodChain.selectLevel(). The program must be bound.
+
+        if self.lodChain is None:
+            raise ValueError("The mesh has no levels of detail")
+
+        self.bind(state)
+
+        self.drawChunk(gl, level, state=state)
+
+        if state is None:
+            self.release()
+
+    def destroy(self):
+
+        # GL objects need to be destroyed explicitly, with the context current
+
+        if not self.vao is None:
+            self.vao.destroy()
+            self.vertexBuffer.destroy()
+            self.vao = None
+            self.vertexBuffer = None
+
+        if not self.indexBuffer is None:
+            self.indexBuffer.destroy()
+
+
+def gpuMeshFromWavefront(wavefront, positionFormat = None, position = POSITION_ATTRIBUTE, normal = NORMAL_ATTRIBUTE, texCo = TEXTURE_ATTRIBUTE, maxChunkVertices = MAX_SHORT_INDEX_VERTICES):
+
+    # A GpuMesh with the seam split vertices and faces of a Wavefront object. positionFormat
+    # None gives float32 vertices, "int16" or "half" gives PackedVertices. Like in a mesh
+    # file, meshes with more than maxChunkVertices vertices are split into chunks (see
+    # Wavefront.getIndexChunks()), so that 16-bit indices can always be used. If
+    # maxChunkVertices is None, the mesh is never split, and large meshes get uint32 indices.
+
+    if maxChunkVertices is None:
+        maxChunkVertices = len(wavefront.splitVertexMap)
+
+    indexChunks = wavefront.getIndexChunks(maxChunkVertices)
+
+    packedVertices = None
+
+    if positionFormat is None:
+        vertices = wavefront.getSplitVertexAndNormalAndTexCoArray()
+        layout = floatLayout(vertices.itemsize, [ (position, 3), (normal, 3), (texCo, 2) ])
+    else:
+        packedVertices = packWavefront(wavefront, positionFormat)
+        vertices = packedVertices.data
+        layout = packedLayout(packedVertices, position, normal, texCo)
+
+    # A single chunk uses all vertices in their own order, otherwise the vertices of each
+    # chunk are put one after the other, the same way writeMeshFile() does
+    if len(indexChunks) > 1:
+        vertices = vertices[numpy.concatenate( [vertexMap for (vertexMap, indices) in indexChunks] )]
+
+    chunks = []
+    vertexStart = 0
+    indexStart = 0
+    for (vertexMap, indices) in indexChunks:
+        chunks.append( (vertexStart * layout.stride, indexStart, len(indices)) )
+        vertexStart = vertexStart + len(vertexMap)
+        indexStart = indexStart + len(indices)
+
+    mesh = GpuMesh(vertices, layout, numpy.concatenate( [indices for (vertexMap, indices) in indexChunks] ), chunks)
+    mesh.packedVertices = packedVertices
+
+    return mesh
+
+
+def gpuMeshFromMeshFile(meshFile, positionFormat = None, position = POSITION_ATTRIBUTE, normal = NORMAL_ATTRIBUTE, texCo = TEXTURE_ATTRIBUTE):
+
+    # A GpuMesh with the vertices, indices and chunks of a MeshFile. positionFormat None
+    # uploads the memory mapped float32 vertices as they are, "int16" or "half" packs them
+    # first, see packMeshFile().
+
+    if positionFormat is None:
+        return GpuMesh(meshFile.vertices, meshFileLayout(meshFile, position, normal, texCo), meshFile.indices, meshFile.bufferChunks)
+
+    packedVertices = packMeshFile(meshFile, positionFormat)
+
+    # The chunks' vertex byte offsets are for the float32 vertices, so recalculate them for
+    # the packed ones
+    chunks = []
+    for (vertexBytesOffset, indexStart, indexCount) in meshFile.bufferChunks:
+        chunks.append( (vertexBytesOffset // meshFile.vertexStride * packedVertices.vertexStride, indexStart, indexCount) )
+
+    mesh = GpuMesh(packedVertices.data, packedLayout(packedVertices, position, normal, texCo), meshFile.indices, chunks)
+    mesh.packedVertices = packedVertices
+
+    return mesh
+
+
+def gpuMeshFromLodChain(meshFile, lodChain, position = POSITION_ATTRIBUTE, normal = NORMAL_ATTRIBUTE, texCo = TEXTURE_ATTRIBUTE):
+
+    # A GpuMesh with the vertices of a MeshFile and the indices of every level of a
+    # LodChain, one after the other in a single index buffer. Each level is a chunk, see
+    # drawLevel(). The chain must have been made with the same settings as the mesh file
+    # (see loadLodChain()), and the mesh file must not be split into chunks, since the
+    # levels index its vertices as a whole.
+
+    if len(meshFile.bufferChunks) != 1 or meshFile.vertexCount != lodChain.vertexCount:
+        raise ValueError("The LOD chain does not match the vertices of " + meshFile.path)
+
+    chunks = []
+    indexStart = 0
+    for indices in lodChain.levels:
+        chunks.append( (0, indexStart, len(indices)) )
+        indexStart = indexStart + len(indices)
+
+    mesh = GpuMesh(meshFile.vertices, meshFileLayout(meshFile, position, normal, texCo), numpy.concatenate(lodChain.levels), chunks)
+    mesh.lodChain = lodChain
+
+    return mesh
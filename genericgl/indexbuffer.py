@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy
+
+from PyQt5 import sip
+from PyQt5.QtGui import QOpenGLBuffer
+
+from .simpledebug import info
+
+# An index buffer which lives on the GPU. The indices are uploaded once, and draws
+# then only pass a byte offset into the buffer, rather than handing glDrawElements()
+# a client side array which has to be converted and copied on every frame.
+#
+# The element array binding is part of the VAO state, so create() should be called
+# while the VAO is bound. Binding the VAO then also binds the index buffer. Note that
+# releasing the index buffer while the VAO is bound removes it from the VAO again.
+
+# GL enums for the index types, as passed to glDrawElements()
+GL_UNSIGNED_BYTE = 0x1401
+GL_UNSIGNED_SHORT = 0x1403
+GL_UNSIGNED_INT = 0x1405
+
+_indexTypes = { 1: GL_UNSIGNED_BYTE, 2: GL_UNSIGNED_SHORT, 4: GL_UNSIGNED_INT }
+
+def _bufferOffset(offset):
+
+    # PyQt's glDrawElements() wants an array for the indices argument. When an index
+    # buffer is bound, GL reads the pointer value as a byte offset into it, so hand it a
+    # void pointer with the offset as its address.
+    return sip.voidptr(offset, 1)
+
+
+class IndexBuffer():
+
+    def __init__(self, indices):
+
+        # indices is anything numpy can turn into an array of unsigned integers, for example
+        # a numpy array, a memory mapped array from a mesh file or an array.array('H')
+
+        self.indices = numpy.ascontiguousarray(indices)
+
+        if not self.indices.dtype.kind in "ui" or not self.indices.itemsize in _indexTypes:
+            raise ValueError("Unsupported index type " + str(self.indices.dtype))
+
+        self.count = self.indices.size
+        self.itemSize = self.indices.itemsize
+
+        # What GL datatype are the indices? This follows from the numpy dtype.
+        self.glIndexType = _indexTypes[self.itemSize]
+
+        self.buffer = None
+
+    def create(self, usagePattern = QOpenGLBuffer.StaticDraw):
+
+        # Upload the indices. Needs a current context, and should be called with the VAO
+        # the indices belong to bound.
+
+        self.buffer = QOpenGLBuffer(QOpenGLBuffer.IndexBuffer)
+        self.buffer.create()
+        self.buffer.bind()
+        self.buffer.setUsagePattern(usagePattern)
+        self.buffer.allocate(self.indices, self.indices.nbytes)
+
+        info("INDEX BUFFER", str(self.count) + " indices, " + str(self.indices.nbytes) + " bytes")
+
+    def bind(self):
+
+        # Only needed when drawing without a VAO, since the VAO remembers the index buffer
+        self.buffer.bind()
+
+    def draw(self, gl, mode, start = 0, count = None):
+
+        # Draw count indices (all the rest if None), starting at index number start. The
+        # index buffer must be bound, usually by binding the VAO. gl is the canvas' GL
+        # functions.
+
+        if count is None:
+            count = self.count - start
+
+        gl.glDrawElements(mode, count, self.glIndexType, _bufferOffset(start * self.itemSize))
+
+    def destroy(self):
+
+        if not self.buffer is None:
+            self.buffer.destroy()
+            self.buffer = None
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import lzma
+import zlib
+import numpy
+
+from .simpledebug import info
+from .vertexcache import tipsify, firstUseVertexOrder
+
+# A compressed file format for the arrays of a Wavefront object, for storing many
+# meshes in little space. Loading a compressed mesh (pass its path to Wavefront)
+# needs no text parsing at all, only a few vectorized passes over each array.
+#
+# The file contains:
+#
+#   * MESHCODEC_MAGIC, followed by the length of the header as an uint32
+#   * A JSON header with counts, quantization settings and the streams in the file
+#   * The streams, each compressed with zlib or lzma
+#
+# Before compression, the data is transformed so that it compresses well:
+#
+#   * Positions and texture coordinates are quantized to integers on a grid over
+#     their bounding box, and delta coded along the vertex order
+#   * Faces are reordered for the vertex cache, and split vertices are renumbered in
+#     the order they are first used. Each index is then stored as its distance
+#     below the next unused vertex, which gives 0 for every new vertex and small
+#     numbers for recently used ones.
+#   * Signed values are zigzag coded (0, -1, 1, -2, ... become 0, 1, 2, 3, ...), stored
+#     with as few bytes as possible, and byte shuffled (all lowest bytes first, then
+#     all second bytes and so on)
+#
+# Normals are not stored. They are recalculated when the mesh is loaded.
+#
+# Vertex coordinates keep the order in the Wavefront object, so morph targets apply as
+# they are. Faces and split vertices are reordered.
+
+MESHCODEC_MAGIC = b"GLTCMSHZ"
+
+# Bump this whenever the layout or contents change, so that old files are never read
+MESHCODEC_VERSION = 1
+
+COMPRESSED_MESH_EXTENSION = ".meshz"
+
+_compressors = {
+    "zlib": (lambda data: zlib.compress(data, 9), zlib.decompress),
+    "lzma": (lambda data: lzma.compress(data, preset=9), lzma.decompress)
+}
+
+def _zigzag(values):
+    return (values << 1) ^ (values >> 63)
+
+
+def _unzigzag(values):
+    return (values >> 1) ^ -(values & 1)
+
+
+def _shuffle(values):
+
+    # Store unsigned values with the smallest possible number of bytes, byte shuffled.
+    # Returns a tuple with the dtype used and the bytes.
+
+    maximum = int(values.max()) if len(values) > 0 else 0
+
+    dtype = "<u1"
+    if maximum > 0xFFFFFFFF:
+        dtype = "<u8"
+    elif maximum > 0xFFFF:
+        dtype = "<u4"
+    elif maximum > 0xFF:
+        dtype = "<u2"
+
+    width = numpy.dtype(dtype).itemsize
+
+    return (dtype, values.astype(dtype).view(numpy.uint8).reshape(-1, width).T.tobytes())
+
+
+def _unshuffle(data, dtype, count):
+
+    width = numpy.dtype(dtype).itemsize
+    planes = numpy.frombuffer(data, dtype=numpy.uint8).reshape(width, count)
+
+    return numpy.ascontiguousarray(planes.T).view(dtype).ravel().astype(numpy.int64)
+
+
+def _deltas(values):
+
+    # Delta code along the first axis, zigzag coded, for each column
+
+    values = values.astype(numpy.int64).reshape(len(values), -1)
+
+    deltas = numpy.diff(values, axis=0, prepend=0)
+
+    return _zigzag(deltas.T.ravel())
+
+
+def _undeltas(values, columns):
+
+    deltas = _unzigzag(values).reshape(columns, -1).T
+
+    return numpy.cumsum(deltas, axis=0)
+
+
+def _quantize(values, bits):
+
+    # Returns a tuple with the integer grid positions, and the lower corner and step of the
+    # grid, such that values ~ lower + grid * step
+
+    lower = values.min(axis=0) if len(values) > 0 else numpy.zeros(values.shape[1])
+    upper = values.max(axis=0) if len(values) > 0 else numpy.zeros(values.shape[1])
+
+    step = (upper - lower) / ((1 << bits) - 1)
+    step[step == 0] = 1.0
+
+    grid = numpy.round( (values - lower) / step ).astype(numpy.int64)
+
+    return (grid, lower, step)
+
+
+def _encodeIndices(faces):
+
+    # Faces must use vertices in first use order, ie each new vertex is one more than the
+    # largest one used so far
+
+    flat = faces.ravel().astype(numpy.int64)
+
+    nextUnused = numpy.maximum.accumulate(flat) + 1
+    nextUnused = numpy.concatenate( ([0], nextUnused[:-1]) )
+
+    return nextUnused - flat
+
+
+def _decodeIndices(codes):
+
+    # A code of zero means a new vertex, so the next unused vertex before each index is
+    # the number of zeros before it
+
+    isNew = codes == 0
+    nextUnused = numpy.cumsum(isNew) - isNew
+
+    return nextUnused - codes
+
+
+def writeCompressedMesh(path, wavefront, compression = "lzma", positionBits = 16, texCoBits = 16, reorderFaces = True):
+
+    # Write a Wavefront object to a compressed mesh file. Positions and texture coordinates
+    # are quantized to the given number of bits per axis. Use positionBits = None to store
+    # positions losslessly. If reorderFaces is True, faces are reordered for the vertex
+    # cache before they are stored.
+
+    if not compression in _compressors:
+        raise ValueError("Unknown compression " + str(compression))
+
+    if not positionBits is None and (positionBits < 1 or positionBits > 31):
+        raise ValueError("positionBits must be between 1 and 31")
+
+    if texCoBits < 1 or texCoBits > 31:
+        raise ValueError("texCoBits must be between 1 and 31")
+
+    compress = _compressors[compression][0]
+
+    splitFaces = numpy.asarray(wavefront.splitFaces)
+    numberOfSplitVertices = len(wavefront.splitVertexMap)
+
+    if reorderFaces:
+        splitFaces = splitFaces[tipsify(splitFaces, numberOfSplitVertices)]
+
+    (newToOld, oldToNew) = firstUseVertexOrder(splitFaces, numberOfSplitVertices)
+
+    splitFaces = oldToNew[splitFaces]
+    splitVertexMap = wavefront.splitVertexMap[newToOld]
+    splitTexCo = wavefront.splitTexCo[newToOld]
+
+    header = dict()
+    header["version"] = MESHCODEC_VERSION
+    header["compression"] = compression
+    header["numberOfVertices"] = len(wavefront.vertexCoords)
+    header["numberOfSplitVertices"] = numberOfSplitVertices
+    header["numberOfFaces"] = len(splitFaces)
+    header["hasTexCo"] = bool(wavefront.hasTexCo)
+    header["positionBits"] = positionBits
+    header["streams"] = []
+
+    streams = []
+
+    def addStream(name, values, dtype = None):
+        if dtype is None:
+            (dtype, data) = _shuffle(values)
+        else:
+            data = values.astype(dtype).view(numpy.uint8).reshape(-1, numpy.dtype(dtype).itemsize).T.tobytes()
+        compressed = compress(data)
+        header["streams"].append( (name, dtype, len(values), len(compressed)) )
+        streams.append(compressed)
+
+    coords = numpy.asarray(wavefront.vertexCoords, dtype=float)
+
+    if positionBits is None:
+        addStream("positions", coords.T.ravel(), "<f8")
+    else:
+        (grid, lower, step) = _quantize(coords, positionBits)
+        header["positionLower"] = lower.tolist()
+        header["positionStep"] = step.tolist()
+        addStream("positions", _deltas(grid))
+
+    (grid, lower, step) = _quantize(splitTexCo, texCoBits)
+    header["texCoLower"] = lower.tolist()
+    header["texCoStep"] = step.tolist()
+    addStream("texCo", _deltas(grid))
+
+    addStream("splitVertexMap", _deltas(splitVertexMap))
+    addStream("indices", _encodeIndices(splitFaces))
+
+    if not wavefront.originalVertexIndices is None:
+        addStream("originalVertexIndices", _deltas(wavefront.originalVertexIndices))
+
+    headerBytes = json.dumps(header).encode("utf-8")
+
+    # Write to a temporary file and move it in place, so that an interrupted write
+    # never leaves a half written file behind
+    temporaryPath = path + ".tmp"
+
+    with open(temporaryPath, "wb") as file:
+        file.write(MESHCODEC_MAGIC)
+        file.write(numpy.array([len(headerBytes)], dtype="<u4").tobytes())
+        file.write(headerBytes)
+        for stream in streams:
+            file.write(stream)
+
+    os.replace(temporaryPath, path)
+
+    info("COMPRESSED MESH", "wrote " + path + " (" + str(os.path.getsize(path)) + " bytes)")
+
+
+def readCompressedMesh(path):
+
+    # Decode a compressed mesh file. Returns a dict with the arrays vertexCoords,
+    # splitVertexMap, splitTexCo and splitFaces, the flag hasTexCo and, if the mesh had
+    # been reordered by Wavefront.optimizeVertexCache(), originalVertexIndices.
+
+    if not os.path.exists(path):
+        raise IOError(path + " does not exist")
+
+    with open(path, "rb") as file:
+        content = file.read()
+
+    magicLength = len(MESHCODEC_MAGIC)
+
+    if content[:magicLength] != MESHCODEC_MAGIC:
+        raise ValueError(path + " is not a compressed mesh file")
+
+    headerLength = int(numpy.frombuffer(content, dtype="<u4", count=1, offset=magicLength)[0])
+    headerStart = magicLength + 4
+
+    header = json.loads(content[headerStart:headerStart + headerLength].decode("utf-8"))
+
+    if header["version"] != MESHCODEC_VERSION:
+        raise ValueError(path + " has compressed mesh version " + str(header["version"]) + ", expected " + str(MESHCODEC_VERSION))
+
+    decompress = _compressors[header["compression"]][1]
+
+    streams = dict()
+    position = headerStart + headerLength
+
+    for (name, dtype, count, size) in header["streams"]:
+        data = decompress(content[position:position + size])
+        position = position + size
+
+        if dtype == "<f8":
+            planes = numpy.frombuffer(data, dtype=numpy.uint8).reshape(8, count)
+            streams[name] = numpy.ascontiguousarray(planes.T).view("<f8").ravel()
+        else:
+            streams[name] = _unshuffle(data, dtype, count)
+
+    result = dict()
+
+    if header["positionBits"] is None:
+        result["vertexCoords"] = streams["positions"].reshape(3, -1).T.copy()
+    else:
+        grid = _undeltas(streams["positions"], 3)
+        result["vertexCoords"] = grid * numpy.array(header["positionStep"]) + numpy.array(header["positionLower"])
+
+    grid = _undeltas(streams["texCo"], 2)
+    result["splitTexCo"] = grid * numpy.array(header["texCoStep"]) + numpy.array(header["texCoLower"])
+
+    result["splitVertexMap"] = _undeltas(streams["splitVertexMap"], 1).ravel()
+    result["splitFaces"] = _decodeIndices(streams["indices"]).reshape(-1, 3)
+    result["hasTexCo"] = header["hasTexCo"]
+
+    if "originalVertexIndices" in streams:
+        result["originalVertexIndices"] = _undeltas(streams["originalVertexIndices"], 1).ravel()
+
+    return result
+
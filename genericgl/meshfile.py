@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import numpy
+
+from .simpledebug import info
+from .wavefront import Wavefront, MAX_SHORT_INDEX_VERTICES, indexTypeFor
+
+# A mesh file contains the vertex and index data for a mesh, laid out exactly
+# the way it is going to be uploaded to the GPU:
+#
+#   * A fixed size header (see _headerType below)
+#   * A table of chunks (see _chunkType below)
+#   * Interleaved vertex data, float32 XYZ NNN TT per vertex. Vertices on UV seams
+#     are split, see Wavefront.splitVertexMap
+#   * Index data, three indices per tri, uint16 if possible and otherwise uint32
+#
+# Meshes with more than 65535 vertices are split into chunks which each use at most
+# 65535 vertices, see Wavefront.getIndexChunks(). The vertices of each chunk are
+# stored one after the other, and the indices of a chunk are relative to its first
+# vertex. That way all indices are uint16, which GLES 2 requires, and every chunk
+# can be drawn from the same vertex buffer by pointing the attributes at the chunk's
+# first vertex. Smaller meshes have a single chunk with the vertices in the order of
+# Wavefront.splitVertexMap (so that LOD chains, see decimate.py, apply to them).
+#
+# The data blocks start at an aligned offset, so that they can be mapped with
+# numpy.memmap and passed as they are to QOpenGLBuffer.allocate() or glDrawElements().
+# Nothing is read from disk until the GL driver actually touches the pages.
+
+MESHFILE_MAGIC = b"GLTCMESH"
+
+# Bump this whenever the layout or contents change, so that old files are never read
+MESHFILE_VERSION = 5
+
+# Bits in the header flags
+MESHFILE_FLAG_VERTEX_CACHE_OPTIMIZED = 1
+MESHFILE_FLAG_TRIANGULATED = 2
+
+_alignment = 64
+
+_headerType = numpy.dtype([
+    ("magic", "S8"),
+    ("version", "<u4"),
+    ("floatsPerVertex", "<u4"),
+    ("vertexCount", "<u8"),
+    ("vertexOffset", "<u8"),
+    ("indexCount", "<u8"),
+    ("indexOffset", "<u8"),
+    ("indexItemSize", "<u4"),
+    ("flags", "<u4"),
+    ("sourceMtime", "<i8"),
+    ("sourceSize", "<u8"),
+    ("chunkCount", "<u8"),
+    ("chunkOffset", "<u8")
+])
+
+# Offsets and counts are in vertices and indices, not bytes
+_chunkType = numpy.dtype([
+    ("vertexStart", "<u8"),
+    ("vertexCount", "<u8"),
+    ("indexStart", "<u8"),
+    ("indexCount", "<u8")
+])
+
+_floatsPerVertex = 8 # XYZ NNN TT
+
+def _align(offset):
+    return (offset + _alignment - 1) // _alignment * _alignment
+
+
+def writeMeshFile(path, wavefront, sourcePath = None, maxChunkVertices = MAX_SHORT_INDEX_VERTICES):
+
+    # Write the arrays of a Wavefront object to a mesh file. If sourcePath is given,
+    # the mtime and size of that file is recorded, so that loadMeshFile() can tell when
+    # the mesh file is out of date. If maxChunkVertices is None, the mesh is never split
+    # into chunks, and large meshes get uint32 indices.
+
+    if maxChunkVertices is None:
+        maxChunkVertices = len(wavefront.splitVertexMap)
+
+    chunks = wavefront.getIndexChunks(maxChunkVertices)
+
+    # The split vertex for each vertex in the file
+    chunkVertices = numpy.concatenate( [vertexMap for (vertexMap, indices) in chunks] )
+    splitVertexMap = wavefront.splitVertexMap[chunkVertices]
+
+    vertexCount = len(chunkVertices)
+    indexCount = sum( [len(indices) for (vertexMap, indices) in chunks] )
+
+    indexType = indexTypeFor(maxChunkVertices)
+
+    chunkOffset = _align(_headerType.itemsize)
+    vertexOffset = _align(chunkOffset + len(chunks) * _chunkType.itemsize)
+    indexOffset = _align(vertexOffset + vertexCount * _floatsPerVertex * 4)
+    totalSize = indexOffset + indexCount * indexType.itemsize
+
+    # Write to a temporary file and move it in place, so that an interrupted write
+    # never leaves a half written mesh file behind
+    temporaryPath = path + ".tmp"
+
+    output = numpy.memmap(temporaryPath, dtype=numpy.uint8, mode="w+", shape=(totalSize,))
+
+    header = output[:_headerType.itemsize].view(_headerType)
+    header["magic"] = MESHFILE_MAGIC
+    header["version"] = MESHFILE_VERSION
+    header["floatsPerVertex"] = _floatsPerVertex
+    header["vertexCount"] = vertexCount
+    header["vertexOffset"] = vertexOffset
+    header["indexCount"] = indexCount
+    header["indexOffset"] = indexOffset
+    header["indexItemSize"] = indexType.itemsize
+    header["chunkCount"] = len(chunks)
+    header["chunkOffset"] = chunkOffset
+
+    flags = 0
+    if not wavefront.originalVertexIndices is None:
+        flags = flags | MESHFILE_FLAG_VERTEX_CACHE_OPTIMIZED
+    if wavefront.triangulateQuads:
+        flags = flags | MESHFILE_FLAG_TRIANGULATED
+    header["flags"] = flags
+
+    if not sourcePath is None:
+        stat = os.stat(sourcePath)
+        header["sourceMtime"] = stat.st_mtime_ns
+        header["sourceSize"] = stat.st_size
+
+    # Fill the interleaved vertex data directly in the mapped file, rather than building
+    # it in memory first
+    vertices = output[vertexOffset:vertexOffset + vertexCount * _floatsPerVertex * 4].view("<f4").reshape(vertexCount, _floatsPerVertex)
+    vertices[:,0:3] = wavefront.vertexCoords[splitVertexMap]
+    vertices[:,3:6] = wavefront.vertexNormals[splitVertexMap]
+    vertices[:,6:8] = wavefront.splitTexCo[chunkVertices]
+
+    indices = output[indexOffset:].view(indexType)
+    table = output[chunkOffset:chunkOffset + len(chunks) * _chunkType.itemsize].view(_chunkType)
+
+    vertexStart = 0
+    indexStart = 0
+    for (chunk, (vertexMap, chunkIndices)) in enumerate(chunks):
+        table[chunk] = (vertexStart, len(vertexMap), indexStart, len(chunkIndices))
+        indices[indexStart:indexStart + len(chunkIndices)] = chunkIndices
+        vertexStart = vertexStart + len(vertexMap)
+        indexStart = indexStart + len(chunkIndices)
+
+    output.flush()
+    del header, table, vertices, indices, output
+
+    os.replace(temporaryPath, path)
+
+    info("MESH FILE", "wrote " + path)
+
+
+class MeshFile():
+
+    def __init__(self, path):
+
+        if not os.path.exists(path):
+            raise IOError(path + " does not exist")
+
+        # Only the header is actually read here
+        header = numpy.fromfile(path, dtype=_headerType, count=1)
+
+        if len(header) < 1 or header["magic"][0] != MESHFILE_MAGIC:
+            raise ValueError(path + " is not a mesh file")
+
+        header = header[0]
+
+        if header["version"] != MESHFILE_VERSION:
+            raise ValueError(path + " has mesh file version " + str(header["version"]) + ", expected " + str(MESHFILE_VERSION))
+
+        self.path = path
+
+        self.sourceMtime = int(header["sourceMtime"])
+        self.sourceSize = int(header["sourceSize"])
+
+        self.vertexCount = int(header["vertexCount"])
+        self.indexCount = int(header["indexCount"])
+        self.floatsPerVertex = int(header["floatsPerVertex"])
+
+        # True if triangles and vertices have been reordered, see Wavefront.optimizeVertexCache()
+        self.vertexCacheOptimized = bool(header["flags"] & MESHFILE_FLAG_VERTEX_CACHE_OPTIMIZED)
+
+        # The triangulateQuads setting of the Wavefront the file was written from
+        self.triangulateQuads = bool(header["flags"] & MESHFILE_FLAG_TRIANGULATED)
+
+        indexType = numpy.dtype("<u2")
+        if header["indexItemSize"] == 4:
+            indexType = numpy.dtype("<u4")
+
+        # See _chunkType
+        self.chunks = numpy.fromfile(path, dtype=_chunkType, count=int(header["chunkCount"]), offset=int(header["chunkOffset"]))
+
+        # Memory mapped, read only views of the vertex and index data. These can be passed
+        # directly to QOpenGLBuffer.allocate() and glDrawElements().
+        self.vertices = numpy.memmap(path, dtype="<f4", mode="r", offset=int(header["vertexOffset"]), shape=(self.vertexCount, self.floatsPerVertex))
+        self.indices = numpy.memmap(path, dtype=indexType, mode="r", offset=int(header["indexOffset"]), shape=(self.indexCount,))
+
+        # Size in bytes for each vertex specification, and where the different parts of it start
+        self.vertexStride = self.vertices.itemsize * self.floatsPerVertex
+        self.positionBytesOffset = 0
+        self.normalBytesOffset = self.vertices.itemsize * 3
+        self.textureBytesOffset = self.vertices.itemsize * 6
+
+        # For drawing the chunks one after the other: a list of tuples with the byte offset
+        # of the chunk's first vertex (to add to the attribute offsets above) and the
+        # chunk's indices
+        self.drawChunks = []
+        for chunk in self.chunks:
+            indexStart = int(chunk["indexStart"])
+            self.drawChunks.append( (int(chunk["vertexStart"]) * self.vertexStride, self.indices[indexStart:indexStart + int(chunk["indexCount"])]) )
+
+        # The same, for drawing from an index buffer holding all of indices (see IndexBuffer):
+        # a list of tuples with the byte offset of the chunk's first vertex, and the number
+        # of the chunk's first index and its number of indices
+        self.bufferChunks = []
+        for chunk in self.chunks:
+            self.bufferChunks.append( (int(chunk["vertexStart"]) * self.vertexStride, int(chunk["indexStart"]), int(chunk["indexCount"])) )
+
+
+def loadMeshFile(objPath, meshPath = None, triangulateQuads = True, optimizeForVertexCache = False):
+
+    # Return a MeshFile for a wavefront obj. The mesh file is (re)created from the obj if
+    # it is missing, if the obj has changed since the mesh file was written or if it was
+    # written with a different triangulateQuads or optimizeForVertexCache setting.
+
+    if meshPath is None:
+        meshPath = objPath + ".mesh"
+
+    stat = os.stat(objPath)
+
+    if os.path.exists(meshPath):
+        try:
+            meshFile = MeshFile(meshPath)
+            if meshFile.sourceMtime == stat.st_mtime_ns and meshFile.sourceSize == stat.st_size:
+                if meshFile.triangulateQuads != triangulateQuads:
+                    info("MESH FILE", "different triangulation, recreating " + meshPath)
+                elif meshFile.vertexCacheOptimized != optimizeForVertexCache:
+                    info("MESH FILE", "different vertex cache optimization, recreating " + meshPath)
+                else:
+                    return meshFile
+            else:
+                info("MESH FILE", "out of date, recreating " + meshPath)
+        except ValueError as e:
+            info("MESH FILE", "unable to use " + meshPath + " (" + str(e) + ")")
+
+    wavefront = Wavefront(objPath, triangulateQuads, optimizeForVertexCache=optimizeForVertexCache)
+    writeMeshFile(meshPath, wavefront, objPath)
+
+    return MeshFile(meshPath)
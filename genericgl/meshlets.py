@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy
+
+from .simpledebug import info
+from .wavefront import indexTypeFor
+from .vertexcache import tipsify
+
+# Meshlets are small clusters of spatially coherent faces. Each meshlet has a
+# bounding sphere and a normal cone (an axis and the widest angle between the axis
+# and any face normal in the meshlet). Given the current rotation, whole meshlets
+# can then be skipped when all their faces point away from the viewer, or when
+# their bounding sphere is outside the view volume.
+#
+# Faces are first grouped by the direction of their normal, using the cells of a cube
+# map (each side of a cube around the normal is split into a grid), and then sorted
+# along a Morton (Z-order) curve through their centroids. Cutting the sorted faces
+# into runs of maxTriangles gives meshlets which are both compact and have narrow
+# normal cones. Faces in the same Morton cell keep their original relative order.
+# Optionally, the faces inside each meshlet are then reordered for the vertex cache.
+#
+# The view is assumed to be the one in the test shaders: an orthographic projection
+# of the rotated object (see RotatableCanvas.rotationMatrix()), scaled by
+# viewportScaling and looking along +Z. Culling back facing meshlets only changes what
+# is drawn for meshes where back faces can be seen, such as meshes with holes.
+
+_mortonBits = 10
+
+# Each side of the normal cube map is split into this many cells along each axis. More
+# cells give narrower normal cones but less compact meshlets.
+_normalCellsPerSide = 3
+
+def _spreadBits(values):
+
+    # Spread the lower 10 bits of each value out so that there are two zero bits
+    # between each of them
+
+    values = values.astype(numpy.uint64) & numpy.uint64(0x3FF)
+    values = (values | (values << numpy.uint64(16))) & numpy.uint64(0x030000FF)
+    values = (values | (values << numpy.uint64(8))) & numpy.uint64(0x0300F00F)
+    values = (values | (values << numpy.uint64(4))) & numpy.uint64(0x030C30C3)
+    values = (values | (values << numpy.uint64(2))) & numpy.uint64(0x09249249)
+
+    return values
+
+
+def mortonCodes(points):
+
+    # 30 bit Morton codes for (n, 3) points, quantized within their bounding box
+
+    lower = points.min(axis=0)
+    extent = numpy.maximum(points.max(axis=0) - lower, 1e-300)
+
+    cells = (1 << _mortonBits) - 1
+    quantized = numpy.clip( ((points - lower) / extent * cells).astype(int), 0, cells )
+
+    return (_spreadBits(quantized[:,0]) << numpy.uint64(2)) | (_spreadBits(quantized[:,1]) << numpy.uint64(1)) | _spreadBits(quantized[:,2])
+
+
+class Meshlets():
+
+    def __init__(self, positions, faces, maxTriangles = 128, optimizeForVertexCache = False):
+
+        # positions is a (n, 3) array of vertex positions and faces a (f, 3) array of
+        # indices into it. For a mesh file, use MeshFile.vertices[:,0:3] and the indices of
+        # a chunk. For a Wavefront, use vertexCoords[splitVertexMap] and splitFaces.
+        #
+        # Sorting the faces into meshlets undoes any vertex cache order they had (see
+        # vertexcache.py). If optimizeForVertexCache is True, the faces of each meshlet are
+        # reordered with Tipsify, so that what locality the meshlet has is used. Which faces
+        # end up in which meshlet, and so the culling, is the same either way.
+
+        positions = numpy.asarray(positions, dtype=float)
+        faces = numpy.asarray(faces, dtype=int).reshape(-1, 3)
+
+        self.maxTriangles = maxTriangles
+
+        corners = positions[faces]
+        normals = numpy.cross(corners[:,1] - corners[:,0], corners[:,2] - corners[:,0])
+        lengths = numpy.linalg.norm(normals, axis=1)
+
+        unitNormals = numpy.zeros(normals.shape, dtype=float)
+        nonZero = lengths > 0
+        unitNormals[nonZero] = normals[nonZero] / lengths[nonZero,None]
+
+        # Which side of the cube map (+X, -X, +Y, -Y, +Z or -Z) each normal points at, and
+        # which cell on that side
+        faceRange = numpy.arange(len(faces))
+        dominantAxis = numpy.argmax(numpy.abs(unitNormals), axis=1)
+        dominant = unitNormals[faceRange, dominantAxis]
+        side = dominantAxis * 2 + (dominant < 0)
+
+        cells = _normalCellsPerSide
+        direction = side
+        for otherAxis in (1, 2):
+            projected = unitNormals[faceRange, (dominantAxis + otherAxis) % 3] / numpy.maximum(numpy.abs(dominant), 1e-300)
+            cell = numpy.clip( ((projected + 1.0) / 2.0 * cells).astype(int), 0, cells - 1 )
+            direction = direction * cells + cell
+
+        centroids = corners.mean(axis=1)
+        codes = mortonCodes(centroids) if len(faces) > 0 else numpy.zeros(0, dtype=numpy.uint64)
+
+        # Sort by direction, then by Morton code. The stable sort keeps the original order of
+        # faces in the same cell.
+        self.faceOrder = numpy.lexsort( (codes, direction) )
+
+        direction = direction[self.faceOrder]
+
+        # Cut each direction group into meshlets of at most maxTriangles faces
+        groupStarts = numpy.flatnonzero(numpy.diff(direction, prepend=-1))
+        groupSizes = numpy.diff(numpy.append(groupStarts, len(direction)))
+        positionInGroup = numpy.arange(len(direction)) - numpy.repeat(groupStarts, groupSizes)
+
+        newMeshlet = (positionInGroup % maxTriangles) == 0
+        self.meshletStarts = numpy.flatnonzero(newMeshlet)
+        self.meshletCounts = numpy.diff(numpy.append(self.meshletStarts, len(direction)))
+
+        self.numberOfMeshlets = len(self.meshletStarts)
+
+        meshletOfFace = numpy.repeat(numpy.arange(self.numberOfMeshlets), self.meshletCounts)
+
+        if optimizeForVertexCache:
+            self._optimizeMeshletsForVertexCache(faces)
+
+        # Index array with the faces in meshlet order, three indices per face. The faces of
+        # meshlet i are found from meshletStarts[i] to meshletStarts[i] + meshletCounts[i].
+        sortedFaces = faces[self.faceOrder]
+        self.indices = sortedFaces.ravel().astype(indexTypeFor(len(positions)))
+
+        if self.numberOfMeshlets == 0:
+            self.centers = numpy.zeros( (0, 3), dtype=float )
+            self.radii = numpy.zeros(0, dtype=float)
+            self.coneAxes = numpy.zeros( (0, 3), dtype=float )
+            self.coneThresholds = numpy.zeros(0, dtype=float)
+            return
+
+        # Bounding spheres around the center of each meshlet's bounding box
+        sortedCorners = corners[self.faceOrder]
+
+        lower = numpy.minimum.reduceat(sortedCorners.min(axis=1), self.meshletStarts)
+        upper = numpy.maximum.reduceat(sortedCorners.max(axis=1), self.meshletStarts)
+        self.centers = (lower + upper) / 2.0
+
+        cornerDistances = numpy.linalg.norm(sortedCorners - self.centers[meshletOfFace,None,:], axis=2).max(axis=1)
+        self.radii = numpy.maximum.reduceat(cornerDistances, self.meshletStarts)
+
+        # Normal cones. The axis is the average normal, and the cone is as wide as the
+        # normal furthest from it. Faces without area have no normal and do not count.
+        sortedNormals = unitNormals[self.faceOrder]
+
+        axes = numpy.add.reduceat(sortedNormals, self.meshletStarts)
+        axisLengths = numpy.linalg.norm(axes, axis=1)
+        hasAxis = axisLengths > 0
+        axes[hasAxis] = axes[hasAxis] / axisLengths[hasAxis,None]
+        self.coneAxes = axes
+
+        dots = numpy.einsum("ij,ij->i", sortedNormals, axes[meshletOfFace])
+        dots[~nonZero[self.faceOrder]] = 1.0
+        cutoffs = numpy.minimum(numpy.minimum.reduceat(dots, self.meshletStarts), 1.0)
+
+        # A meshlet faces away from the viewer if the angle between its cone axis and the
+        # view direction is less than 90 degrees minus the cone's half angle, ie if the dot
+        # product between them is larger than the sine of the half angle. Cones of 90
+        # degrees or wider never face away.
+        self.coneThresholds = numpy.full(self.numberOfMeshlets, 2.0)
+        narrow = (cutoffs > 0) & hasAxis
+        self.coneThresholds[narrow] = numpy.sqrt(1.0 - cutoffs[narrow] * cutoffs[narrow])
+
+        info("MESHLETS", str(self.numberOfMeshlets) + " meshlets, " + str(int(narrow.sum())) + " can be back face culled")
+
+    def _optimizeMeshletsForVertexCache(self, faces):
+
+        # Reorder the faces within each meshlet with Tipsify. Each meshlet is numbered with
+        # its own vertices, so that Tipsify only looks at the vertices the meshlet uses.
+
+        for (start, count) in zip(self.meshletStarts.tolist(), self.meshletCounts.tolist()):
+            meshletFaces = self.faceOrder[start:start + count]
+            (usedVertices, localFaces) = numpy.unique(faces[meshletFaces], return_inverse=True)
+            order = tipsify(localFaces.reshape(-1, 3), len(usedVertices))
+            self.faceOrder[start:start + count] = meshletFaces[order]
+
+    def cull(self, rotation, viewportScale = (1.0, 1.0, 1.0, 1.0)):
+
+        # Return a boolean array telling which meshlets may be visible. rotation is the 3x3
+        # rotation matrix applied to the object and viewportScale the XYZW scaling applied
+        # after it, see RotatableCanvas.rotationMatrix() and currentViewportScale().
+
+        rotation = numpy.asarray(rotation, dtype=float)
+        (scaleX, scaleY, scaleZ, scaleW) = viewportScale
+
+        # The view direction (+Z after rotation) in object coordinates
+        viewDirection = rotation[2]
+
+        frontFacing = self.coneAxes @ viewDirection <= self.coneThresholds
+
+        # The view volume is -1 to 1 on each axis after scaling
+        rotatedCenters = self.centers @ rotation.T
+        limits = scaleW / numpy.array([scaleX, scaleY, scaleZ])
+
+        inside = (numpy.abs(rotatedCenters) - self.radii[:,None] <= limits).all(axis=1)
+
+        return frontFacing & inside
+
+    def visibleRanges(self, visible):
+
+        # Given the result of cull(), return a list of (start, count) tuples with ranges of
+        # indices to draw. Neighbouring visible meshlets are merged into one range, so that
+        # there are as few draw calls as possible.
+
+        if len(visible) == 0:
+            return []
+
+        changes = numpy.flatnonzero(numpy.diff(numpy.concatenate( ([False], visible, [False]) ).astype(numpy.int8)))
+        runStarts = changes[0::2]
+        runEnds = changes[1::2]
+
+        triangleStarts = self.meshletStarts[runStarts]
+        triangleEnds = self.meshletStarts[runEnds - 1] + self.meshletCounts[runEnds - 1]
+
+        return list(zip( (triangleStarts * 3).tolist(), ((triangleEnds - triangleStarts) * 3).tolist() ))
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import numpy
+
+# Morph targets are sparse sets of vertex offsets. Each target lists a number of
+# vertex indices and an XYZ offset for each of them. A mesh is deformed by adding
+# the offsets of each target, multiplied with a weight for that target, to the
+# base coordinates of the mesh.
+#
+# All targets are stacked into one sparse matrix (in coordinate form), with one
+# row per stored offset. Evaluating base + W * targets is then a single weighted
+# bincount over all rows, no matter how many targets there are.
+
+def loadTarget(path):
+
+    # Load a target file in MakeHuman's text format, ie lines with a vertex index
+    # followed by an XYZ offset. Lines starting with "#" are comments. Returns a
+    # tuple with an int array of vertex indices and a (n, 3) float array of offsets.
+
+    if not os.path.exists(path):
+        raise IOError(path + " does not exist")
+
+    data = numpy.loadtxt(path, comments="#", ndmin=2)
+
+    if data.size == 0:
+        return (numpy.zeros(0, dtype=int), numpy.zeros( (0, 3), dtype=float ))
+
+    if data.shape[1] != 4:
+        raise ValueError(path + " does not look like a target file")
+
+    return (data[:,0].astype(int), data[:,1:4])
+
+
+class MorphTargets():
+
+    def __init__(self, wavefront):
+
+        # The mesh which is deformed. Its current coordinates are used as the base
+        # coordinates that all offsets are relative to.
+        self.wavefront = wavefront
+        self.baseCoords = numpy.array(wavefront.vertexCoords, dtype=float)
+
+        self.targetNames = []
+        self.weights = numpy.zeros(0, dtype=float)
+
+        # The stacked sparse matrix. Rows are sorted by target, and the rows for target
+        # number i are found from _targetOffsets[i] to _targetOffsets[i + 1].
+        self._vertexIndices = numpy.zeros(0, dtype=int)
+        self._deltas = numpy.zeros( (0, 3), dtype=float )
+        self._targetOffsets = numpy.zeros(1, dtype=int)
+
+        # All vertices affected by any target
+        self._affectedVertices = numpy.zeros(0, dtype=int)
+
+        # Coordinates for the current weights
+        self.currentCoords = self.baseCoords.copy()
+
+    def addTarget(self, name, indices, deltas):
+
+        if name in self.targetNames:
+            raise ValueError("There is already a target called " + name)
+
+        indices = numpy.asarray(indices, dtype=int)
+        deltas = numpy.asarray(deltas, dtype=float).reshape(-1, 3)
+
+        if len(indices) != len(deltas):
+            raise ValueError("Target " + name + " has " + str(len(indices)) + " indices but " + str(len(deltas)) + " offsets")
+
+        numberOfVertices = len(self.baseCoords)
+
+        if len(indices) > 0 and (indices.min() < 0 or indices.max() >= numberOfVertices):
+            raise ValueError("Target " + name + " refers to vertices outside the mesh")
+
+        # Merge offsets listed several times for the same vertex, so that each vertex
+        # appears only once per target
+        (uniqueIndices, inverse) = numpy.unique(indices, return_inverse=True)
+        mergedDeltas = numpy.zeros( (len(uniqueIndices), 3), dtype=float )
+        numpy.add.at(mergedDeltas, inverse, deltas)
+
+        self.targetNames.append(name)
+        self.weights = numpy.append(self.weights, 0.0)
+
+        self._vertexIndices = numpy.concatenate( (self._vertexIndices, uniqueIndices) )
+        self._deltas = numpy.concatenate( (self._deltas, mergedDeltas) )
+        self._targetOffsets = numpy.append(self._targetOffsets, len(self._vertexIndices))
+
+        self._affectedVertices = numpy.union1d(self._affectedVertices, uniqueIndices)
+
+    def loadTarget(self, path, name = None):
+
+        if name is None:
+            name = os.path.splitext(os.path.basename(path))[0]
+
+        (indices, deltas) = loadTarget(path)
+
+        # Target files use the vertex order of the obj file. If the mesh has been reordered,
+        # map them to the current vertex order.
+        originalVertexIndices = self.wavefront.originalVertexIndices
+        if not originalVertexIndices is None:
+            if len(indices) > 0 and (indices.min() < 0 or indices.max() >= len(originalVertexIndices)):
+                raise ValueError("Target " + name + " refers to vertices outside the mesh")
+            indices = numpy.argsort(originalVertexIndices)[indices]
+
+        self.addTarget(name, indices, deltas)
+
+        return name
+
+    def _targetIndex(self, name):
+
+        if not name in self.targetNames:
+            raise ValueError("There is no target called " + str(name))
+
+        return self.targetNames.index(name)
+
+    def evaluate(self, weights):
+
+        # Evaluate base + W * targets for a full weight vector (one weight per target, in
+        # the order they were added) and apply the result to the mesh. Returns the indices
+        # of the vertices whose coordinates or normals changed, see
+        # Wavefront.updateVertexCoords()
+
+        weights = numpy.asarray(weights, dtype=float)
+
+        if weights.shape != self.weights.shape:
+            raise ValueError("Expected " + str(len(self.weights)) + " weights, got " + str(weights.shape))
+
+        self.weights = weights.copy()
+
+        # The weight for each row of the stacked matrix
+        rowWeights = numpy.repeat(weights, numpy.diff(self._targetOffsets))
+
+        # Sum up all weighted offsets in one go, treating the (vertex, axis) pairs as one
+        # flat index
+        numberOfVertices = len(self.baseCoords)
+        flatIndices = (self._vertexIndices[:,None] * 3 + numpy.arange(3)).ravel()
+        flatOffsets = (self._deltas * rowWeights[:,None]).ravel()
+
+        offsets = numpy.bincount(flatIndices, weights=flatOffsets, minlength=numberOfVertices * 3).reshape(-1, 3)
+
+        self.currentCoords = self.baseCoords + offsets
+
+        affected = self._affectedVertices
+
+        return self.wavefront.updateVertexCoords(affected, self.currentCoords[affected])
+
+    def setWeight(self, name, weight):
+
+        # Change the weight of a single target. Only the vertices of that target are
+        # touched, so this is the path to use for interactive sliders. Returns the indices
+        # of the vertices whose coordinates or normals changed.
+
+        targetIndex = self._targetIndex(name)
+
+        change = weight - self.weights[targetIndex]
+        self.weights[targetIndex] = weight
+
+        start = self._targetOffsets[targetIndex]
+        end = self._targetOffsets[targetIndex + 1]
+
+        indices = self._vertexIndices[start:end]
+
+        self.currentCoords[indices] += change * self._deltas[start:end]
+
+        return self.wavefront.updateVertexCoords(indices, self.currentCoords[indices])
+
+    def getWeight(self, name):
+        return self.weights[self._targetIndex(name)]
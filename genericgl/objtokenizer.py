@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import numpy
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+# Bulk tokenizer for wavefront obj data. Rather than splitting the text line
+# by line in python, the whole file is looked at as one array of bytes. Lines
+# are grouped by their leading token ("v", "vt" and "f"), the bytes of each group
+# are converted to numbers in one go, and face corners such as "1/2/3" are
+# split into vertex, texture coordinate and normal columns with array
+# operations.
+#
+# Only the records Wavefront cares about are extracted. Everything else
+# (comments, normals, groups, materials...) is skipped. Comments at the end of a
+# line ("v 1.0 2.0 3.0 # top") are ignored, like in Wavefront's stream parser.
+
+# For the parallel tokenizer: each worker gets at least this many bytes of the file.
+# Smaller files are tokenized directly, since starting processes costs more than it saves.
+_minimumBytesPerWorker = 1 << 20
+
+_SPACE = 32
+_TAB = 9
+_CARRIAGE_RETURN = 13
+_NEWLINE = 10
+_SLASH = 47
+_HASH = 35
+_LETTER_V = 118
+_LETTER_T = 116
+_LETTER_F = 102
+
+def _linesToBytes(buffer, lineLengths, lines, keywordPositions, keywordLength):
+
+    # Cut out the given lines from the buffer as one string, with the leading keyword
+    # replaced by spaces, so that only the numbers are left
+
+    work = buffer.copy()
+    i = 0
+    while i < keywordLength:
+        work[keywordPositions + i] = _SPACE
+        i = i + 1
+
+    # Spread the per line selection out on the bytes of each line
+    keepLine = numpy.zeros(len(lineLengths), dtype=bool)
+    keepLine[lines] = True
+
+    keep = numpy.repeat(keepLine, lineLengths)
+
+    return work[keep].tobytes()
+
+
+def _parseNumbers(text, dtype, expectedCount):
+
+    # Convert all numbers in the text with a single call to numpy's C parser. The lines
+    # may hold different numbers of values, so they are joined into one long row first.
+    # Anything which is not a number of the given type raises a ValueError.
+    if expectedCount == 0:
+        values = numpy.zeros(0, dtype=dtype)
+    else:
+        values = numpy.loadtxt(io.BytesIO(text.replace(b"\n", b" ")), dtype=dtype, comments=None, ndmin=1)
+
+    if len(values) != expectedCount:
+        raise ValueError("Unable to parse all numbers in the wavefront file")
+
+    return values
+
+
+def _firstValuesPerLine(values, valuesPerLine, numberOfValues):
+
+    # Given a flat array of values and the number of values on each line, return an
+    # array with the first numberOfValues values of each line
+
+    if (valuesPerLine == numberOfValues).all():
+        return values.reshape(-1, numberOfValues)
+
+    if (valuesPerLine < numberOfValues).any():
+        raise ValueError("Found a line with fewer than " + str(numberOfValues) + " values")
+
+    lineStarts = numpy.cumsum(valuesPerLine) - valuesPerLine
+
+    return values[lineStarts[:,None] + numpy.arange(numberOfValues)]
+
+
+def tokenizeObj(data):
+
+    # Takes the contents of an obj file as bytes and returns a tuple with
+    #
+    #   vertices:     (numVerts, 3) float array
+    #   texCo:        (numTexCo, 2) float array
+    #   faceCorners:  (numFaces, 4) int array with zero based vertex indices. Tris are padded with -1.
+    #   faceTexCo:    (numFaces, 4) int array with zero based texture coordinate indices, -1 if missing
+
+    if not data.endswith(b"\n"):
+        data = data + b"\n"
+
+    # Pad with an empty line, so that looking a couple of bytes past the start
+    # of the last token never reads outside the buffer
+    data = data + b"\n\n"
+
+    buffer = numpy.frombuffer(data, dtype=numpy.uint8)
+
+    isNewline = buffer == _NEWLINE
+
+    # Blank out comments, from the first "#" on a line to the newline ending it. Each
+    # comment adds one at its start and subtracts one at its end, so the running sum is one
+    # inside comments. Data always ends with a newline, so every "#" has a line end.
+    hashPositions = numpy.flatnonzero(buffer == _HASH)
+    if len(hashPositions) > 0:
+        newlinePositions = numpy.flatnonzero(isNewline)
+        (commentEnds, firstHash) = numpy.unique(newlinePositions[numpy.searchsorted(newlinePositions, hashPositions)], return_index=True)
+
+        delta = numpy.zeros(len(buffer), dtype=numpy.int8)
+        delta[hashPositions[firstHash]] = 1
+        delta[commentEnds] = -1
+
+        buffer = buffer.copy()
+        buffer[numpy.cumsum(delta, dtype=numpy.int8) > 0] = _SPACE
+    isSeparator = (buffer == _SPACE) | (buffer == _TAB) | (buffer == _CARRIAGE_RETURN) | isNewline
+
+    # Positions of all tokens, and which line each of them is on. A line ends with (and
+    # includes) its newline character.
+    previousIsSeparator = numpy.empty(len(buffer), dtype=bool)
+    previousIsSeparator[:1] = True
+    previousIsSeparator[1:] = isSeparator[:-1]
+
+    tokenStarts = numpy.flatnonzero(~isSeparator & previousIsSeparator)
+    lineEnds = numpy.flatnonzero(isNewline)
+    lineLengths = numpy.diff(lineEnds, prepend=-1)
+
+    tokenLines = numpy.searchsorted(lineEnds, tokenStarts)
+
+    # The first token on each line decides what kind of record the line is
+    isFirstToken = numpy.ones(len(tokenStarts), dtype=bool)
+    isFirstToken[1:] = tokenLines[1:] != tokenLines[:-1]
+
+    keywordPositions = tokenStarts[isFirstToken]
+    keywordLines = tokenLines[isFirstToken]
+
+    c0 = buffer[keywordPositions]
+    c1 = buffer[keywordPositions + 1]
+
+    isVertexLine = (c0 == _LETTER_V) & isSeparator[keywordPositions + 1]
+    isTexCoLine = (c0 == _LETTER_V) & (c1 == _LETTER_T) & isSeparator[keywordPositions + 2]
+    isFaceLine = (c0 == _LETTER_F) & isSeparator[keywordPositions + 1]
+
+    # Number of value tokens (that is, not counting the keyword) on each line
+    valuesPerLine = numpy.bincount(tokenLines, minlength=len(lineEnds)) - 1
+
+    # Vertices and texture coordinates are plain lists of floats
+
+    lines = keywordLines[isVertexLine]
+    text = _linesToBytes(buffer, lineLengths, lines, keywordPositions[isVertexLine], 1)
+    values = _parseNumbers(text, float, valuesPerLine[lines].sum())
+    vertices = _firstValuesPerLine(values, valuesPerLine[lines], 3)
+
+    lines = keywordLines[isTexCoLine]
+    text = _linesToBytes(buffer, lineLengths, lines, keywordPositions[isTexCoLine], 2)
+    values = _parseNumbers(text, float, valuesPerLine[lines].sum())
+    texCo = _firstValuesPerLine(values, valuesPerLine[lines], 2)
+
+    # Faces consist of corners such as "1", "1/2", "1//3" or "1/2/3". Each corner is a token,
+    # and each number in it is a field. Find out which corner and which field each number
+    # belongs to, by counting slashes.
+
+    faceLines = keywordLines[isFaceLine]
+
+    cornersPerFace = valuesPerLine[faceLines]
+    cornersPerFace = cornersPerFace[cornersPerFace > 0]
+
+    if (cornersPerFace > 4).any():
+        raise ValueError("Found a face with more than four vertices. N-gons are not supported.")
+    if (cornersPerFace < 3).any():
+        raise ValueError("Found a face with less than three vertices")
+
+    text = _linesToBytes(buffer, lineLengths, faceLines, keywordPositions[isFaceLine], 1)
+    faceBuffer = numpy.frombuffer(text, dtype=numpy.uint8)
+
+    isFaceSlash = faceBuffer == _SLASH
+    isFaceSeparator = (faceBuffer == _SPACE) | (faceBuffer == _TAB) | (faceBuffer == _CARRIAGE_RETURN) | (faceBuffer == _NEWLINE)
+
+    previousIsBreak = numpy.empty(len(faceBuffer), dtype=bool)
+    previousIsBreak[:1] = True
+    previousIsBreak[1:] = isFaceSeparator[:-1] | isFaceSlash[:-1]
+
+    previousIsSeparator = numpy.empty(len(faceBuffer), dtype=bool)
+    previousIsSeparator[:1] = True
+    previousIsSeparator[1:] = isFaceSeparator[:-1]
+
+    notBreak = ~isFaceSeparator & ~isFaceSlash
+
+    numberStarts = numpy.flatnonzero(notBreak & previousIsBreak)
+    cornerStarts = numpy.flatnonzero(~isFaceSeparator & previousIsSeparator)
+    slashPositions = numpy.flatnonzero(isFaceSlash)
+
+    numberCorners = numpy.searchsorted(cornerStarts, numberStarts, side="right") - 1
+    numberFields = numpy.searchsorted(slashPositions, numberStarts) - numpy.searchsorted(slashPositions, cornerStarts)[numberCorners]
+
+    faceText = text.replace(b"/", b" ")
+    values = _parseNumbers(faceText, int, len(numberStarts))
+
+    numberOfCorners = len(cornerStarts)
+
+    isVertexField = numberFields == 0
+    isTexCoField = numberFields == 1
+
+    if isVertexField.sum() != numberOfCorners:
+        raise ValueError("Found a face corner without a vertex index")
+
+    # Note "-1" since wavefront indexes start at 1 rather than 0. Corners without
+    # a texture coordinate end up as -1.
+    cornerVertices = numpy.empty(numberOfCorners, dtype=int)
+    cornerVertices[numberCorners[isVertexField]] = values[isVertexField] - 1
+
+    cornerTexCo = numpy.full(numberOfCorners, -1, dtype=int)
+    cornerTexCo[numberCorners[isTexCoField]] = values[isTexCoField] - 1
+
+    # Spread the corners out on (numFaces, 4) arrays
+    faceStarts = numpy.cumsum(cornersPerFace) - cornersPerFace
+    cornerFaces = numpy.repeat(numpy.arange(len(cornersPerFace)), cornersPerFace)
+    cornerColumns = numpy.arange(numberOfCorners) - faceStarts[cornerFaces]
+
+    faceCorners = numpy.full( (len(cornersPerFace), 4), -1, dtype=int )
+    faceCorners[cornerFaces, cornerColumns] = cornerVertices
+
+    faceTexCo = numpy.full( (len(cornersPerFace), 4), -1, dtype=int )
+    faceTexCo[cornerFaces, cornerColumns] = cornerTexCo
+
+    return (vertices, texCo, faceCorners, faceTexCo)
+
+
+def _findRanges(path, numberOfRanges):
+
+    # Split the file into about equally large byte ranges, each starting right after a
+    # newline. Returns a list of (start, end) tuples.
+
+    size = os.path.getsize(path)
+    boundaries = [0]
+
+    with open(path, "rb") as file:
+        for i in range(1, numberOfRanges):
+            file.seek(size * i // numberOfRanges)
+            file.readline()
+            position = file.tell()
+            if position > boundaries[-1] and position < size:
+                boundaries.append(position)
+
+    boundaries.append(size)
+
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _tokenizeRange(path, start, end):
+
+    # Runs in a worker process. Tokenize a byte range of the file and hand the resulting
+    # arrays back through a block of shared memory rather than pickling them. Returns
+    # the name of the block and the (shape, dtype, offset) of each array in it.
+
+    with open(path, "rb") as file:
+        file.seek(start)
+        data = file.read(end - start)
+
+    arrays = tokenizeObj(data)
+
+    # The block stays registered with the resource tracker, which the worker shares with
+    # the parent process. The parent unlinks the block once it has read it (which also
+    # unregisters it), and if the parent dies first, the tracker unlinks it.
+    block = shared_memory.SharedMemory(create=True, size=max(1, sum([array.nbytes for array in arrays])))
+
+    descriptions = []
+    offset = 0
+    for array in arrays:
+        numpy.ndarray(array.shape, dtype=array.dtype, buffer=block.buf, offset=offset)[...] = array
+        descriptions.append( (array.shape, array.dtype.str, offset) )
+        offset = offset + array.nbytes
+
+    name = block.name
+    block.close()
+
+    return (name, descriptions)
+
+
+def tokenizeObjParallel(path, numberOfWorkers = None):
+
+    # Same as tokenizeObj(), but for a file, which is split into newline aligned byte
+    # ranges that are tokenized in a pool of processes. Indices in obj files are absolute,
+    # so the vertices, texture coordinates and faces of each range just need to be put
+    # after those of the ranges before it to give exactly the same result as tokenizing
+    # the whole file at once.
+    #
+    # The workers are started with the "spawn" method, since forking a process which
+    # runs other threads (such as Qt's, or the AssetLoader's) is unsafe. Spawned workers
+    # import the main script, so scripts calling this must keep their top level code in
+    # an "if __name__ == '__main__':" block.
+
+    if numberOfWorkers is None:
+        numberOfWorkers = os.cpu_count() or 1
+
+    numberOfRanges = max(1, min(numberOfWorkers, os.path.getsize(path) // _minimumBytesPerWorker))
+
+    if numberOfRanges == 1:
+        with open(path, "rb") as file:
+            return tokenizeObj(file.read())
+
+    ranges = _findRanges(path, numberOfRanges)
+
+    # Leaving the with block waits for all workers, also when one of them fails
+    with ProcessPoolExecutor(max_workers=len(ranges), mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(_tokenizeRange, path, start, end) for (start, end) in ranges]
+
+    blocks = []
+
+    try:
+        # Attach to the blocks of all workers that succeeded before raising the error of
+        # one that did not, so that every block gets unlinked
+        for future in futures:
+            if future.exception() is None:
+                blocks.append( (shared_memory.SharedMemory(name=future.result()[0]), future.result()[1]) )
+
+        for future in futures:
+            future.result()
+
+        results = [[numpy.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset) for (shape, dtype, offset) in descriptions] for (block, descriptions) in blocks]
+
+        # Concatenate straight from the shared memory, then let go of it
+        combined = tuple([numpy.concatenate([result[i] for result in results]) for i in range(4)])
+        del results
+
+    finally:
+        for (block, descriptions) in blocks:
+            block.close()
+            block.unlink()
+
+    return combined
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy
+
+from PyQt5.QtGui import QVector2D, QVector3D
+
+from .simpledebug import info
+from .shadercache import insertAfterVersion
+
+# Packing of vertex data into 16 bytes per vertex, rather than 32 bytes for eight
+# float32 values:
+#
+#   position: 3 x int16, spread over the bounding box of the mesh, plus 2 bytes of
+#             padding. Alternatively 3 x float16 (half floats) plus padding.
+#   normal:   2 x int16, octahedral encoding (see octahedralEncode())
+#   texCo:    2 x uint16, spread over the range of the texture coordinates
+#
+# QOpenGLShaderProgram.setAttributeBuffer() has no way of asking for normalized
+# attributes, so the shader gets the raw integer values as floats. Decoding them is
+# done in the vertex shader, with the functions in GLSL_DECODE and a per mesh scale
+# and bias for positions and texture coordinates (see PackedVertices.setDecodeUniforms()).
+
+# GL enums for the attribute types, as passed to setAttributeBuffer()
+GL_SHORT = 0x1402
+GL_UNSIGNED_SHORT = 0x1403
+GL_HALF_FLOAT = 0x140B
+
+_int16Max = 32767
+_uint16Max = 65535
+
+# Decoding functions for the vertex shader. Insert them after the #version line, for
+# example with addDecodeToShader(), and declare the packed attributes as vec4 (position),
+# vec2 (normal) and vec2 (texture coordinate). Both decodePosition() and decodeNormal()
+# give w = 1.0, like a vec4 attribute fed with three floats, so the decoded values can be
+# used exactly as the unpacked ones.
+GLSL_DECODE = """
+// Decoding of packed vertex data, see genericgl/quantize.py
+uniform vec3 positionScale = vec3(1.0, 1.0, 1.0);
+uniform vec3 positionBias = vec3(0.0, 0.0, 0.0);
+uniform vec2 texCoScale = vec2(1.0, 1.0);
+uniform vec2 texCoBias = vec2(0.0, 0.0);
+
+vec4 decodePosition(vec4 packedPosition) {
+  return vec4(packedPosition.xyz * positionScale + positionBias, 1.0);
+}
+
+vec4 decodeNormal(vec2 packedNormal) {
+  vec2 e = packedNormal / 32767.0;
+  vec3 n = vec3(e.xy, 1.0 - abs(e.x) - abs(e.y));
+  if (n.z < 0.0) {
+    vec2 signs = vec2(n.x >= 0.0 ? 1.0 : -1.0, n.y >= 0.0 ? 1.0 : -1.0);
+    n.xy = (1.0 - abs(n.yx)) * signs;
+  }
+  return vec4(normalize(n), 1.0);
+}
+
+vec2 decodeTexCo(vec2 packedTexCo) {
+  return packedTexCo * texCoScale + texCoBias;
+}
+"""
+
+def addDecodeToShader(source):
+
+    # Return the shader source with GLSL_DECODE inserted after the #version line (or at
+    # the start, if there is none)
+    return insertAfterVersion(source, GLSL_DECODE)
+
+
+def _signNotZero(values):
+    return numpy.where(values >= 0.0, 1.0, -1.0)
+
+
+def octahedralEncode(normals):
+
+    # Map unit vectors onto an octahedron, unfold it onto a square and store the two
+    # square coordinates as int16. This spreads the precision evenly over all directions.
+
+    normals = numpy.asarray(normals, dtype=float)
+
+    lengths = numpy.abs(normals).sum(axis=1)
+    lengths[lengths == 0] = 1.0
+
+    projected = normals[:,0:2] / lengths[:,None]
+
+    lowerHalf = normals[:,2] < 0
+    folded = (1.0 - numpy.abs(projected[:,::-1])) * _signNotZero(projected)
+    projected[lowerHalf] = folded[lowerHalf]
+
+    return numpy.round(numpy.clip(projected, -1.0, 1.0) * _int16Max).astype("<i2")
+
+
+def octahedralDecode(encoded):
+
+    # The inverse of octahedralEncode(), as done by decodeNormal() in GLSL_DECODE
+
+    e = numpy.asarray(encoded, dtype=float) / _int16Max
+
+    normals = numpy.empty( (len(e), 3), dtype=float )
+    normals[:,0:2] = e
+    normals[:,2] = 1.0 - numpy.abs(e[:,0]) - numpy.abs(e[:,1])
+
+    lowerHalf = normals[:,2] < 0
+    unfolded = (1.0 - numpy.abs(e[:,::-1])) * _signNotZero(e)
+    normals[lowerHalf,0:2] = unfolded[lowerHalf]
+
+    lengths = numpy.linalg.norm(normals, axis=1)
+    lengths[lengths == 0] = 1.0
+
+    return normals / lengths[:,None]
+
+
+def _rangeTransform(values, maxValue, centered):
+
+    # Scale and bias which spread the values over 0 .. maxValue (or -maxValue .. maxValue
+    # if centered), such that values = packed * scale + bias
+
+    lower = values.min(axis=0) if len(values) > 0 else numpy.zeros(values.shape[1])
+    upper = values.max(axis=0) if len(values) > 0 else numpy.ones(values.shape[1])
+
+    extent = upper - lower
+    extent[extent == 0] = 1.0
+
+    if centered:
+        return (extent / 2.0 / maxValue, (lower + upper) / 2.0)
+
+    return (extent / maxValue, lower)
+
+
+class PackedVertices():
+
+    def __init__(self, positions, normals, texCo, positionFormat = "int16"):
+
+        # positions, normals and texCo are arrays with one row per vertex, for example
+        # from a mesh file or a Wavefront's split vertex stream (see packWavefront()).
+        # positionFormat is "int16" or "half". Half float attributes need GL 3.0 or the
+        # ARB_half_float_vertex extension.
+
+        positions = numpy.asarray(positions, dtype=float)
+        normals = numpy.asarray(normals, dtype=float)
+        texCo = numpy.asarray(texCo, dtype=float)
+
+        if not positionFormat in ("int16", "half"):
+            raise ValueError("positionFormat must be \"int16\" or \"half\", not " + str(positionFormat))
+
+        self.positionFormat = positionFormat
+
+        positionType = "<i2"
+        if positionFormat == "half":
+            positionType = "<f2"
+
+        vertexType = numpy.dtype([ ("position", positionType, 4), ("normal", "<i2", 2), ("texCo", "<u2", 2) ])
+
+        self.vertexCount = len(positions)
+
+        # The packed vertices, which can be passed as they are to QOpenGLBuffer.allocate()
+        self.data = numpy.zeros(self.vertexCount, dtype=vertexType)
+
+        if positionFormat == "half":
+            self.positionScale = numpy.ones(3)
+            self.positionBias = numpy.zeros(3)
+            self.data["position"][:,0:3] = positions
+            self.positionType = GL_HALF_FLOAT
+        else:
+            (self.positionScale, self.positionBias) = _rangeTransform(positions, _int16Max, True)
+            self.data["position"][:,0:3] = numpy.round( (positions - self.positionBias) / self.positionScale )
+            self.positionType = GL_SHORT
+
+        self.data["normal"] = octahedralEncode(normals)
+        self.normalType = GL_SHORT
+
+        (self.texCoScale, self.texCoBias) = _rangeTransform(texCo, _uint16Max, False)
+        self.data["texCo"] = numpy.round( (texCo - self.texCoBias) / self.texCoScale )
+        self.textureType = GL_UNSIGNED_SHORT
+
+        # Size in bytes for each vertex specification, and where the different parts of it
+        # start. Same names as in MeshFile.
+        self.vertexStride = vertexType.itemsize
+        self.positionBytesOffset = vertexType.fields["position"][1]
+        self.normalBytesOffset = vertexType.fields["normal"][1]
+        self.textureBytesOffset = vertexType.fields["texCo"][1]
+
+        info("PACKED VERTICES", str(self.vertexCount) + " vertices, " + str(self.data.nbytes) + " bytes")
+
+    def setDecodeUniforms(self, program):
+
+        # Set the uniforms used by GLSL_DECODE on a bound QOpenGLShaderProgram
+
+        program.setUniformValue("positionScale", QVector3D(*self.positionScale))
+        program.setUniformValue("positionBias", QVector3D(*self.positionBias))
+        program.setUniformValue("texCoScale", QVector2D(*self.texCoScale))
+        program.setUniformValue("texCoBias", QVector2D(*self.texCoBias))
+
+    def unpack(self):
+
+        # Decode the packed data on the CPU, exactly like GLSL_DECODE does. Returns a tuple
+        # (positions, normals, texCo).
+
+        positions = self.data["position"][:,0:3].astype(float) * self.positionScale + self.positionBias
+        normals = octahedralDecode(self.data["normal"])
+        texCo = self.data["texCo"].astype(float) * self.texCoScale + self.texCoBias
+
+        return (positions, normals, texCo)
+
+
+def packWavefront(wavefront, positionFormat = "int16"):
+
+    # Pack the seam split vertex stream of a Wavefront object, ie the vertices indexed
+    # by splitFaces
+
+    splitVertexMap = wavefront.splitVertexMap
+
+    return PackedVertices(wavefront.vertexCoords[splitVertexMap], wavefront.vertexNormals[splitVertexMap], wavefront.splitTexCo, positionFormat)
+
+
+def packMeshFile(meshFile, positionFormat = "int16"):
+
+    # Pack the vertices of a MeshFile. The mesh file's indices (and chunks) apply as they are.
+
+    vertices = meshFile.vertices
+
+    return PackedVertices(vertices[:,0:3], vertices[:,3:6], vertices[:,6:8], positionFormat)
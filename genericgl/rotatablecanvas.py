@@ -8,6 +8,9 @@ from PyQt5.QtWidgets import *
 from PyQt5.QtGui import *
 from PyQt5.QtCore import *
 
+import math
+import numpy
+
 from .simpledebug import info
 from .canvas import Canvas
 
@@ -64,6 +67,63 @@ class RotatableCanvas(Canvas):
 
         self.lastPos = event.pos()
 
+    def rotationMatrix(self):
+
+        # The 3x3 rotation matrix applied to vertex positions by the test shaders, ie
+        # rz * ry * rx from vertex.glsl. Note that GLSL's mat4() is filled column by
+        # column, so the rz given there turns the object by minus zRot.
+
+        (ax, ay, az) = [math.radians(rotation / 16) for rotation in (self.xRot, self.yRot, self.zRot)]
+
+        rx = numpy.array([ [1.0, 0.0, 0.0], [0.0, math.cos(ax), -math.sin(ax)], [0.0, math.sin(ax), math.cos(ax)] ])
+        ry = numpy.array([ [math.cos(ay), 0.0, math.sin(ay)], [0.0, 1.0, 0.0], [-math.sin(ay), 0.0, math.cos(ay)] ])
+        rz = numpy.array([ [math.cos(az), math.sin(az), 0.0], [-math.sin(az), math.cos(az), 0.0], [0.0, 0.0, 1.0] ])
+
+        return rz @ ry @ rx
+
+    def currentViewportScale(self, globalScale = 1.0):
+
+        # The XYZW scaling which the tests pass as viewportScaling for the current widget
+        # size, so that the object keeps its proportions. globalScale is the W component.
+
+        width = max(self.width(), 1)
+        height = max(self.height(), 1)
+
+        scaleX = 1.0
+        scaleY = 1.0
+
+        if width > height:
+            scaleX = height / width
+        else:
+            scaleY = width / height
+
+        return (scaleX, scaleY, 1.0, globalScale)
+
+    def pickRay(self, x, y, globalScale = 1.0):
+
+        # Return a tuple (origin, direction) with the ray, in object coordinates, which goes
+        # through widget pixel (x, y), for example event.x() and event.y(). This follows the
+        # projection in the test shaders: the shorter side of the widget spans -1.0 to 1.0,
+        # globalScale is the W component of viewportScaling, and the view is orthographic
+        # looking along +Z (lower depth values are closer). Use with Bvh.firstHit().
+
+        width = max(self.width(), 1)
+        height = max(self.height(), 1)
+
+        (scaleX, scaleY, scaleZ, scaleW) = self.currentViewportScale(globalScale)
+
+        # Normalized device coordinates, and from there rotated object coordinates
+        ndcX = 2.0 * (x + 0.5) / width - 1.0
+        ndcY = 1.0 - 2.0 * (y + 0.5) / height
+
+        rotatedOrigin = numpy.array([ndcX * scaleW / scaleX, ndcY * scaleW / scaleY, -scaleW / scaleZ])
+        rotatedDirection = numpy.array([0.0, 0.0, 1.0])
+
+        # The rotation is orthonormal, so its transpose undoes it
+        rotation = self.rotationMatrix()
+
+        return (rotation.T @ rotatedOrigin, rotation.T @ rotatedDirection)
+
     def normalizeAngle(self, angle):
         while angle < 0:
             angle += 360 * 16
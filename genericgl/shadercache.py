@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import hashlib
+
+from PyQt5 import sip
+from PyQt5.QtGui import QOpenGLShader, QOpenGLShaderProgram
+
+from .simpledebug import info
+
+# A cache for linked shader programs. Programs are identified by a hash of their
+# sources and defines.
+#
+#   * Within a context, asking for the same program again returns the already
+#     linked one
+#   * Across runs, Qt keeps the program binaries on disk. Sources added with
+#     addCacheableShaderFromSourceCode() are only compiled when there is no binary
+#     for them (or the driver cannot load it), so a second start skips compiling
+#     altogether. This needs a driver with program binary support
+#     (GL_ARB_get_program_binary), and can be turned off with the application
+#     attribute Qt.AA_DisableShaderDiskCache.
+#
+# The time spent linking (which includes compiling, or loading the binary) is logged,
+# so that the saving is visible.
+
+# Linked programs, by the address of their context and then by key, see programKey()
+_programsByContext = dict()
+
+def programKey(vertexSource, fragmentSource, defines = None):
+
+    # A hash identifying a program made from the given sources and defines
+
+    digest = hashlib.sha1()
+
+    for source in (vertexSource, fragmentSource):
+        digest.update(source.encode("utf-8"))
+        digest.update(b"\0")
+
+    for (name, value) in _sortedDefines(defines):
+        digest.update((name + "=" + str(value)).encode("utf-8"))
+        digest.update(b"\0")
+
+    return digest.hexdigest()
+
+
+def _sortedDefines(defines):
+
+    # defines is None, a dict or a list of (name, value) tuples. Use None as value for a
+    # define without a value.
+
+    if defines is None:
+        return []
+
+    if isinstance(defines, dict):
+        defines = defines.items()
+
+    return sorted(defines, key=lambda define: define[0])
+
+
+def insertAfterVersion(source, text):
+
+    # Return the source with text inserted after the #version line (or at the start, if
+    # there is none), since #version must come first
+
+    lines = source.split("\n")
+
+    position = 0
+    while position < len(lines) and not lines[position].strip().startswith("#version"):
+        position = position + 1
+
+    if position == len(lines):
+        return text + "\n" + source
+
+    return "\n".join(lines[:position + 1] + [text] + lines[position + 1:])
+
+
+def addDefines(source, defines):
+
+    # Return the source with a #define line for each define, inserted after the #version
+    # line (or at the start, if there is none)
+
+    defines = _sortedDefines(defines)
+
+    if len(defines) == 0:
+        return source
+
+    defineLines = []
+    for (name, value) in defines:
+        if value is None:
+            defineLines.append("#define " + name)
+        else:
+            defineLines.append("#define " + name + " " + str(value))
+
+    return insertAfterVersion(source, "\n".join(defineLines))
+
+
+def _forgetContext(contextId):
+    _programsByContext.pop(contextId, None)
+
+
+def shaderProgram(context, vertexSource, fragmentSource, defines = None):
+
+    # Return a linked QOpenGLShaderProgram for the sources and defines, owned by the
+    # given (current) context. The same program is returned for the same sources and
+    # defines until the context is destroyed.
+
+    # The address of the C++ object, since the Python wrapper of a context may come and go
+    contextId = sip.unwrapinstance(context)
+    key = programKey(vertexSource, fragmentSource, defines)
+
+    if not contextId in _programsByContext:
+        _programsByContext[contextId] = dict()
+        context.aboutToBeDestroyed.connect(lambda: _forgetContext(contextId))
+
+    programs = _programsByContext[contextId]
+
+    if key in programs:
+        info("SHADER CACHE", "reusing program " + key[:12])
+        return programs[key]
+
+    program = QOpenGLShaderProgram(context)
+
+    # These only store the sources. Compiling (or loading a binary from the disk cache)
+    # happens when linking.
+    if not program.addCacheableShaderFromSourceCode(QOpenGLShader.Vertex, addDefines(vertexSource, defines)):
+        raise RuntimeError("Could not add the vertex shader: " + program.log())
+
+    if not program.addCacheableShaderFromSourceCode(QOpenGLShader.Fragment, addDefines(fragmentSource, defines)):
+        raise RuntimeError("Could not add the fragment shader: " + program.log())
+
+    startTime = time.perf_counter()
+
+    if not program.link():
+        raise RuntimeError("Could not link the shader program: " + program.log())
+
+    linkTime = time.perf_counter() - startTime
+
+    info("SHADER CACHE", "program " + key[:12] + " linked in " + str(round(linkTime * 1000.0, 2)) + " ms")
+
+    programs[key] = program
+
+    return program
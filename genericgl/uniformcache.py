@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from PyQt5.QtGui import QVector2D, QVector3D, QVector4D
+
+from .simpledebug import info
+
+# A wrapper around a QOpenGLShaderProgram which remembers the last value given to
+# each uniform and only calls setUniformValue() when the value changes. Uniform
+# locations are looked up once by name.
+#
+# Uniform values belong to the program, so all uniforms of a program should be set
+# through the same UniformCache. If the program is relinked, or its uniforms are set
+# some other way, call invalidate().
+
+# Qt vector types for uniforms given as two, three or four numbers
+_vectorTypes = { 2: QVector2D, 3: QVector3D, 4: QVector4D }
+
+class UniformCache():
+
+    def __init__(self, program):
+
+        self.program = program
+
+        # Locations by name, and the last value set by location
+        self._locations = dict()
+        self._values = dict()
+
+        # Number of setUniformValue() calls made and skipped since resetCounters()
+        self.issued = 0
+        self.skipped = 0
+
+    def location(self, name):
+
+        # The location of a uniform, looked up the first time it is asked for. Uniforms the
+        # shader does not use (or which the compiler removed) have location -1.
+
+        location = self._locations.get(name)
+
+        if location is None:
+            location = self.program.uniformLocation(name)
+            if location < 0:
+                info("UNIFORM CACHE", "the program has no uniform " + name)
+            self._locations[name] = location
+
+        return location
+
+    def set(self, name, *values):
+
+        # Set a uniform, if its value has changed. The program must be bound. Give either a
+        # single value (a number, or anything setUniformValue() takes, such as a QVector4D or
+        # a QMatrix4x4), or two to four numbers for a vec2, vec3 or vec4. In the latter case no
+        # Qt vector is created unless the value has changed. Returns True if GL was called.
+
+        location = self.location(name)
+
+        if location < 0:
+            return False
+
+        if len(values) == 1:
+            value = values[0]
+        else:
+            value = tuple(values)
+
+        if location in self._values and self._values[location] == value:
+            self.skipped = self.skipped + 1
+            return False
+
+        if isinstance(value, tuple):
+            self.program.setUniformValue(location, _vectorTypes[len(value)](*value))
+        else:
+            self.program.setUniformValue(location, value)
+
+            # Keep a copy of Qt value types, since the caller may change the original in place
+            if not isinstance(value, (int, float)):
+                value = type(value)(value)
+
+        self._values[location] = value
+        self.issued = self.issued + 1
+
+        return True
+
+    def invalidate(self):
+
+        # Forget the remembered values, so that all uniforms are set again
+        self._values.clear()
+
+    def resetCounters(self):
+        self.issued = 0
+        self.skipped = 0
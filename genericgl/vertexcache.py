@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy
+
+# Helpers for reordering a triangle mesh for better use of the GPU's post-transform
+# vertex cache. When a vertex index was used recently, the GPU can reuse the
+# output of the vertex shader rather than running it again. How well this works
+# depends on the order of the triangles, which for exported meshes is usually
+# far from ideal.
+#
+# Triangles are reordered with the "Tipsify" algorithm (Sander, Nehab and Barczak,
+# "Fast Triangle Reordering for Vertex Locality and Reduced Overdraw", 2007), which
+# runs in linear time. Vertices are then reordered in the order they are first used,
+# so that vertex fetches walk through memory in order.
+#
+# The result is measured as:
+#
+#   ACMR: Average cache miss ratio, ie transformed vertices per triangle. Between 0.5
+#         (ideal, for large meshes) and 3.0 (no reuse at all).
+#   ATVR: Average transform to vertex ratio, ie transformed vertices per vertex. The
+#         ideal is 1.0.
+
+def _vertexTriangleAdjacency(faces, numberOfVertices):
+
+    # CSR form lists of the triangles using each vertex
+
+    flatFaces = faces.ravel()
+
+    triangles = numpy.argsort(flatFaces, kind="stable") // 3
+
+    offsets = numpy.zeros(numberOfVertices + 1, dtype=int)
+    numpy.cumsum(numpy.bincount(flatFaces, minlength=numberOfVertices), out=offsets[1:])
+
+    return (offsets, triangles)
+
+
+def tipsify(faces, numberOfVertices, cacheSize = 16):
+
+    # Return an array with the triangle indices of faces, in the order they should be drawn
+
+    (offsets, adjacentTriangles) = _vertexTriangleAdjacency(faces, numberOfVertices)
+
+    # Plain python lists are much faster than numpy arrays for element by element access
+    offsets = offsets.tolist()
+    adjacentTriangles = adjacentTriangles.tolist()
+    triangleVertices = faces.tolist()
+
+    liveTriangles = numpy.diff(offsets).tolist() if len(offsets) > 1 else []
+    cacheTimeStamps = [0] * numberOfVertices
+    emitted = [False] * len(triangleVertices)
+    deadEndStack = []
+
+    output = []
+
+    fanningVertex = 0
+    timeStamp = cacheSize + 1
+    cursor = 0
+
+    # Skip leading unused vertices
+    while fanningVertex < numberOfVertices and liveTriangles[fanningVertex] == 0:
+        fanningVertex = fanningVertex + 1
+
+    if fanningVertex >= numberOfVertices:
+        return numpy.zeros(0, dtype=int)
+
+    while fanningVertex >= 0:
+
+        candidates = []
+
+        # Emit all remaining triangles around the fanning vertex
+        for triangle in adjacentTriangles[offsets[fanningVertex]:offsets[fanningVertex + 1]]:
+            if emitted[triangle]:
+                continue
+
+            output.append(triangle)
+
+            for vertex in triangleVertices[triangle]:
+                deadEndStack.append(vertex)
+                candidates.append(vertex)
+                liveTriangles[vertex] = liveTriangles[vertex] - 1
+
+                # Vertex is not in the cache, so it is transformed and put in it
+                if timeStamp - cacheTimeStamps[vertex] > cacheSize:
+                    cacheTimeStamps[vertex] = timeStamp
+                    timeStamp = timeStamp + 1
+
+            emitted[triangle] = True
+
+        # Pick the next fanning vertex among the vertices just used. Prefer vertices which
+        # will still be in the cache after their remaining triangles have been emitted, and
+        # of those the ones that entered the cache the earliest.
+        nextVertex = -1
+        bestPriority = -1
+
+        for vertex in candidates:
+            if liveTriangles[vertex] > 0:
+                priority = 0
+                if timeStamp - cacheTimeStamps[vertex] + 2 * liveTriangles[vertex] <= cacheSize:
+                    priority = timeStamp - cacheTimeStamps[vertex]
+                if priority > bestPriority:
+                    bestPriority = priority
+                    nextVertex = vertex
+
+        # No candidate had any triangles left. Walk back through recently used vertices,
+        # and fall back to scanning the mesh in input order.
+        if nextVertex == -1:
+            while len(deadEndStack) > 0:
+                vertex = deadEndStack.pop()
+                if liveTriangles[vertex] > 0:
+                    nextVertex = vertex
+                    break
+
+        if nextVertex == -1:
+            while cursor < numberOfVertices:
+                if liveTriangles[cursor] > 0:
+                    nextVertex = cursor
+                    break
+                cursor = cursor + 1
+
+        fanningVertex = nextVertex
+
+    return numpy.array(output, dtype=int)
+
+
+def firstUseVertexOrder(faces, numberOfVertices):
+
+    # Return a tuple with an array listing the old vertex index for each new vertex, and
+    # an array listing the new index for each old vertex, such that vertices are numbered
+    # in the order faces first use them. Unused vertices are placed last, in their
+    # original order.
+
+    (usedVertices, firstUse) = numpy.unique(faces.ravel(), return_index=True)
+
+    isUsed = numpy.zeros(numberOfVertices, dtype=bool)
+    isUsed[usedVertices] = True
+
+    newToOld = numpy.concatenate( (usedVertices[numpy.argsort(firstUse)], numpy.flatnonzero(~isUsed)) )
+
+    oldToNew = numpy.empty(numberOfVertices, dtype=int)
+    oldToNew[newToOld] = numpy.arange(numberOfVertices)
+
+    return (newToOld, oldToNew)
+
+
+def cacheStatistics(faces, numberOfVertices, cacheSize = 32):
+
+    # Simulate a FIFO post-transform cache of the given size, and return a tuple with
+    # the ACMR and the ATVR of drawing the faces in the given order.
+
+    numberOfFaces = len(faces)
+
+    if numberOfFaces == 0:
+        return (0.0, 0.0)
+
+    # A vertex is in the cache if fewer than cacheSize other vertices have been
+    # transformed since it was
+    transformedAt = [-cacheSize - 1] * numberOfVertices
+    transformed = 0
+
+    for vertex in faces.ravel().tolist():
+        if transformed - transformedAt[vertex] > cacheSize:
+            transformedAt[vertex] = transformed
+            transformed = transformed + 1
+
+    usedVertices = len(numpy.unique(faces))
+
+    return (transformed / numberOfFaces, transformed / usedVertices)
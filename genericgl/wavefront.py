@@ -3,12 +3,48 @@
 
 import os
 import json
-import math
+import hashlib
+import zipfile
 import numpy
 
+from .simpledebug import info
+from .objtokenizer import tokenizeObj, tokenizeObjParallel
+from .vertexcache import tipsify, firstUseVertexOrder, cacheStatistics
+from .meshcodec import readCompressedMesh, COMPRESSED_MESH_EXTENSION
+
+# Bump this whenever the contents or meaning of the arrays written to the
+# mesh cache change, so that old cache files are never read
+CACHE_FORMAT_VERSION = 3
+
+# The attributes that make up the interleaved vertex buffers, with their widths. 
+_attributeWidths = { "coords": 3, "normals": 3, "texco": 2 }
+
+# Interleaved vertex buffer layouts. The "split" layouts contain one row per 
+# split vertex rather than one row per vertex.
+_interleavedLayouts = {
+    "VN": ( ("coords", "normals"), False ),
+    "VNT": ( ("coords", "normals", "texco"), False ),
+    "SPLIT_VNT": ( ("coords", "normals", "texco"), True )
+}
+
+# The largest number of vertices which can be drawn with 16-bit indices. Index 65535
+# is left unused, since it doubles as the primitive restart index.
+MAX_SHORT_INDEX_VERTICES = 65535
+
+def indexTypeFor(numberOfVertices):
+
+    # The smallest numpy index type which can address the given number of vertices. Use
+    # GL_UNSIGNED_SHORT or GL_UNSIGNED_INT with glDrawElements() to match its itemsize.
+
+    if numberOfVertices <= MAX_SHORT_INDEX_VERTICES:
+        return numpy.dtype("<u2")
+
+    return numpy.dtype("<u4")
+
+
 class Wavefront():
 
-    def __init__(self, path, triangulateQuads = True):
+    def __init__(self, path, triangulateQuads = True, useCache = False, cacheDir = None, parser = "stream", optimizeForVertexCache = False):
 
         # These are the arrays we're going to produce, and which might 
         # make sense to manipulate from the outside:
@@ -17,24 +53,76 @@ class Wavefront():
         self.vertexNormals = None # Normal (in XYZ form) for each vertex
         self.faces = None         # Faces, specified by listing indexes for participating vertices
 
+        # Vertices that are used with several texture coordinates (ie on UV seams) need
+        # to be split into one vertex per texture coordinate before they can be drawn.
+        # These arrays describe the mesh after such a split:
+
+        self.splitVertexMap = None # For each split vertex, the index of the vertex it was split from
+        self.splitTexCo = None     # Texture coordinates for each split vertex
+        self.splitFaces = None     # Faces, specified by listing indexes for split vertices
+
         # These are internal work arrays
 
         self._rawVertices = []
         self._rawTexCo = []        
-        self._rawVertexTexCo = [];
         self._rawFaces = []
-        self._vertexBelongsToFaces = None
+        self._rawFaceCorners = []  # Vertex indices per face, as listed in the file. Tris are padded with -1.
+        self._rawFaceTexCo = []    # Texture coordinate indices per face corner, -1 if missing
+        self._vertexFaceOffsets = None # Vertex/face incidence, see _buildVertexFaceIncidence()
+        self._vertexFaceIndices = None
         self._faceVertCache = None
 
+        self.degenerateFaces = None # Indices of faces with zero area, see recalculateFaceNormals()
+
+        # If the mesh has been reordered by optimizeVertexCache(), this lists the vertex index
+        # in the obj file for each vertex, and vertexCacheStatistics has the ACMR and ATVR
+        # before and after.
+        self.originalVertexIndices = None
+        self.vertexCacheStatistics = None
+
+        # Preallocated float32 interleaved vertex buffers, with the attributes that need to
+        # be refreshed in each of them. See _getInterleavedBuffer() and markDirty()
+        self._interleavedBuffers = dict()
+
         self.triangulateQuads = triangulateQuads
+        self.optimizeForVertexCache = optimizeForVertexCache
+
+        # parser can be:
+        #   stream: Read the file line by line, splitting each line in python
+        #   bulk:     Read the whole file at once and convert it with array operations. This
+        #             needs the whole file in memory while parsing. Loading a 2 MB obj takes
+        #             about three quarters of the time of the stream parser, and small files
+        #             gain next to nothing, so it is not worth it for most meshes.
+        #   parallel: Like bulk, but split the file into pieces which are parsed in a pool
+        #             of processes. For very large files on machines with several cores.
+        #             The processes are spawned, see tokenizeObjParallel().
+        #
+        # All produce identical arrays.
+        if not parser in ("stream", "bulk", "parallel"):
+            raise ValueError("Unknown parser " + str(parser))
+
+        self.parser = parser
 
         if not os.path.exists(path):
             raise IOError(path + " does not exist")
 
-        self.content = []
+        # Compressed mesh files (see meshcodec.py) already contain finished arrays, so they
+        # are neither parsed nor cached
+        if path.endswith(COMPRESSED_MESH_EXTENSION):
+            self._readCompressed(path)
+            return
 
-        with open(path,'r') as file:
-            self.content = file.readlines()
+        # If useCache is set, the produced arrays are written to a binary cache file
+        # after the first load, and read from there as long as the obj file and the
+        # options are unchanged. By default, the cache file is placed next to the obj file.
+        self._cachePath = None
+        self._cacheKey = None
+
+        if useCache:
+            self._cachePath = self._findCachePath(path, cacheDir)
+            self._cacheKey = self._createCacheKey(path)
+            if self._readCache():
+                return
 
         # self._mode can be:
         #   ONLYTRIS:    The incoming mesh only contains tris (so no need to do anything)
@@ -43,22 +131,25 @@ class Wavefront():
 
         self._mode = None
 
-        # Check if mesh contains quads and/or tris
-        self._scanForMode()
+        # Make a single sweep over the file, collecting vertices, texture coordinates and
+        # faces as we go. This also records which kinds of faces the mesh contains.
+        if self.parser == "bulk":
+            self._parseBulk(path)
+        elif self.parser == "parallel":
+            self._parseParallel(path)
+        else:
+            self._parseStream(path)
 
-        # Make a sweep for vertices as faces need that information
-        self._extractVertices()
+        # Check if mesh contains quads and/or tris
+        self._decideMode()
 
-        # Make a sweep for texture coordinates, as faces need that too
-        self._extractTextureCoordinates()
+        # create numpy arrays to contain vertices and vertex normals
+        self._createVerticesNumpyArray()
 
-        # Make a sweep for faces
+        # Turn the parsed faces into tris and find texture coordinates for vertices
         self._extractFaces()
 
-        # TODO: Find texture coordinates for vertices
-
-        # create numpy arrays to contain vertices, faces and normals
-        self._createVerticesNumpyArray()
+        # create numpy arrays to contain faces and face normals
         self._createFacesNumpyArray()
 
         # These two operations need to be redone if vertex coordinates
@@ -66,22 +157,260 @@ class Wavefront():
         self.recalculateFaceNormals()
         self.recalculateVertexNormals()
 
-    def _scanForMode(self):
+        if optimizeForVertexCache:
+            self.optimizeVertexCache()
+
+        if useCache:
+            self._writeCache()
+
+    def _readCompressed(self, path):
+
+        arrays = readCompressedMesh(path)
+
+        self.vertexCoords = arrays["vertexCoords"]
+        self.splitVertexMap = arrays["splitVertexMap"]
+        self.splitTexCo = arrays["splitTexCo"]
+        self.splitFaces = arrays["splitFaces"]
+        self.hasTexCo = arrays["hasTexCo"]
+
+        if "originalVertexIndices" in arrays:
+            self.originalVertexIndices = arrays["originalVertexIndices"]
+
+        self.faces = self.splitVertexMap[self.splitFaces]
+
+        # Vertices on UV seams have several texture coordinates, and only one of them is kept
+        # here. Use the split arrays for drawing textured meshes.
+        self.vertexTexCo = numpy.zeros( (len(self.vertexCoords), 2), dtype=float )
+        self.vertexTexCo[self.splitVertexMap] = self.splitTexCo
+
+        self.vertexNormals = numpy.zeros( (len(self.vertexCoords), 3), dtype=float )
+        self.faceNormals = numpy.zeros( (len(self.faces), 3), dtype=float )
+
+        self.recalculateFaceNormals()
+        self.recalculateVertexNormals()
+
+        info("COMPRESSED MESH", "loaded " + path)
+
+    def _findCachePath(self, path, cacheDir):
+
+        # The same obj file may be loaded with different options (for example with and
+        # without vertex cache optimization), so keep one cache file per combination of
+        # options rather than having them overwrite each other
+        options = "tris"
+        if not self.triangulateQuads:
+            options = "quads"
+        if self.optimizeForVertexCache:
+            options = options + "-vcache"
+
+        if cacheDir is None:
+            return path + "." + options + ".cache.npz"
+
+        # Several obj files with the same name may share a cache dir, so include a
+        # hash of the full path in the name
+        absolutePath = os.path.abspath(path)
+        pathHash = hashlib.sha1(absolutePath.encode("utf-8")).hexdigest()[:16]
+
+        return os.path.join(cacheDir, os.path.basename(path) + "." + pathHash + "." + options + ".cache.npz")
+
+    def _createCacheKey(self, path):
+
+        # Everything that affects the produced arrays. If any of these differ from what is
+        # stored in the cache file, the cache is stale.
+
+        stat = os.stat(path)
+
+        key = dict()
+        key["formatVersion"] = CACHE_FORMAT_VERSION
+        key["path"] = os.path.abspath(path)
+        key["mtime"] = stat.st_mtime_ns
+        key["size"] = stat.st_size
+        key["triangulateQuads"] = bool(self.triangulateQuads)
+        key["optimizeForVertexCache"] = bool(self.optimizeForVertexCache)
+
+        return json.dumps(key, sort_keys=True)
+
+    def _readCache(self):
+
+        if not os.path.exists(self._cachePath):
+            return False
+
+        try:
+            with numpy.load(self._cachePath, allow_pickle=False) as cache:
+                if str(cache["cacheKey"]) != self._cacheKey:
+                    info("WAVEFRONT CACHE", "stale, ignoring " + self._cachePath)
+                    return False
+
+                self.vertexCoords = cache["vertexCoords"]
+                self.vertexNormals = cache["vertexNormals"]
+                self.vertexTexCo = cache["vertexTexCo"]
+                self.faces = cache["faces"]
+                self.faceNormals = cache["faceNormals"]
+                self.degenerateFaces = cache["degenerateFaces"]
+                self.hasTexCo = bool(cache["hasTexCo"])
+                self.splitVertexMap = cache["splitVertexMap"]
+                self.splitTexCo = cache["splitTexCo"]
+                self.splitFaces = cache["splitFaces"]
+
+                if "originalVertexIndices" in cache.files:
+                    self.originalVertexIndices = cache["originalVertexIndices"]
+                    self.vertexCacheStatistics = json.loads(str(cache["vertexCacheStatistics"]))
+
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            info("WAVEFRONT CACHE", "unable to read " + self._cachePath + " (" + str(e) + ")")
+            return False
+
+        info("WAVEFRONT CACHE", "loaded " + self._cachePath)
+        return True
+
+    def _writeCache(self):
+
+        # Write to a temporary file and move it in place, so that an interrupted write
+        # never leaves a half written cache file behind
+        temporaryPath = self._cachePath + ".tmp"
+
+        # Only meshes that have been optimized for the vertex cache have these
+        optimization = dict()
+        if not self.originalVertexIndices is None:
+            optimization["originalVertexIndices"] = self.originalVertexIndices
+            optimization["vertexCacheStatistics"] = numpy.array(json.dumps(self.vertexCacheStatistics))
+
+        try:
+            with open(temporaryPath, "wb") as file:
+                numpy.savez(file,
+                            cacheKey = numpy.array(self._cacheKey),
+                            vertexCoords = self.vertexCoords,
+                            vertexNormals = self.vertexNormals,
+                            vertexTexCo = self.vertexTexCo,
+                            faces = self.faces,
+                            faceNormals = self.faceNormals,
+                            degenerateFaces = self.degenerateFaces,
+                            hasTexCo = numpy.array(self.hasTexCo),
+                            splitVertexMap = self.splitVertexMap,
+                            splitTexCo = self.splitTexCo,
+                            splitFaces = self.splitFaces,
+                            **optimization)
+            os.replace(temporaryPath, self._cachePath)
+        except OSError as e:
+            info("WAVEFRONT CACHE", "unable to write " + self._cachePath + " (" + str(e) + ")")
+            return
+
+        info("WAVEFRONT CACHE", "wrote " + self._cachePath)
+
+    def _parseStream(self, path):
+
+        # Read the file one line at a time, so the full text never has to be kept in memory,
+        # and sort each line into the work array it belongs to.
 
-        containsTris = False
-        containsQuads = False
+        self.hasTexCo = False
 
-        for line in self.content:
-            strippedLine = line.strip()
-            if not strippedLine is None and not strippedLine == "" and not strippedLine[0] == "#":
-                parts = strippedLine.split(' ')
-                if len(parts) > 4:
-                    containsQuads = True
-                if len(parts) == 4:
-                    containsTris = True
-                if len(parts) > 5:
-                    raise ValueError("Found a face with more than four vertices. N-gons are not supported.")
-                # TODO: Check for n-gons?
+        self._containsTris = False
+        self._containsQuads = False
+
+        with open(path,'r') as file:
+            for line in file:
+
+                # Drop comments, also those at the end of a line
+                if "#" in line:
+                    line = line[:line.index("#")]
+
+                parts = line.split()
+                if len(parts) < 2:
+                    continue
+
+                command = parts[0]
+
+                if command == "v":
+                    x = float(parts[1])
+                    y = float(parts[2])
+                    z = float(parts[3])
+                    vertex = [x, y, z]
+                    self._rawVertices.append(vertex)
+                    continue
+
+                if command == "vt":
+                    x = float(parts[1])
+                    y = float(parts[2])
+                    texco = [x, y]
+                    self._rawTexCo.append(texco)
+                    continue
+
+                if command == "f":
+
+                    numberOfCorners = len(parts) - 1
+
+                    if numberOfCorners > 4:
+                        raise ValueError("Found a face with more than four vertices. N-gons are not supported.")
+                    if numberOfCorners < 3:
+                        raise ValueError("Found a face with less than three vertices")
+
+                    if numberOfCorners == 4:
+                        self._containsQuads = True
+                    else:
+                        self._containsTris = True
+
+                    # Face info is vertIdx / texCoIdx / faceNormalIdx  OR  vertIdx / texCoIdx  OR  vertIdx
+                    #
+                    # Note "-1" since wavefront indexes start at 1 rather than 0. Texture coordinate
+                    # indices are stored as -1 when the corner has none (for example when there is no
+                    # UV unwrap). Texture coordinates may be listed after the faces using them, so they
+                    # are resolved once the whole file has been read.
+
+                    vertexIndices = []
+                    texCoIndices = []
+
+                    for corner in parts[1:]:
+                        f = corner.split('/')
+                        vertexIndices.append(int(f[0]) - 1)
+                        if len(f) > 1 and f[1] != "":
+                            texCoIndices.append(int(f[1]) - 1)
+                        else:
+                            texCoIndices.append(-1)
+
+                    # Pad tris so that all faces can be stored in a (N, 4) array later
+                    if numberOfCorners == 3:
+                        vertexIndices.append(-1)
+                        texCoIndices.append(-1)
+
+                    self._rawFaceCorners.append(vertexIndices)
+                    self._rawFaceTexCo.append(texCoIndices)
+
+
+    def _parseBulk(self, path):
+
+        # Read the whole file and let the bulk tokenizer sort out vertices, texture
+        # coordinates and faces
+
+        self.hasTexCo = False
+
+        with open(path,'rb') as file:
+            data = file.read()
+
+        self._useTokenizedArrays(tokenizeObj(data))
+
+
+    def _parseParallel(self, path):
+
+        # Let a pool of processes tokenize parts of the file, see tokenizeObjParallel()
+
+        self.hasTexCo = False
+
+        self._useTokenizedArrays(tokenizeObjParallel(path))
+
+
+    def _useTokenizedArrays(self, arrays):
+
+        (self._rawVertices, self._rawTexCo, self._rawFaceCorners, self._rawFaceTexCo) = arrays
+
+        isQuad = self._rawFaceCorners[:,3] > -1
+
+        self._containsQuads = bool(isQuad.any())
+        self._containsTris = bool((~isQuad).any())
+
+
+    def _decideMode(self):
+
+        containsTris = self._containsTris
+        containsQuads = self._containsQuads
 
         if containsQuads:
             if self.triangulateQuads:
@@ -103,124 +432,116 @@ class Wavefront():
         print("Tris " + str(containsTris))
         print("Quads " + str(containsQuads))
         print(self._mode)
-    
 
-    def _extractVertices(self):
-        for line in self.content:
-            strippedLine = line.strip()
-            if not strippedLine is None and not strippedLine == "" and not strippedLine[0] == "#":
-                parts = strippedLine.split(' ')
-                if len(parts) > 1:
-                    command = parts[0]
-                    if command == "v":
-                        x = float(parts[1])
-                        y = float(parts[2])
-                        z = float(parts[3])
-                        vertex = [x, y, z]
-                        self._rawVertices.append(vertex)
-                        self._rawVertexTexCo.append([0,0])
 
+    def _distancesBetweenVerticesByIdx(self, idx1, idx2):
 
-    def _extractTextureCoordinates(self):
+        # Takes two index arrays and returns an array with the distances between the
+        # vertices at idx1 and the vertices at idx2
 
-        self.hasTexCo = False
+        difference = self.vertexCoords[idx2] - self.vertexCoords[idx1]
+
+        x = difference[:,0]
+        y = difference[:,1]
+        z = difference[:,2]
 
-        for line in self.content:
-            strippedLine = line.strip()
-            if not strippedLine is None and not strippedLine == "" and not strippedLine[0] == "#":
-                parts = strippedLine.split(' ')
-                if len(parts) > 1:
-                    command = parts[0]
-                    if command == "vt":
-                        x = float(parts[1])
-                        y = float(parts[2])
-                        texco = [x, y]
-                        self._rawTexCo.append(texco)
+        return numpy.sqrt( x*x + y*y + z*z )
 
 
-    def _distanceBetweenVerticesByIdx(self, idx1, idx2):
+    def _triangulate(self, corners):
 
-        vert1 = numpy.array(self._rawVertices[idx1])
-        vert2 = numpy.array(self._rawVertices[idx2])    
+        # Takes a (N, 4) array with the vertex indices of the parsed faces, where tris have
+        # -1 as their fourth index, and decides which tris to produce. Returns a tuple with
+        # the index of the parsed face each tri comes from, and a (numTris, 3) array with 
+        # which corners (0-3) of that face make up the tri.
+        #
+        # Quads are split into two tris using the shortest diagonal. All quads are handled
+        # at once, rather than face by face.
 
-        difference = vert2 - vert1
+        isQuad = corners[:,3] > -1
 
-        x = difference[0]
-        y = difference[1]
-        z = difference[2]
+        # The first row is the tri for a tri face. The second row is unused for tris.
+        cornerPatterns = numpy.zeros( (len(corners), 2, 3), dtype=int )
+        cornerPatterns[:] = [[0, 1, 2], [0, 0, 0]]
 
-        distance = math.sqrt( x*x + y*y + z*z )
-        return distance
+        quads = corners[isQuad]
+
+        distance13 = self._distancesBetweenVerticesByIdx(quads[:,0], quads[:,2])
+        distance24 = self._distancesBetweenVerticesByIdx(quads[:,1], quads[:,3])
+
+        splitAlong24 = numpy.array( [[0, 1, 3], [2, 3, 1]], dtype=int )
+        splitAlong13 = numpy.array( [[0, 2, 3], [1, 2, 0]], dtype=int )
+
+        cornerPatterns[isQuad] = numpy.where( (distance13 > distance24)[:,None,None], splitAlong24, splitAlong13 )
+
+        # Keep one tri per tri face, and two per quad, in the order the faces were listed
+        keep = numpy.ones( (len(corners), 2), dtype=bool )
+        keep[:,1] = isQuad
+
+        faceIndices = numpy.repeat( numpy.arange(len(corners)), keep.sum(axis=1) )
+
+        return (faceIndices, cornerPatterns[keep])
 
 
     def _extractFaces(self):
 
-        # Note that wavefront lists starts at 1, not 0
-
-        for line in self.content:
-            strippedLine = line.strip()
-            if not strippedLine is None and not strippedLine == "" and not strippedLine[0] == "#":
-                parts = strippedLine.split(' ')
-                if len(parts) > 1:
-                    command = parts[0]
-                    if command == "f":
-
-                        # Face info is vertIdx / texCoIdx / faceNormalIdx  OR  vertIdx / texCoIdx  OR  vertIdx
-
-                        vInfo1 = parts[1].split('/')
-                        vInfo2 = parts[2].split('/')
-                        vInfo3 = parts[3].split('/')
-
-                        # Find indexes of vertices making up the face. Note "-1" since wavefront indexes start
-                        # at 1 rather than 0
-                        vidx1 = int(vInfo1[0]) - 1
-                        vidx2 = int(vInfo2[0]) - 1
-                        vidx3 = int(vInfo3[0]) - 1
-                        
-                        if len(parts) == 4:
-                            if self._mode == "ONLYQUADS":
-                                raise ValueError("Found tri although mode was ONLYQUADS")
-                            face = [vidx1, vidx2, vidx3]
-                            self._rawFaces.append(face)
-                        else:
-                            vInfo4 = parts[4].split('/')
-                            vidx4 = int(vInfo4[0]) - 1
-                            if self._mode == "ONLYTRIS":
-                                raise ValueError("Found quad although mode was ONLYTRIS")
-                            if self._mode == "ONLYQUADS":
-                                raise ValueError("ONLYQUADS mode not implemented yet")
-
-                            # Perform triangulation by splitting quad into two tris, using the shortest diagonal
-                            distance13 = self._distanceBetweenVerticesByIdx(vidx1, vidx3)
-                            distance24 = self._distanceBetweenVerticesByIdx(vidx2, vidx4)
-
-                            if distance13 > distance24:
-                                face = [vidx1, vidx2, vidx4]
-                                self._rawFaces.append(face)
-                                face = [vidx3, vidx4, vidx2]
-                                self._rawFaces.append(face)
-                            else:
-                                face = [vidx1, vidx3, vidx4]
-                                self._rawFaces.append(face)
-                                face = [vidx2, vidx3, vidx1]
-                                self._rawFaces.append(face)
-
-                        i = 1
-                        while i < len(parts):
-
-                            f = parts[i].split('/')
-
-                            if len(f) > 1:
-                                vidx = int(f[0]) - 1 # Vertex index
-
-                                ti = f[1] # May be empty if no UV unwrap
-                                if ti != "":
-                                    tidx = int(ti) - 1 # Texture coordinate index
-                                    texco = self._rawTexCo[tidx] # Actual texture coordinats, x/y
-                                    self._rawVertexTexCo[vidx] = texco
-                                    self.hasTexCo = True
-
-                            i = i + 1
+        # Turn the faces collected by _parseStream() into tris and assign texture coordinates
+        # to vertices
+
+        corners = numpy.array( self._rawFaceCorners, dtype=int ).reshape(-1, 4)
+        texCoIndices = numpy.array( self._rawFaceTexCo, dtype=int ).reshape(-1, 4)
+
+        (faceIndices, cornerIndices) = self._triangulate(corners)
+        self._rawFaces = corners[faceIndices[:,None], cornerIndices]
+        self._rawFaceTexCo = texCoIndices[faceIndices[:,None], cornerIndices]
+
+        # Find the texture coordinates for vertices. Corners are visited in the order they
+        # were listed in the file, so if a vertex is used with several texture coordinates,
+        # the last one wins.
+        hasTexCo = (corners > -1) & (texCoIndices > -1)
+
+        rawTexCo = numpy.array( self._rawTexCo, dtype=float ).reshape(-1, 2)
+
+        if hasTexCo.any():
+            self.vertexTexCo[corners[hasTexCo]] = rawTexCo[texCoIndices[hasTexCo]]
+            self.hasTexCo = True
+
+        self._splitSeams(rawTexCo)
+
+        # The parsed faces are not needed anymore
+        self._rawFaceCorners = []
+        self._rawFaceTexCo = []
+
+
+    def _splitSeams(self, rawTexCo):
+
+        # Find all unique (vertex, texture coordinate) pairs used by face corners. Each such
+        # pair becomes a split vertex. Vertices which are always used with the same texture
+        # coordinate thus end up as a single split vertex, while vertices on UV seams are
+        # split into one vertex per texture coordinate.
+        #
+        # The pairs are encoded as a single integer per corner, so that numpy.unique() can
+        # do all the work. Since the pairs are sorted, split vertices come in the same order
+        # as the vertices they were split from.
+
+        faceVertices = self._rawFaces.ravel()
+        faceTexCo = self._rawFaceTexCo.ravel()
+
+        # Corners without texture coordinates have texco index -1, so shift by one
+        texCoSlots = len(rawTexCo) + 1
+
+        pairs = faceVertices * texCoSlots + (faceTexCo + 1)
+
+        (uniquePairs, splitFaces) = numpy.unique(pairs, return_inverse=True)
+
+        self.splitVertexMap = uniquePairs // texCoSlots
+        self.splitFaces = splitFaces.reshape(-1, 3)
+
+        splitTexCoIndices = uniquePairs % texCoSlots - 1
+
+        self.splitTexCo = numpy.zeros( (len(uniquePairs), 2), dtype=float )
+        hasTexCo = splitTexCoIndices > -1
+        self.splitTexCo[hasTexCo] = rawTexCo[splitTexCoIndices[hasTexCo]]
 
 
     def _createFacesNumpyArray(self, assumeQuads = False):
@@ -247,85 +568,154 @@ class Wavefront():
 
         numberOfVertices = len(self._rawVertices)
 
-        if numberOfVertices != len(self._rawVertexTexCo):
-            raise ValueError("Not same number of elements in texco array")
-
         # Convert raw coords from wavefront into a 2d numpy array
-        self.vertexCoords = numpy.array( self._rawVertices, dtype=float )
+        self.vertexCoords = numpy.array( self._rawVertices, dtype=float ).reshape(-1, 3)
 
         # Create a two-dimensional float array with shape (numVerts/3) and 
         # fill it with zeros. This will contain vertex normals.
         self.vertexNormals = numpy.zeros( (numberOfVertices, 3), dtype=float )
 
         # Create a two-dimensional float array with shape (numVerts/2) and 
-        # fill it with texture coordinates. 
-        self.vertexTexCo = numpy.array( self._rawVertexTexCo, dtype=float )
+        # fill it with zeros. This will contain texture coordinates. 
+        self.vertexTexCo = numpy.zeros( (numberOfVertices, 2), dtype=float )
 
     
 
 
+    def _buildVertexFaceIncidence(self):
+
+        # Build a sparse vertex/face incidence matrix in CSR form. The faces which a vertex
+        # belongs to are listed in self._vertexFaceIndices, in the slice starting at
+        # self._vertexFaceOffsets[vertex] and ending at self._vertexFaceOffsets[vertex + 1].
+        #
+        # A stable sort keeps the faces of each vertex in ascending order.
+
+        numberOfVertices = len(self.vertexCoords)
+        vertsPerFace = self.faces.shape[1]
+
+        flatFaces = self.faces.ravel()
+
+        self._vertexFaceIndices = numpy.argsort(flatFaces, kind="stable") // vertsPerFace
+
+        facesPerVertex = numpy.bincount(flatFaces, minlength=numberOfVertices)
+
+        self._vertexFaceOffsets = numpy.zeros(numberOfVertices + 1, dtype=int)
+        numpy.cumsum(facesPerVertex, out=self._vertexFaceOffsets[1:])
+
+
     def recalculateVertexNormals(self, assumeQuads = False):
 
         # Build a cache where we, per vertex, list which faces are relevant
         # for it. We need this in order to calculate the vertex normal later,
         # as an average of the face normals surrounding it
-        if self._vertexBelongsToFaces is None:
-
-            self._vertexBelongsToFaces = []
-
-            numberOfFaces = len(self.faces)
-            numberOfVertices = len(self.vertexCoords)
-
-            vertsPerFace = 3
-            if assumeQuads:
-                vertsPerFace = 4
-
-            currentVert = 0
-            while currentVert < numberOfVertices:
-                self._vertexBelongsToFaces.append([])
-                currentVert = currentVert + 1 
-
-            currentFace = 0
-            while currentFace < numberOfFaces:
-                fv = self.faces[currentFace]
-                currentVert = 0
-                while currentVert < vertsPerFace:
-                    vertexIndex = fv[currentVert]
-                    self._vertexBelongsToFaces[vertexIndex].append(currentFace)
-                    currentVert = currentVert + 1
-                currentFace = currentFace + 1
-        
+        if self._vertexFaceOffsets is None:
+            self._buildVertexFaceIncidence()
+
+        offsets = self._vertexFaceOffsets
+        facesPerVertex = numpy.diff(offsets)
+
+        unusedVertices = numpy.flatnonzero(facesPerVertex < 1)
+        if len(unusedVertices) > 0:
+            raise ValueError("Found a vertex (" + str(unusedVertices[0]) + ") which did not belong to any face")
+
         # Calculate vertex normals as an average of the surrounding face
         # normals. 
-        currentVert = 0
+        (self.vertexNormals[:], zeroNormals) = self._averageFaceNormals(self._vertexFaceIndices, offsets[:-1], facesPerVertex)
+
+        self.markDirty( ("normals",) )
 
-        zeroNormal = numpy.array([0.0, 0.0, 0.0], dtype=float)
+        return zeroNormals
 
-        while currentVert < numberOfVertices:
-            faces = self._vertexBelongsToFaces[currentVert]
-            numberOfFaces = len(faces)
-            currentNormal = numpy.array([0,0,0], dtype=float)
-            currentFace = 0
-            firstNormal = None
-            while currentFace < numberOfFaces:
-                fidx = faces[currentFace]
-                fnormal = self.faceNormals[fidx]
-                if firstNormal is None:
-                    firstNormal = fnormal
-                currentNormal = currentNormal + fnormal
-                currentFace = currentFace + 1
-            if numberOfFaces < 1:
-                raise ValueError("Found a vertex (" + str(currentVert) + ") which did not belong to any face")
 
-            averageNormal = currentNormal / numberOfFaces
+    def _averageFaceNormals(self, faceIndices, segmentStarts, facesPerVertex):
 
-            if numpy.array_equal(averageNormal, zeroNormal):
-                print("WARNING: found zero vertex normal for vertex " + str(currentVert))
-                averageNormal = firstNormal
+        # Takes the faces of a number of vertices, listed one vertex after the other in 
+        # faceIndices (with the list for each vertex starting at segmentStarts), and returns
+        # the normalized average of the face normals for each vertex. The face normals are
+        # gathered in that order and summed per vertex in one go.
 
-            self.vertexNormals[currentVert] = self._unitVector(averageNormal)
+        summedNormals = numpy.add.reduceat(self.faceNormals[faceIndices], segmentStarts, axis=0)
+        averageNormals = summedNormals / facesPerVertex[:,None]
 
-            currentVert = currentVert + 1
+        # If the surrounding normals cancel each other out, fall back to the normal
+        # of the first face the vertex belongs to
+        zeroNormals = numpy.flatnonzero(~averageNormals.any(axis=1))
+        firstFaces = faceIndices[segmentStarts[zeroNormals]]
+        averageNormals[zeroNormals] = self.faceNormals[firstFaces]
+
+        # Vertices which still lack a normal (only touching degenerate faces) are left with
+        # a zero normal, and are returned to the caller
+        return self._unitVectors(averageNormals)
+
+
+    def _gatherVertexFaces(self, vertices):
+
+        # Look up the faces of the given vertices in the vertex/face incidence matrix. Returns
+        # a tuple with the face indices (one vertex after the other), where the list for each
+        # vertex starts, and the number of faces for each vertex.
+
+        starts = self._vertexFaceOffsets[vertices]
+        facesPerVertex = self._vertexFaceOffsets[vertices + 1] - starts
+
+        segmentStarts = numpy.cumsum(facesPerVertex) - facesPerVertex
+
+        positions = numpy.arange(facesPerVertex.sum()) + numpy.repeat(starts - segmentStarts, facesPerVertex)
+
+        return (self._vertexFaceIndices[positions], segmentStarts, facesPerVertex)
+
+
+    def updateVertexCoords(self, indices, coords):
+
+        # Move a subset of the vertices and recalculate normals only where needed: the
+        # face normals of faces touching the moved vertices, and the vertex normals of 
+        # all vertices in those faces. This is much cheaper than calling 
+        # recalculateFaceNormals() and recalculateVertexNormals() when only a small 
+        # part of the mesh changes.
+        #
+        # Returns a sorted array with the indices of all vertices whose coordinates or 
+        # normals changed, so that the caller can update only those on the GPU.
+
+        indices = numpy.asarray(indices, dtype=int)
+
+        self.vertexCoords[indices] = coords
+
+        if self._vertexFaceOffsets is None:
+            self._buildVertexFaceIncidence()
+
+        # Marking in boolean masks, rather than using numpy.unique(), avoids sorting
+        (faceIndices, segmentStarts, facesPerVertex) = self._gatherVertexFaces(indices)
+
+        isDirtyFace = numpy.zeros(len(self.faces), dtype=bool)
+        isDirtyFace[faceIndices] = True
+        dirtyFaces = numpy.flatnonzero(isDirtyFace)
+
+        # Face normals for the touched faces
+        faceVertCoords = self.vertexCoords[self.faces[dirtyFaces]]
+        if not self._faceVertCache is None:
+            self._faceVertCache[dirtyFaces] = faceVertCoords
+
+        U = faceVertCoords[:,1] - faceVertCoords[:,0]
+        V = faceVertCoords[:,2] - faceVertCoords[:,0]
+
+        (self.faceNormals[dirtyFaces], degenerateFaces) = self._unitVectors(numpy.cross(U,V))
+
+        if not self.degenerateFaces is None:
+            self.degenerateFaces = numpy.union1d(numpy.setdiff1d(self.degenerateFaces, dirtyFaces), dirtyFaces[degenerateFaces])
+
+        # Vertex normals for all vertices in the touched faces
+        isDirtyVertex = numpy.zeros(len(self.vertexCoords), dtype=bool)
+        isDirtyVertex[self.faces[dirtyFaces]] = True
+        dirtyVertices = numpy.flatnonzero(isDirtyVertex)
+
+        (faceIndices, segmentStarts, facesPerVertex) = self._gatherVertexFaces(dirtyVertices)
+        (self.vertexNormals[dirtyVertices], zeroNormals) = self._averageFaceNormals(faceIndices, segmentStarts, facesPerVertex)
+
+        isDirtyVertex[indices] = True
+        dirtyVertices = numpy.flatnonzero(isDirtyVertex)
+
+        self.markDirty( ("coords", "normals"), dirtyVertices )
+
+        return dirtyVertices
 
 
     def recalculateFaceNormals(self):
@@ -335,38 +725,37 @@ class Wavefront():
         # Calculate the face normal from the first three vertices. This might produce 
         # strange results if using quads. In that case we should probably triangulate and
         # and weight together the face normals of the resulting two tris. 
-        numberOfFaces = len(self.faces)
+        #
+        # All faces are handled at once as whole-array operations on the face vertex cache.
 
-        currentFace = 0
-        while currentFace < numberOfFaces:
+        U = self._faceVertCache[:,1] - self._faceVertCache[:,0]
+        V = self._faceVertCache[:,2] - self._faceVertCache[:,0]
 
-            U = self._faceVertCache[currentFace][1] - self._faceVertCache[currentFace][0]
-            V = self._faceVertCache[currentFace][2] - self._faceVertCache[currentFace][0]
+        cross = numpy.cross(U,V)
 
-            cross = numpy.cross(U,V)
-            N = self._unitVector(cross)
+        # Faces with zero area (for example faces where two vertices share the same
+        # location) do not have a normal. These are given a zero normal and are
+        # reported in self.degenerateFaces, rather than stopping at the first one.
+        (self.faceNormals[:], self.degenerateFaces) = self._unitVectors(cross)
 
-            self.faceNormals[currentFace] = N
-            currentFace = currentFace + 1
+        # Face normals are recalculated because vertex coordinates changed
+        self.markDirty( ("coords",) )
 
+        return self.degenerateFaces
 
-    def _unitVector(self, normal):
 
-        # There is probably a numpy version of doing this calculation 
+    def _unitVectors(self, normals):
 
-        x = normal[0] * normal[0]
-        y = normal[1] * normal[1]
-        z = normal[2] * normal[2]
+        # Takes an array with shape (n, 3) and returns a tuple with the normalized vectors
+        # and an index array listing the rows which had zero magnitude. The latter are
+        # returned as zero vectors.
 
-        magnitude = math.sqrt(x + y + z)
+        magnitudes = numpy.sqrt(normals[:,0] * normals[:,0] + normals[:,1] * normals[:,1] + normals[:,2] * normals[:,2])
 
-        if magnitude == 0.0:
-            print("\nINVALID MAGNITUDE:\n")
-            print("Normal was: " + str(normal))
-            raise ValueError("Invalid magnitude")
-            sys.exit(1)
+        zeroMagnitude = numpy.flatnonzero(magnitudes == 0.0)
+        magnitudes[zeroMagnitude] = 1.0
 
-        return normal / magnitude
+        return (normals / magnitudes[:,None], zeroMagnitude)
 
 
     def _copyVertCoordsToCache(self, assumeQuads = False):
@@ -385,14 +774,9 @@ class Wavefront():
         if self._faceVertCache is None:
             self._faceVertCache = numpy.zeros( (numberOfFaces, vertsPerFace, 3), dtype=float )
 
-        currentFace = 0
-        while currentFace < numberOfFaces:
-            currentVertex = 0
-            while currentVertex < vertsPerFace:
-                vertexIndex = self.faces[currentFace][currentVertex]
-                self._faceVertCache[currentFace][currentVertex] = self.vertexCoords[vertexIndex]
-                currentVertex = currentVertex + 1
-            currentFace = currentFace + 1
+        # Gather the coordinates of all face corners with a single fancy indexing operation,
+        # writing straight into the existing cache
+        numpy.take(self.vertexCoords, self.faces, axis=0, out=self._faceVertCache)
 
 
     def getVertexArray(self):
@@ -403,19 +787,271 @@ class Wavefront():
         return self.vertexNormals
 
 
+    def optimizeVertexCache(self, cacheSize = 16):
+
+        # Reorder the mesh for better use of the GPU's post-transform vertex cache, see
+        # vertexcache.py. Triangles are reordered for the split vertex stream (since that is 
+        # what gets drawn), and both vertices and split vertices are then renumbered in the
+        # order they are first used. All per vertex and per face arrays are remapped.
+        #
+        # Note that this changes vertex indices. originalVertexIndices lists the obj file
+        # index of each vertex, for example for remapping morph targets.
+        #
+        # Returns a dict with ACMR and ATVR before and after, for a FIFO cache of 32 entries.
+
+        numberOfSplitVertices = len(self.splitVertexMap)
+
+        (acmrBefore, atvrBefore) = cacheStatistics(self.splitFaces, numberOfSplitVertices)
+
+        # Reorder triangles
+        triangleOrder = tipsify(self.splitFaces, numberOfSplitVertices, cacheSize)
+
+        self.faces = self.faces[triangleOrder]
+        self.splitFaces = self.splitFaces[triangleOrder]
+        self.faceNormals = self.faceNormals[triangleOrder]
+
+        oldToNewFace = numpy.empty(len(triangleOrder), dtype=int)
+        oldToNewFace[triangleOrder] = numpy.arange(len(triangleOrder))
+        if not self.degenerateFaces is None:
+            self.degenerateFaces = numpy.sort(oldToNewFace[self.degenerateFaces])
+
+        # Renumber split vertices in the order they are first used
+        (newToOld, oldToNew) = firstUseVertexOrder(self.splitFaces, numberOfSplitVertices)
+
+        self.splitFaces = oldToNew[self.splitFaces]
+        self.splitVertexMap = self.splitVertexMap[newToOld]
+        self.splitTexCo = self.splitTexCo[newToOld]
+
+        # Renumber vertices in the order they are first used
+        (newToOld, oldToNew) = firstUseVertexOrder(self.faces, len(self.vertexCoords))
+
+        self.faces = oldToNew[self.faces]
+        self.splitVertexMap = oldToNew[self.splitVertexMap]
+        self.vertexCoords = self.vertexCoords[newToOld]
+        self.vertexNormals = self.vertexNormals[newToOld]
+        self.vertexTexCo = self.vertexTexCo[newToOld]
+
+        if self.originalVertexIndices is None:
+            self.originalVertexIndices = newToOld
+        else:
+            self.originalVertexIndices = self.originalVertexIndices[newToOld]
+
+        # Caches which refer to the old order
+        self._vertexFaceOffsets = None
+        self._vertexFaceIndices = None
+        self._faceVertCache = None
+        self._interleavedBuffers = dict()
+
+        (acmrAfter, atvrAfter) = cacheStatistics(self.splitFaces, numberOfSplitVertices)
+
+        self.vertexCacheStatistics = dict()
+        self.vertexCacheStatistics["acmrBefore"] = acmrBefore
+        self.vertexCacheStatistics["atvrBefore"] = atvrBefore
+        self.vertexCacheStatistics["acmrAfter"] = acmrAfter
+        self.vertexCacheStatistics["atvrAfter"] = atvrAfter
+
+        info("VERTEX CACHE ACMR", str(round(acmrBefore, 3)) + " -> " + str(round(acmrAfter, 3)))
+        info("VERTEX CACHE ATVR", str(round(atvrBefore, 3)) + " -> " + str(round(atvrAfter, 3)))
+
+        return self.vertexCacheStatistics
+
+
+    def markDirty(self, attributes = ("coords", "normals", "texco"), vertices = None):
+
+        # Tell the interleaved vertex buffers that attributes ("coords", "normals" and/or 
+        # "texco") have changed, either for all vertices or only for the vertices listed in
+        # vertices. The buffers are refreshed the next time they are asked for.
+        #
+        # recalculateFaceNormals(), recalculateVertexNormals() and updateVertexCoords() call
+        # this, so it is only needed when changing for example vertexTexCo directly.
+
+        for layout in self._interleavedBuffers:
+            (buffer, dirty) = self._interleavedBuffers[layout]
+            (layoutAttributes, split) = _interleavedLayouts[layout]
+
+            rows = None
+            if not vertices is None:
+                if split:
+                    isDirtyVertex = numpy.zeros(len(self.vertexCoords), dtype=bool)
+                    isDirtyVertex[vertices] = True
+                    rows = numpy.flatnonzero(isDirtyVertex[self.splitVertexMap])
+                else:
+                    rows = numpy.asarray(vertices, dtype=int)
+
+            for attribute in attributes:
+                if not attribute in layoutAttributes:
+                    continue
+                if attribute in dirty:
+                    # Already dirty for all rows, or merge with the rows already dirty
+                    if dirty[attribute] is None or rows is None:
+                        dirty[attribute] = None
+                    else:
+                        dirty[attribute] = numpy.union1d(dirty[attribute], rows)
+                else:
+                    dirty[attribute] = rows
+
+
+    def _getAttributeArray(self, attribute, split, rows):
+
+        # Return the values of an attribute, for the given rows (or all rows if rows is None) 
+        # of an interleaved buffer
+
+        if attribute == "texco":
+            source = self.splitTexCo if split else self.vertexTexCo
+            return source if rows is None else source[rows]
+
+        source = self.vertexCoords if attribute == "coords" else self.vertexNormals
+
+        if split:
+            return source[self.splitVertexMap if rows is None else self.splitVertexMap[rows]]
+
+        return source if rows is None else source[rows]
+
+
+    def _getInterleavedBuffer(self, layout):
+
+        # Return a preallocated float32 buffer with the attributes of the layout interleaved,
+        # one row per vertex. The buffer is created on the first call. After that only the
+        # attributes (and rows) marked as dirty are copied into it, so asking for the buffer
+        # again when nothing has changed costs nothing.
+
+        (attributes, split) = _interleavedLayouts[layout]
+
+        if not layout in self._interleavedBuffers:
+            numberOfRows = len(self.splitVertexMap) if split else len(self.vertexCoords)
+            width = sum([_attributeWidths[attribute] for attribute in attributes])
+
+            buffer = numpy.empty( (numberOfRows, width), dtype=numpy.float32 )
+            dirty = dict.fromkeys(attributes)
+
+            self._interleavedBuffers[layout] = (buffer, dirty)
+
+        (buffer, dirty) = self._interleavedBuffers[layout]
+
+        column = 0
+        for attribute in attributes:
+            width = _attributeWidths[attribute]
+            if attribute in dirty:
+                rows = dirty[attribute]
+                values = self._getAttributeArray(attribute, split, rows)
+                if rows is None:
+                    buffer[:, column:column + width] = values
+                else:
+                    buffer[rows, column:column + width] = values
+            column = column + width
+
+        dirty.clear()
+
+        return buffer
+
+
     def getVertexAndNormalArray(self):
-        # This should possibly be cached
-        return numpy.hstack( (self.vertexCoords, self.vertexNormals) )
+        # Returns a cached float32 array with the shape [ [XYZNNN] [XYZNNN] ... ]. The same
+        # array is updated in place when coordinates or normals change.
+        return self._getInterleavedBuffer("VN")
 
     def getVertexAndNormalAndTexCoArray(self):
-        # This should possibly be cached
-        return numpy.hstack( (self.vertexCoords, self.vertexNormals, self.vertexTexCo) )
+        # Returns a cached float32 array with the shape [ [XYZNNNTT] [XYZNNNTT] ... ]. The same
+        # array is updated in place when coordinates, normals or texture coordinates change.
+        return self._getInterleavedBuffer("VNT")
 
 
     def getFaceArray(self):
         return self.faces
 
 
+    def getSplitVertexAndNormalAndTexCoArray(self):
+        # Same as getVertexAndNormalAndTexCoArray(), but for split vertices. Positions and normals
+        # are looked up from the vertices they were split from, so changes to vertexCoords (and 
+        # recalculated normals) carry over.
+        return self._getInterleavedBuffer("SPLIT_VNT")
+
+
+    def getSplitFaceArray(self):
+        return self.splitFaces
+
+
+    def getIndexArray(self, split = True):
+
+        # Flat array of face indices (of split vertices if split is True), using the
+        # smallest index type possible, see indexTypeFor()
+
+        if split:
+            return self.splitFaces.ravel().astype(indexTypeFor(len(self.splitVertexMap)))
+
+        return self.faces.ravel().astype(indexTypeFor(len(self.vertexCoords)))
+
+
+    def getIndexChunks(self, maxVertices = MAX_SHORT_INDEX_VERTICES, split = True):
+
+        # Split the faces into chunks which use at most maxVertices vertices each, so that
+        # large meshes can be drawn with 16-bit indices (for example on GLES 2, where 32-bit
+        # indices are an optional extension). Faces are taken in order, so a mesh which has
+        # been optimized for the vertex cache gives spatially coherent chunks.
+        #
+        # Returns a list of (vertexMap, indices) tuples. vertexMap lists the vertex (or split
+        # vertex) for each vertex in the chunk, so the chunk's vertex data is for example
+        # getSplitVertexAndNormalAndTexCoArray()[vertexMap]. indices is a flat array of
+        # indices into the chunk's vertices. Vertices used by several chunks are repeated.
+        #
+        # A mesh which is small enough gives a single chunk with the vertices in their
+        # original order.
+
+        faces = self.faces
+        numberOfVertices = len(self.vertexCoords)
+
+        if split:
+            faces = self.splitFaces
+            numberOfVertices = len(self.splitVertexMap)
+
+        if maxVertices < 3:
+            raise ValueError("A chunk needs room for at least three vertices")
+
+        if numberOfVertices <= maxVertices:
+            return [ (numpy.arange(numberOfVertices), faces.ravel().astype(indexTypeFor(numberOfVertices))) ]
+
+        indexType = indexTypeFor(maxVertices)
+
+        chunks = []
+        localIndex = numpy.empty(numberOfVertices, dtype=int)
+
+        # How many faces to look at when searching for the end of a chunk. Closed meshes have
+        # about twice as many faces as vertices, so this usually suffices. Otherwise it grows.
+        windowSize = 3 * maxVertices
+
+        start = 0
+        while start < len(faces):
+
+            # Count the distinct vertices used by the faces from start and on, and cut the
+            # chunk at the last face that does not take the count over maxVertices
+            flatFaces = faces[start:start + windowSize].ravel()
+
+            (vertices, firstUse) = numpy.unique(flatFaces, return_index=True)
+
+            isFirstUse = numpy.zeros(len(flatFaces), dtype=bool)
+            isFirstUse[firstUse] = True
+
+            distinctAfterFace = numpy.cumsum(isFirstUse)[2::3]
+            numberOfFaces = numpy.searchsorted(distinctAfterFace, maxVertices, side="right")
+
+            if numberOfFaces == len(distinctAfterFace) and start + numberOfFaces < len(faces):
+                windowSize = windowSize * 2
+                continue
+
+            # Vertices of the chunk, in the order they are first used
+            firstUse = numpy.sort(firstUse)
+            vertexMap = flatFaces[firstUse[firstUse < numberOfFaces * 3]]
+
+            localIndex[vertexMap] = numpy.arange(len(vertexMap))
+            indices = localIndex[flatFaces[:numberOfFaces * 3]].astype(indexType)
+
+            chunks.append( (vertexMap, indices) )
+
+            start = start + numberOfFaces
+
+        return chunks
+
+
     def debugVertices(self):
 
         vertices = self.getVertexAndNormalArray()